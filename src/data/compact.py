@@ -0,0 +1,11 @@
+"""One-off migration of an existing database: python -m src.data.compact
+
+Compresses chat contents stored before compression existed, reclaims the freed space
+and rebuilds the full-text index. Best run while PIPKA is stopped.
+"""
+from src.data.database import compact_database
+
+
+if __name__ == "__main__":
+    compressed, size_before, size_after = compact_database()
+    print(f"Compressed {compressed} chats, database {size_before / 1024 ** 2:.1f} MB -> {size_after / 1024 ** 2:.1f} MB")
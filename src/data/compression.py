@@ -0,0 +1,45 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Smaller contents stay plain text - compressing them saves little and costs a decode on every read
+COMPRESS_THRESHOLD = 4096
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+# First byte of a compressed blob names the codec, so both can be read whatever is installed now
+_ZLIB = b'z'
+_ZSTD = b's'
+
+
+def compress_text(text):
+    data = text.encode('utf-8')
+    if zstandard is not None:
+        return _ZSTD + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return _ZLIB + zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress_text(blob):
+    blob = bytes(blob)
+    codec, data = blob[:1], blob[1:]
+    if codec == _ZLIB:
+        return zlib.decompress(data).decode('utf-8')
+    if codec == _ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Chat stored with zstd, install it: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    raise ValueError(f"Unknown compression codec {codec!r}")
+
+
+def pack_text(text):
+    """(plain text, None) for small contents, (None, compressed blob) for large ones."""
+    if text is None or len(text) < COMPRESS_THRESHOLD:
+        return text, None
+    return None, compress_text(text)
+
+
+def unpack_text(text, blob):
+    return decompress_text(blob) if blob is not None else text
@@ -14,13 +14,14 @@ class Conversation:
         return json.dumps(self.to_dict())
 
 class Chat:
-    def __init__(self, conversation_id, role, content):
+    def __init__(self, conversation_id, role, content, id=None):
         self.conversation_id = conversation_id
         self.role = role
         self.content = content
+        self.id = id
 
     def to_dict(self):
-        return {"conversation_id": self.conversation_id, "role": self.role, "content": self.content}
+        return {"id": self.id, "conversation_id": self.conversation_id, "role": self.role, "content": self.content}
 
     def to_json(self):
         return json.dumps(self.to_dict())
@@ -0,0 +1,119 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 500
+# How long the writer waits for more writes before committing what it has
+MAX_DELAY = 0.05
+# Back-off between attempts while the database cannot be reached
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30
+
+
+class WriteBehind:
+    """Runs queued writes on one background thread, many of them per transaction.
+
+    Writes are functions taking a cursor and run in the order they were submitted. Writes submitted
+    with the same key replace each other while waiting, so only the newest one runs. While the database
+    cannot be reached the batch is kept and tried again, and a writer thread that died is started again.
+    """
+
+    def __init__(self, backend_factory):
+        self._backend_factory = backend_factory
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, write, *args, key=None):
+        self._start()
+        self._queue.put((write, args, key))
+
+    def flush(self, timeout=10):
+        """Wait until everything submitted so far is committed."""
+        if self._thread is None or threading.current_thread() is self._thread:
+            return True
+        self._start()
+        done = threading.Event()
+        self._queue.put((None, (done,), None))
+        return done.wait(timeout)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                if self._thread is None:
+                    atexit.register(self.flush)
+                else:
+                    logger.error("Database writer thread died, starting it again")
+                self._thread = threading.Thread(target=self._run, name="pipka-db-writer", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < MAX_BATCH:
+            try:
+                batch.append(self._queue.get(timeout=MAX_DELAY))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            writes, markers = [], []
+            for write, args, key in batch:
+                if write is None:
+                    markers.extend(args)
+                    continue
+                writes.append((write, args, key))
+            # Keep only the newest of the writes sharing a key
+            latest = {key: i for i, (_, _, key) in enumerate(writes) if key is not None}
+            writes = [item for i, item in enumerate(writes) if item[2] is None or latest[item[2]] == i]
+            delay = RETRY_DELAY
+            while writes:
+                try:
+                    self._commit(writes)
+                except Exception as e:
+                    logger.error(f"Database unavailable, retrying {len(writes)} writes in {delay:g} s: {e}")
+                    time.sleep(delay)
+                    delay = min(delay * 2, MAX_RETRY_DELAY)
+            for done in markers:
+                done.set()
+
+    def _commit(self, writes):
+        """Run writes, removing each from the list once it is committed or given up on.
+
+        Raises when the database cannot be reached, leaving the rest of the writes to be tried again.
+        """
+        backend = self._backend_factory()
+        connection = backend.connect()
+        try:
+            try:
+                cursor = connection.cursor()
+                for write, args, _ in writes:
+                    write(cursor, *args)
+                connection.commit()
+                writes.clear()
+                return
+            except Exception as e:
+                # Fails in turn when the connection is gone
+                connection.rollback()
+                logger.warning(f"Batched write failed, retrying one by one: {e}")
+            # One bad write must not take the rest of the batch with it
+            while writes:
+                write, args, _ = writes[0]
+                try:
+                    write(connection.cursor(), *args)
+                    connection.commit()
+                except Exception as e:
+                    connection.rollback()
+                    logger.error(f"Write {write.__name__} failed: {e}")
+                writes.pop(0)
+        finally:
+            try:
+                backend.release(connection)
+            except Exception as e:
+                logger.warning(f"Failed to release a database connection: {e}")
@@ -0,0 +1,261 @@
+# admission.py
+import os
+import json
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from src.utils.router import models, services
+
+logger = logging.getLogger(__name__)
+
+# Lower goes first: a waiting chat turn is let through before the reasoning chain, image generation and background work
+PRIORITY_CHAT = 0
+PRIORITY_REASONING = 1
+PRIORITY_IMAGE = 2
+PRIORITY_BACKGROUND = 3
+# A request waiting longer than this gives up
+QUEUE_TIMEOUT = int(os.environ.get("PIPKA_QUEUE_TIMEOUT", "600"))
+# A bucket holds this many seconds' worth of its per-minute limit, so bursts stay under the quota
+BURST_SECONDS = 10
+CHARS_PER_TOKEN = 4
+# Waiters look again at least this often, buckets refill without anybody leaving the queue
+RECHECK_SECONDS = 1.0
+ASYNC_RECHECK_SECONDS = 0.1
+
+
+class AdmissionTimeout(Exception):
+    pass
+
+
+# (user id, priority, on_wait) of the code calling AWS; set by the job, page or request that calls
+_context = ContextVar('pipka_admission', default=(None, PRIORITY_CHAT, None))
+# Services admit_async has let the caller through to, for the one request it then makes
+_admitted = ContextVar('pipka_admitted', default=frozenset())
+_cond = threading.Condition()
+_seq = itertools.count()
+# service -> _Service, or None when it has no limits
+_services = {}
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount):
+        """Seconds until amount is available; 0 when it is now."""
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= amount
+
+
+class _Service:
+    """Buckets of one service and its queue, fair between users within a priority."""
+
+    def __init__(self, limits):
+        self.requests = TokenBucket(limits['requests_per_minute']) if limits.get('requests_per_minute') else None
+        self.tokens = TokenBucket(limits['tokens_per_minute']) if limits.get('tokens_per_minute') else None
+        self.waiting = []  # (priority, tag, seq, user id, tokens)
+        # Start-time fair queuing: every request of a user is tagged after that user's previous one,
+        # so a user with many queued requests does not hold back the others
+        self.virtual_time = 0.0
+        self.last_tag = {}
+
+    def wait_time(self, tokens):
+        return max(self.requests.wait_time(1) if self.requests else 0.0,
+                   self.tokens.wait_time(tokens) if self.tokens and tokens else 0.0)
+
+    def take(self, tokens):
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens and tokens:
+            self.tokens.take(tokens)
+
+
+def _service_id(service):
+    # LiteLLM names and cross-region profiles, e.g. bedrock/us.amazon.nova-lite-v1:0, are limited as their model
+    service = service.split('/', 1)[-1]
+    return service[3:] if service[:3] in ('us.', 'eu.') else service
+
+
+def _service(service):
+    if service not in _services:
+        settings = models().get(service) or services().get(service) or {}
+        limits = settings.get('limits') or {}
+        _services[service] = _Service(limits) if limits.get('requests_per_minute') or limits.get('tokens_per_minute') else None
+    return _services[service]
+
+
+def estimate_tokens(messages, max_tokens=0):
+    """Rough input plus output tokens of a chat request, for the tokens-per-minute bucket."""
+    return len(json.dumps(messages, default=str)) // CHARS_PER_TOKEN + (max_tokens or 0)
+
+
+def admit_completion(model, params):
+    """admit() for a LiteLLM completion request, see router.routed_completions."""
+    return admit(model, estimate_tokens(params.get('messages'), params.get('max_tokens')))
+
+
+@contextmanager
+def admission_context(user_id, priority=PRIORITY_CHAT, on_wait=None):
+    """AWS calls made inside are queued for user_id at priority; on_wait(place) hears the place in the queue, 0 once admitted."""
+    token = _context.set((user_id, priority, on_wait))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def _enqueue(service, tokens, user_id, priority):
+    """Queue one request; (state, ticket) or None when service has no limits."""
+    state = _service(_service_id(service))
+    if state is None:
+        return None
+    if state.tokens:
+        tokens = min(tokens, state.tokens.capacity)
+    tag = max(state.virtual_time, state.last_tag.get(user_id, 0.0)) + 1
+    state.last_tag[user_id] = tag
+    return state, (priority, tag, next(_seq), user_id, tokens)
+
+
+def _try_take(state, ticket):
+    """(place in the queue, seconds to wait); the capacity is taken when the wait is 0."""
+    _, tag, _, _, tokens = ticket
+    place = sorted(state.waiting).index(ticket) + 1
+    wait = state.wait_time(tokens) if place == 1 else RECHECK_SECONDS
+    if wait <= 0:
+        state.take(tokens)
+        state.virtual_time = max(state.virtual_time, tag)
+        # Users with nothing left in the queue start again from the current virtual time
+        state.last_tag = {user: last for user, last in state.last_tag.items() if last > state.virtual_time}
+    return place, wait
+
+
+def _arguments(user_id, priority, on_wait):
+    context_user, context_priority, context_on_wait = _context.get()
+    return user_id or context_user, context_priority if priority is None else priority, on_wait or context_on_wait
+
+
+def _pre_admitted(service):
+    """True, once, when admit_async let the caller through to service already."""
+    admitted = _admitted.get()
+    if _service_id(service) not in admitted:
+        return False
+    _admitted.set(admitted - {_service_id(service)})
+    return True
+
+
+def _log_wait(service, user_id, started):
+    waited = time.monotonic() - started
+    if waited > RECHECK_SECONDS:
+        logger.info(f"{service} request of {user_id} waited {waited:.1f} s")
+    return waited
+
+
+def admit(service, tokens=0, user_id=None, priority=None, on_wait=None):
+    """Block until service has capacity for one request of about tokens tokens and it is this request's turn.
+
+    service is a models.json model id (LiteLLM names work too) or a service from its "services";
+    services without limits are admitted at once. Arguments left out come from admission_context.
+    Returns the seconds spent waiting; raises AdmissionTimeout after QUEUE_TIMEOUT.
+    Holds its thread while it waits - on an event loop use admit_async or admitted instead.
+    """
+    if _pre_admitted(service):
+        return 0.0
+    user_id, priority, on_wait = _arguments(user_id, priority, on_wait)
+    started = time.monotonic()
+    with _cond:
+        queued = _enqueue(service, tokens, user_id, priority)
+        if queued is None:
+            return 0.0
+        state, ticket = queued
+        state.waiting.append(ticket)
+    reported = None
+    try:
+        while True:
+            with _cond:
+                place, wait = _try_take(state, ticket)
+                if wait <= 0:
+                    break
+                if time.monotonic() - started > QUEUE_TIMEOUT:
+                    raise AdmissionTimeout(f"{service} is busy, gave up after waiting {QUEUE_TIMEOUT} s in the queue.")
+                if place == reported or on_wait is None:
+                    _cond.wait(min(wait, RECHECK_SECONDS))
+                    continue
+            # Outside the lock, the callback may write to a page or a database
+            reported = place
+            on_wait(place)
+    finally:
+        with _cond:
+            state.waiting.remove(ticket)
+            _cond.notify_all()
+    if reported is not None:
+        on_wait(0)
+    return _log_wait(service, user_id, started)
+
+
+async def admit_async(service, tokens=0, user_id=None, priority=None, on_wait=None):
+    """admit() for coroutines: waits in the same queue with asyncio.sleep, holding neither the event loop nor a thread."""
+    if _pre_admitted(service):
+        return 0.0
+    user_id, priority, on_wait = _arguments(user_id, priority, on_wait)
+    started = time.monotonic()
+    with _cond:
+        queued = _enqueue(service, tokens, user_id, priority)
+        if queued is None:
+            return 0.0
+        state, ticket = queued
+        state.waiting.append(ticket)
+    reported = None
+    try:
+        while True:
+            with _cond:
+                place, wait = _try_take(state, ticket)
+            if wait <= 0:
+                break
+            if time.monotonic() - started > QUEUE_TIMEOUT:
+                raise AdmissionTimeout(f"{service} is busy, gave up after waiting {QUEUE_TIMEOUT} s in the queue.")
+            if place != reported and on_wait is not None:
+                reported = place
+                on_wait(place)
+            # Not woken by the others leaving like the threads are, so it looks more often
+            await asyncio.sleep(min(wait, ASYNC_RECHECK_SECONDS))
+    finally:
+        with _cond:
+            state.waiting.remove(ticket)
+            _cond.notify_all()
+    if reported is not None:
+        on_wait(0)
+    return _log_wait(service, user_id, started)
+
+
+@asynccontextmanager
+async def admitted(service, tokens=0, user_id=None, priority=None, on_wait=None):
+    """Queue with admit_async, then run a blocking call that admits itself (e.g. speech.synthesize) inside.
+
+    The call's own admit() for service lets it through at once, also in a thread started inside
+    (run_in_threadpool and asyncio.to_thread copy the context).
+    """
+    await admit_async(service, tokens, user_id, priority, on_wait)
+    token = _admitted.set(_admitted.get() | {_service_id(service)})
+    try:
+        yield
+    finally:
+        _admitted.reset(token)
+
+
+def queue_report():
+    """{service: requests waiting} for display."""
+    with _cond:
+        return {service: len(state.waiting) for service, state in _services.items() if state and state.waiting}
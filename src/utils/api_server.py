@@ -0,0 +1,414 @@
+"""Headless HTTP API for PIPKA, without Streamlit: python -m src.utils.api_server
+
+Turns run as background jobs like in the UI, so a client can disconnect and resume the stream later.
+
+    GET  /conversations                      -> [{"id", "name"}]
+    POST /conversations      {"name"}        -> {"id", "name"}
+    GET  /conversations/{id}/messages        -> [{"id", "role", "content"}]
+    POST /chat               {"message", "conversation_id"?, settings}
+                                             -> text/event-stream: "job", then "chunk" events (id = seq), then "done"
+    GET  /jobs/{id}/events                   -> the same stream, resumed after the Last-Event-ID header or ?after=
+    POST /jobs/{id}/cancel
+    WS   /ws                                 <- {"message", ...} / {"type": "cancel"}
+                                             -> {"type": "job"}, {"type": "chunk", "seq", "chunk"}, {"type": "done"}
+    POST /tts                {"text", "language", "format"?}
+                                             -> audio/mpeg (or audio/ogg for "ogg_opus"/"ogg_vorbis"), streamed from Polly
+    POST /stt?language=cs-CZ (WAV body)      -> {"text"}
+
+Settings are the sidebar's: model (a models.json id or "auto", the default), temperature, max_tokens, auto_run, language, custom_instructions,
+recall_pairs, recall_token_budget, wall_seconds, cpu_seconds, memory_mb, cache (answer repeated low temperature requests
+from the response cache; the last chunk of such a turn is {"type": "metrics"} with the cache hits).
+While a model call of the turn waits for Bedrock capacity, {"type": "queue"} chunks carry its place in the queue, 0 when it got through.
+
+PIPKA_API_TOKEN must be set; every request carries "Authorization: Bearer <token>" (or ?token= on the websocket).
+A user token (python -m src.utils.api_server --issue-token <user>) names its user. PIPKA_API_TOKEN itself is the
+service token of a proxy in front, which names the user with X-Pipka-User (or ?user=); such a user counts as
+authenticated only with PIPKA_API_TRUST_PROXY_USER=1, set when the proxy logs users in and overwrites the header.
+"auto_run": true is refused for users who are not authenticated.
+"""
+import os
+import sys
+import hmac
+import json
+import uuid
+import base64
+import hashlib
+import argparse
+import asyncio
+import logging
+import threading
+import weakref
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+from src.data.database import (create_tables, get_all_conversations, get_chats_by_conversation_id, get_conversation_by_id,
+                               get_job, save_chat, save_conversation)
+from src.data.models import Chat, Conversation
+from src.utils.file_server import FILE_SERVER_PORT, FILE_SERVER_URL, refresh_links, start_file_server
+from src.utils.admission import admission_context, admitted
+from src.utils.jobs import ExecutionLimits, cancel_job, running_job, start_turn, sweep_jobs, tail_job_async
+from src.utils.kernels import kernel_for
+from src.utils.llm_cache import ENABLED_BY_DEFAULT as CACHE_BY_DEFAULT
+from src.utils.router import AUTO_MODEL, max_output_tokens, models as router_models
+from src.utils.audio import MIME_TYPES
+from src.utils.speech import synthesize, transcribe_audio
+from src.utils.turns import TurnSettings, build_message, configure_interpreter, format_response, turn_stages
+from src.utils.workspace import QuotaExceeded, enforce_quota, invalidate_usage, user_workspace
+
+logger = logging.getLogger(__name__)
+
+# Local only unless set; docker-compose.yml binds it for nginx
+API_HOST = os.environ.get("PIPKA_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("PIPKA_API_PORT", "8503"))
+API_TOKEN = os.environ.get("PIPKA_API_TOKEN", "")
+# Set when the proxy in front logs users in and overwrites X-Pipka-User, so the header it sends can be trusted
+TRUST_PROXY_USER = os.environ.get("PIPKA_API_TRUST_PROXY_USER", "0") == "1"
+USER_TOKEN_PREFIX = "u."
+# Proxies drop connections that stay silent for a minute
+HEARTBEAT_SECONDS = 15
+MAX_AUDIO_BYTES = 25 * 1024 * 1024
+
+# Checking for a running turn and starting one must not interleave for one conversation
+_start_locks = weakref.WeakValueDictionary()
+_start_locks_lock = threading.Lock()
+
+
+class ApiError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _settings(body, models):
+    model = body.get('model') or AUTO_MODEL
+    if model != AUTO_MODEL and model not in models:
+        raise ApiError(f"Unknown model {model!r}.")
+    # Clamped again for the model the router picks
+    output_limit = max_output_tokens(model)
+    try:
+        return TurnSettings(
+            model=model,
+            temperature=float(body.get('temperature', 0.1)),
+            max_tokens=min(int(body.get('max_tokens', 1024)), output_limit),
+            auto_run=bool(body.get('auto_run', False)),
+            language=str(body.get('language', 'en-US')),
+            custom_instructions=str(body.get('custom_instructions', '')),
+            recall_pairs=int(body.get('recall_pairs', 4)),
+            recall_token_budget=int(body.get('recall_token_budget', 800)),
+            response_cache=bool(body.get('cache', CACHE_BY_DEFAULT)),
+            limits=ExecutionLimits(
+                wall_seconds=int(body.get('wall_seconds', 0)),
+                cpu_seconds=int(body.get('cpu_seconds', 0)),
+                memory_mb=int(body.get('memory_mb', 0)),
+            ),
+        )
+    except (TypeError, ValueError) as e:
+        raise ApiError(f"Invalid settings: {e}")
+
+
+def _user_signature(user_id, key):
+    return hmac.new(key.encode(), f"user:{user_id}".encode(), hashlib.sha256).hexdigest()
+
+
+def user_token(user_id, key=None):
+    """Bearer token that authenticates user_id, signed with PIPKA_API_TOKEN (or key)."""
+    encoded = base64.urlsafe_b64encode(user_id.encode()).decode().rstrip('=')
+    return f"{USER_TOKEN_PREFIX}{encoded}.{_user_signature(user_id, key or API_TOKEN)}"
+
+
+def _token_user(token):
+    try:
+        encoded, signature = token[len(USER_TOKEN_PREFIX):].rsplit('.', 1)
+        user_id = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode()
+    except ValueError:
+        return None
+    return user_id if user_id and hmac.compare_digest(_user_signature(user_id, API_TOKEN), signature) else None
+
+
+def _identity(connection):
+    """(user id, authenticated) of a request or websocket; raises ApiError without a valid token."""
+    token = connection.headers.get('authorization', '').removeprefix('Bearer ').strip() or connection.query_params.get('token', '')
+    if token.startswith(USER_TOKEN_PREFIX):
+        user_id = _token_user(token)
+        if user_id is None:
+            raise ApiError("Invalid or missing token.", 401)
+        return user_id, True
+    if not API_TOKEN or not hmac.compare_digest(token.encode(), API_TOKEN.encode()):
+        raise ApiError("Invalid or missing token.", 401)
+    # The service token: the proxy in front names the user
+    user_id = connection.headers.get('x-pipka-user') or connection.query_params.get('user')
+    if not user_id:
+        raise ApiError("X-Pipka-User is required with the service token.", 401)
+    return user_id, TRUST_PROXY_USER
+
+
+def _user(connection):
+    return _identity(connection)[0]
+
+
+def _files_base(connection):
+    if FILE_SERVER_URL:
+        return FILE_SERVER_URL.rstrip('/')
+    return f"{'https' if connection.url.scheme in ('https', 'wss') else 'http'}://{connection.url.hostname}:{FILE_SERVER_PORT}"
+
+
+def _own_conversation(user_id, conversation_id):
+    conversation = get_conversation_by_id(conversation_id)
+    if conversation is None or conversation.user_id != user_id:
+        raise ApiError("Conversation not found.", 404)
+    return conversation
+
+
+def _own_job(user_id, job_id):
+    job = get_job(job_id)
+    if job is None:
+        raise ApiError("Job not found.", 404)
+    _own_conversation(user_id, job['conversation_id'])
+    return job
+
+
+def _start_lock(conversation_id):
+    with _start_locks_lock:
+        lock = _start_locks.get(conversation_id)
+        if lock is None:
+            lock = _start_locks[conversation_id] = threading.Lock()
+        return lock
+
+
+def _begin_turn(interpreter_for, user_id, authenticated, body, models, files_base):
+    """Save the prompt and start the answer as a job; (conversation id, job id)."""
+    prompt = str(body.get('message', '')).strip()
+    if not prompt:
+        raise ApiError("Message is empty.")
+    settings = _settings(body, models)
+    if settings.auto_run and not authenticated:
+        # Code would run as a user nobody proved to be
+        raise ApiError("auto_run needs a user token, or a proxy trusted with PIPKA_API_TRUST_PROXY_USER.", 403)
+    conversation_id = body.get('conversation_id')
+    if conversation_id:
+        _own_conversation(user_id, conversation_id)
+    else:
+        conversation_id = str(uuid.uuid4())
+        save_conversation(Conversation(conversation_id, user_id, prompt[:40]))
+    workspace_dir = user_workspace(user_id)
+    try:
+        enforce_quota(workspace_dir)
+    except QuotaExceeded as e:
+        raise ApiError(str(e), 507)
+    with _start_lock(conversation_id):
+        if running_job(conversation_id):
+            raise ApiError("An answer is still running in this conversation.", 409)
+        history = get_chats_by_conversation_id(conversation_id)
+        interpreter = interpreter_for(conversation_id)
+        configure_interpreter(interpreter, conversation_id, history, workspace_dir, settings, prompt, user_id)
+        save_chat(Chat(conversation_id, "user", prompt))
+        messages = history + [{"role": "user", "content": prompt}]
+        message = build_message(prompt, user_id, conversation_id, workspace_dir, messages, settings)
+        job_id = start_turn(conversation_id, interpreter, message, format_response, settings.limits,
+                            turn_stages(workspace_dir, user_id, files_base, interpreter), user_id)
+    return conversation_id, job_id
+
+
+def _speak(user_id, text, language, audio_format):
+    # Polly calls queue per user like the UI's
+    with admission_context(user_id):
+        return synthesize(text, language, audio_format)
+
+
+def _event(event, data, event_id=None):
+    return (f"id: {event_id}\n" if event_id is not None else "") + f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _job_events(user_id, job_id, after_seq=-1, first=None):
+    if first:
+        yield first
+    async for seq, chunk in tail_job_async(job_id, after_seq, heartbeat=HEARTBEAT_SECONDS):
+        # A comment line, ignored by EventSource
+        yield ": ping\n\n" if seq is None else _event("chunk", chunk, seq)
+    job = await run_in_threadpool(get_job, job_id)
+    # Code may have rewritten files in place, which the incremental scan does not notice
+    invalidate_usage(user_workspace(user_id))
+    yield _event("done", {"job_id": job_id, "status": job['status'] if job else None, "error": job['error'] if job else None})
+
+
+def create_app(interpreter_for=kernel_for):
+    """interpreter_for(conversation_id) gives the interpreter a turn runs on (kernels.kernel_for by default)."""
+    if not API_TOKEN:
+        raise RuntimeError("PIPKA_API_TOKEN is not set; without it anybody could act as any user.")
+    models = router_models()
+    create_tables()
+    # Turns that were running when the previous process stopped are over
+    sweep_jobs(force=True)
+
+    async def _body(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise ApiError("Body must be JSON.")
+        if not isinstance(body, dict):
+            raise ApiError("Body must be a JSON object.")
+        return body
+
+    async def list_conversations(request):
+        user_id = _user(request)
+        conversations = await run_in_threadpool(get_all_conversations, user_id)
+        return JSONResponse([{"id": c['id'], "name": c['name']} for c in conversations])
+
+    async def new_conversation(request):
+        user_id = _user(request)
+        body = await _body(request)
+        conversation = Conversation(str(uuid.uuid4()), user_id, str(body.get('name') or 'Conversation'))
+        await run_in_threadpool(save_conversation, conversation)
+        return JSONResponse({"id": conversation.id, "name": conversation.name})
+
+    async def conversation_messages(request):
+        user_id = _user(request)
+        conversation_id = request.path_params['conversation_id']
+        await run_in_threadpool(_own_conversation, user_id, conversation_id)
+        chats = await run_in_threadpool(get_chats_by_conversation_id, conversation_id)
+        workspace_dir = user_workspace(user_id)
+        # Download links in older answers have expired, the user's own are signed again
+        return JSONResponse([{"id": chat['id'], "role": chat['role'], "content": refresh_links(chat['content'], workspace_dir)}
+                             for chat in chats])
+
+    async def chat(request):
+        user_id, authenticated = _identity(request)
+        body = await _body(request)
+        conversation_id, job_id = await run_in_threadpool(_begin_turn, interpreter_for, user_id, authenticated, body, models,
+                                                          _files_base(request))
+        first = _event("job", {"job_id": job_id, "conversation_id": conversation_id})
+        return StreamingResponse(_job_events(user_id, job_id, first=first), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    async def job_events(request):
+        user_id = _user(request)
+        job_id = request.path_params['job_id']
+        await run_in_threadpool(_own_job, user_id, job_id)
+        try:
+            after_seq = int(request.headers.get('last-event-id') or request.query_params.get('after', -1))
+        except ValueError:
+            raise ApiError("Invalid Last-Event-ID.")
+        return StreamingResponse(_job_events(user_id, job_id, after_seq), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    async def cancel(request):
+        user_id = _user(request)
+        job_id = request.path_params['job_id']
+        await run_in_threadpool(_own_job, user_id, job_id)
+        return JSONResponse({"cancelled": await run_in_threadpool(cancel_job, job_id)})
+
+    async def tts(request):
+        user_id = _user(request)
+        body = await _body(request)
+        text = str(body.get('text', '')).strip()
+        if not text:
+            raise ApiError("Text is empty.")
+        audio_format = body.get('format')
+        if audio_format is not None and audio_format not in MIME_TYPES:
+            raise ApiError(f"Unknown format, use one of {', '.join(MIME_TYPES)}.")
+        # Queued on the event loop, a long wait for Polly holds no worker thread
+        async with admitted('polly', user_id=user_id):
+            speech = await run_in_threadpool(_speak, user_id, text, str(body.get('language', 'en-US')), audio_format)
+        if speech is None:
+            raise ApiError("Speech synthesis failed.", 502)
+        mime_type, chunks = speech
+        # Passed on as Polly produces it, the client starts playing before the whole text is synthesized
+        return StreamingResponse(chunks, media_type=mime_type)
+
+    async def stt(request):
+        _user(request)
+        audio = bytearray()
+        async for chunk in request.stream():
+            audio.extend(chunk)
+            if len(audio) > MAX_AUDIO_BYTES:
+                raise ApiError("Audio is too long.", 413)
+        if not audio:
+            raise ApiError("Audio is empty.")
+        try:
+            text = await run_in_threadpool(transcribe_audio, bytes(audio), request.query_params.get('language', 'en-US'))
+        except ValueError as e:
+            # Not a WAV/AIFF/FLAC file
+            raise ApiError(f"Unsupported audio: {e}")
+        return JSONResponse({"text": text})
+
+    async def chat_socket(websocket):
+        try:
+            user_id, authenticated = _identity(websocket)
+        except ApiError:
+            await websocket.close(code=4401)
+            return
+        await websocket.accept()
+        files_base = _files_base(websocket)
+        receiving = asyncio.ensure_future(websocket.receive_json())
+        try:
+            while True:
+                request = await receiving
+                receiving = asyncio.ensure_future(websocket.receive_json())
+                if not isinstance(request, dict) or request.get('type') == 'cancel':
+                    continue
+                try:
+                    conversation_id, job_id = await run_in_threadpool(_begin_turn, interpreter_for, user_id, authenticated, request, models, files_base)
+                except ApiError as e:
+                    await websocket.send_json({"type": "error", "error": str(e), "status": e.status_code})
+                    continue
+                await websocket.send_json({"type": "job", "job_id": job_id, "conversation_id": conversation_id})
+                async for seq, chunk in tail_job_async(job_id, heartbeat=1):
+                    if receiving.done():
+                        message = receiving.result()
+                        receiving = asyncio.ensure_future(websocket.receive_json())
+                        if isinstance(message, dict) and message.get('type') == 'cancel':
+                            await run_in_threadpool(cancel_job, job_id)
+                        else:
+                            await websocket.send_json({"type": "error", "error": "An answer is still running.", "status": 409})
+                    if seq is not None:
+                        await websocket.send_json({"type": "chunk", "seq": seq, "chunk": chunk})
+                job = await run_in_threadpool(get_job, job_id)
+                invalidate_usage(user_workspace(user_id))
+                await websocket.send_json({"type": "done", "job_id": job_id, "status": job['status'] if job else None,
+                                           "error": job['error'] if job else None})
+        except (WebSocketDisconnect, ValueError):
+            # The job keeps running; its answer is saved and can be streamed again from /jobs/{id}/events
+            pass
+        finally:
+            receiving.cancel()
+
+    async def api_error(request, exc):
+        return JSONResponse({"error": str(exc)}, status_code=exc.status_code)
+
+    async def health(request):
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(
+        routes=[
+            Route("/health", health, methods=["GET"]),
+            Route("/conversations", list_conversations, methods=["GET"]),
+            Route("/conversations", new_conversation, methods=["POST"]),
+            Route("/conversations/{conversation_id}/messages", conversation_messages, methods=["GET"]),
+            Route("/chat", chat, methods=["POST"]),
+            Route("/jobs/{job_id}/events", job_events, methods=["GET"]),
+            Route("/jobs/{job_id}/cancel", cancel, methods=["POST"]),
+            Route("/tts", tts, methods=["POST"]),
+            Route("/stt", stt, methods=["POST"]),
+            WebSocketRoute("/ws", chat_socket),
+        ],
+        exception_handlers={ApiError: api_error},
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--issue-token", metavar="USER", help="print a token that authenticates USER and exit")
+    args = parser.parse_args()
+    if not API_TOKEN:
+        sys.exit("Set PIPKA_API_TOKEN to a long random secret, the API does not start without it.")
+    if args.issue_token:
+        print(user_token(args.issue_token))
+        sys.exit()
+    logging.basicConfig(level=logging.INFO)
+    start_file_server()
+    uvicorn.run(create_app(), host=API_HOST, port=API_PORT, log_level="warning")
@@ -0,0 +1,92 @@
+# audio.py
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Polly OutputFormat -> MIME type
+MIME_TYPES = {
+    'mp3': 'audio/mpeg',
+    'ogg_vorbis': 'audio/ogg',
+    'ogg_opus': 'audio/ogg',
+}
+
+# MPEG version bits -> sample rates; 1 is reserved
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+# Bitrates in kbit/s by MPEG 1 or 2/2.5 and layer (3 = Layer I, 2 = Layer II, 1 = Layer III)
+_BITRATES = {
+    (True, 3): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 1): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 3): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 1): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+OPUS_RATE = 48000
+
+
+def _frame(data, offset):
+    """(length, samples, sample rate) of the MPEG audio frame whose header is at offset, None when there is none."""
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    version, layer = (data[offset + 1] >> 3) & 3, (data[offset + 1] >> 1) & 3
+    bitrate_index, rate_index, padding = data[offset + 2] >> 4, (data[offset + 2] >> 2) & 3, (data[offset + 2] >> 1) & 1
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    rate = _SAMPLE_RATES[version][rate_index]
+    if layer == 3:
+        return (12 * bitrate // rate + padding) * 4, 384, rate
+    samples = 1152 if layer == 2 or mpeg1 else 576
+    return samples // 8 * bitrate // rate + padding, samples, rate
+
+
+def mp3_duration(data):
+    """Seconds of MP3 audio, summed from the frame headers without decoding anything."""
+    offset = 0
+    # ID3v2 tag: 10 byte header, its size in 7 bit bytes
+    if data[:3] == b'ID3' and len(data) >= 10:
+        offset = 10 + ((data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F))
+    seconds = 0.0
+    while offset < len(data):
+        frame = _frame(data, offset)
+        if frame is None:
+            # Junk between frames or a trailing tag; look for the next frame sync
+            offset = data.find(b'\xff', offset + 1)
+            if offset < 0:
+                break
+            continue
+        length, samples, rate = frame
+        seconds += samples / rate
+        offset += length
+    return seconds
+
+
+def ogg_duration(data):
+    """Seconds of Ogg Vorbis or Opus audio: the last page's granule position over the sample rate."""
+    if data[:4] != b'OggS':
+        return 0.0
+    header = data[:512]
+    if b'OpusHead' in header:
+        start = header.index(b'OpusHead')
+        rate, skip = OPUS_RATE, struct.unpack_from('<H', header, start + 10)[0]
+    elif b'\x01vorbis' in header:
+        start = header.index(b'\x01vorbis')
+        rate, skip = struct.unpack_from('<I', header, start + 12)[0], 0
+    else:
+        return 0.0
+    last = data.rfind(b'OggS')
+    if not rate or last + 14 > len(data):
+        return 0.0
+    granule = struct.unpack_from('<q', data, last + 6)[0]
+    return max(0.0, (granule - skip) / rate)
+
+
+def duration(data, mime_type='audio/mpeg'):
+    """Seconds of audio in data, read from its headers; 0 when the format is not known."""
+    try:
+        return ogg_duration(data) if mime_type == 'audio/ogg' else mp3_duration(data)
+    except (IndexError, struct.error) as e:
+        logger.warning(f"Could not read the audio duration: {e}")
+        return 0.0
@@ -0,0 +1,73 @@
+# canvas_sweep.py
+import os
+import random
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PIL import Image, ImageDraw
+
+from src.utils.canvas_tiles import WORKERS, fits_canvas
+
+logger = logging.getLogger(__name__)
+
+# Images one sweep may ask for
+MAX_SWEEP_IMAGES = 24
+MAX_SEED = 858993459
+CONTACT_SHEET = 'contact_sheet.png'
+THUMBNAIL_SIZE = 256
+LABEL_HEIGHT = 18
+
+
+def cfg_scales(low, high, steps):
+    """steps values from low to high, rounded to Nova Canvas' 0.1 steps."""
+    if steps <= 1 or high <= low:
+        return [round(low, 1)]
+    return sorted({round(low + (high - low) * i / (steps - 1), 1) for i in range(steps)})
+
+
+def sweep_grid(seeds, scales, sizes, limit=MAX_SWEEP_IMAGES):
+    """Every combination of seed, cfgScale and (width, height), sizes outermost; at most limit, invalid sizes left out."""
+    sizes = [size for size in sizes if fits_canvas(*size)]
+    grid = [{"seed": seed, "cfgScale": scale, "width": width, "height": height}
+            for width, height in sizes for scale in scales for seed in seeds]
+    return grid[:limit]
+
+
+def random_seeds(count, first=None):
+    """count seeds starting with first, the rest random."""
+    seeds = [first] if first else []
+    while len(seeds) < count:
+        seeds.append(random.randint(1, MAX_SEED))
+    return seeds[:count]
+
+
+def run_sweep(grid, generate, workers=WORKERS):
+    """Call generate(cell) -> base64 image for every cell concurrently; yields (index, image base64 or None, error) as they finish."""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipka-sweep") as executor:
+        # Each request gets a copy of this thread's context, admission.py reads the user from it
+        futures = {executor.submit(contextvars.copy_context().run, generate, cell): index for index, cell in enumerate(grid)}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                logger.warning(f"Sweep image {futures[future]} failed: {e}")
+                yield futures[future], None, str(e)
+
+
+def contact_sheet(directory, entries, columns=4):
+    """Thumbnails of the sweep's images with their parameters under each, saved as CONTACT_SHEET in directory."""
+    entries = [entry for entry in entries if entry.get("file")]
+    rows = max(1, -(-len(entries) // columns))
+    sheet = Image.new('RGB', (columns * THUMBNAIL_SIZE, rows * (THUMBNAIL_SIZE + LABEL_HEIGHT)), 'white')
+    draw = ImageDraw.Draw(sheet)
+    for i, entry in enumerate(entries):
+        x, y = (i % columns) * THUMBNAIL_SIZE, (i // columns) * (THUMBNAIL_SIZE + LABEL_HEIGHT)
+        with Image.open(os.path.join(directory, entry["file"])) as image:
+            image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            sheet.paste(image.convert('RGB'), (x + (THUMBNAIL_SIZE - image.width) // 2, y + (THUMBNAIL_SIZE - image.height) // 2))
+        draw.text((x + 4, y + THUMBNAIL_SIZE + 2), f"seed {entry['seed']}  cfg {entry['cfgScale']}  {entry['width']}x{entry['height']}",
+                  fill='black')
+    path = os.path.join(directory, CONTACT_SHEET)
+    sheet.save(path)
+    return path
@@ -0,0 +1,146 @@
+# canvas_tiles.py
+import io
+import os
+import zlib
+import base64
+import struct
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Nova Canvas takes images with sides of 320 to 4096 pixels and fewer than 4,194,304 pixels in all
+MIN_SIDE = 320
+MAX_SIDE = 4096
+MAX_PIXELS = 4194304
+# Largest square tile under the pixel limit; neighbours share OVERLAP pixels that are cross-faded
+TILE_SIZE = 2032
+OVERLAP = 128
+# Tiles sent at once; Nova Canvas requests are also limited by admission.py
+WORKERS = int(os.environ.get("PIPKA_CANVAS_WORKERS", "4"))
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_COLOR_TYPES = {'RGB': 2, 'RGBA': 6}
+
+
+def fits_canvas(width, height):
+    """True when Nova Canvas takes an image of this size in one request."""
+    return (MIN_SIDE <= width <= MAX_SIDE and MIN_SIDE <= height <= MAX_SIDE and width * height < MAX_PIXELS
+            and max(width, height) <= 4 * min(width, height))
+
+
+def tile_positions(length, tile, overlap=OVERLAP):
+    """Starts of tiles covering length; the last one ends at the edge, overlapping its neighbour by overlap or more."""
+    if length <= tile:
+        return [0]
+    positions = list(range(0, length - tile, tile - overlap))
+    return positions + [length - tile]
+
+
+class PngWriter:
+    """Writes a PNG band of rows at a time, so the whole image is never in memory."""
+
+    def __init__(self, path, width, height, mode):
+        self.width = width
+        self.channels = len(mode)
+        self.file = open(path, 'wb')
+        self.compressor = zlib.compressobj(6)
+        self.file.write(PNG_SIGNATURE)
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, PNG_COLOR_TYPES[mode], 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.file.write(struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    def write(self, rows):
+        """rows: uint8 array of shape (rows, width, channels)."""
+        flat = rows.reshape(len(rows), self.width * self.channels)
+        # "Sub" filter: each byte minus the same channel of the pixel on its left, photos compress much better
+        filtered = flat.copy()
+        filtered[:, self.channels:] = flat[:, self.channels:] - flat[:, :-self.channels]
+        data = self.compressor.compress(np.hstack([np.ones((len(rows), 1), np.uint8), filtered]).tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+
+    def close(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.file.close()
+
+
+def _blend(first, second, offset, axis):
+    """first and second laid over each other with second starting at offset along axis, cross-faded where they overlap."""
+    overlap = first.shape[axis] - offset
+    before = np.take(first, range(offset), axis=axis)
+    after = np.take(second, range(overlap, second.shape[axis]), axis=axis)
+    if overlap <= 0:
+        return np.concatenate([before, after], axis=axis)
+    ramp = ((np.arange(overlap, dtype=np.float32) + 0.5) / overlap).reshape([-1 if i == axis else 1 for i in range(first.ndim)])
+    shared = np.take(first, range(offset, first.shape[axis]), axis=axis) * (1 - ramp) + \
+        np.take(second, range(overlap), axis=axis) * ramp
+    return np.concatenate([before, np.rint(shared).astype(np.uint8), after], axis=axis)
+
+
+def _pad(tile):
+    """tile extended with its edge pixels to MIN_SIDE where it is shorter, Nova Canvas refuses smaller images."""
+    width, height = tile.size
+    if width >= MIN_SIDE and height >= MIN_SIDE:
+        return tile
+    return Image.fromarray(np.pad(np.asarray(tile), ((0, max(0, MIN_SIDE - height)), (0, max(0, MIN_SIDE - width)), (0, 0)),
+                                  mode='edge'))
+
+
+def _process(tile, process_tile, mode):
+    padded = _pad(tile)
+    buffered = io.BytesIO()
+    padded.save(buffered, format='PNG')
+    result = Image.open(io.BytesIO(base64.b64decode(process_tile(base64.b64encode(buffered.getvalue()).decode()))))
+    result = result.convert(mode)
+    if result.size != padded.size:
+        result = result.resize(padded.size, Image.LANCZOS)
+    return np.asarray(result)[:tile.size[1], :tile.size[0]]
+
+
+def process_tiled(image, process_tile, path, mode='RGB', tile_size=TILE_SIZE, overlap=OVERLAP, workers=WORKERS, on_progress=None):
+    """Run process_tile(base64 PNG) -> base64 image over overlapping tiles of image and write the result to path as PNG.
+
+    Tiles are processed concurrently, a band of tile rows at a time (the next band is already in flight while one is
+    blended), and finished rows are written out; memory holds about two bands, not the whole result.
+    Tiles shorter than MIN_SIDE, from images with a short side under it, are padded for the request and cropped back.
+    on_progress(done, total) is called from this thread after every band.
+    """
+    width, height = image.size
+    tile_width, tile_height = min(width, tile_size), min(height, tile_size)
+    # Tiles of a long strip keep within the 1:4 aspect ratio too, as they are sent after padding
+    tile_width, tile_height = min(tile_width, 4 * max(tile_height, MIN_SIDE)), min(tile_height, 4 * max(tile_width, MIN_SIDE))
+    xs, ys = tile_positions(width, tile_width, overlap), tile_positions(height, tile_height, overlap)
+    image = image.convert('RGB')
+    writer = PngWriter(path, width, height, mode)
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipka-tiles") as executor:
+            def submit_band(y):
+                # Each task gets a copy of this thread's context, admission.py reads the user from it
+                return [executor.submit(contextvars.copy_context().run, _process,
+                                        image.crop((x, y, x + tile_width, y + tile_height)), process_tile, mode) for x in xs]
+
+            pending = submit_band(ys[0])
+            # Rows of the previous band that the current one overlaps, not written yet
+            carry = None
+            for i, y in enumerate(ys):
+                futures, pending = pending, submit_band(ys[i + 1]) if i + 1 < len(ys) else None
+                band = None
+                for x, future in zip(xs, futures):
+                    tile = future.result()
+                    band = tile if band is None else _blend(band, tile, x - xs[0], axis=1)
+                if carry is not None:
+                    band = _blend(carry, band, 0, axis=0)
+                next_y = ys[i + 1] if i + 1 < len(ys) else height
+                writer.write(band[:next_y - y])
+                carry = band[next_y - y:]
+                if on_progress is not None:
+                    on_progress((i + 1) * len(xs), len(xs) * len(ys))
+    finally:
+        writer.close()
+    return len(xs) * len(ys)
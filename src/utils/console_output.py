@@ -0,0 +1,99 @@
+# console_output.py
+import os
+import time
+import uuid
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+CONSOLE_DIR = '.console'
+# Per code block: the first HEAD chars of output are shown as they come, after that only the last TAIL chars
+CONSOLE_HEAD_CHARS = 8 * 1024
+CONSOLE_TAIL_CHARS = 8 * 1024
+TAIL_INTERVAL = 0.5
+# Invisible separator (U+2063) marking output PIPKA reads back: in front of the tail, which format_response
+# replaces everything after, and in front of the kernel's variable summary lines (kernels.py)
+OUTPUT_MARK = '\u2063'
+
+
+def new_console_log_path(workspace_dir):
+    name = f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{uuid.uuid4().hex[:8]}.log"
+    return os.path.join(workspace_dir, CONSOLE_DIR, name)
+
+
+class ConsoleLimiter:
+    """Keeps the console output of a turn bounded; the complete output goes to a log file."""
+
+    def __init__(self, log_path, log_url):
+        self.log_path = log_path
+        self.log_url = log_url
+        self._log = None
+        self._block = 0
+        self._reset()
+
+    def _reset(self):
+        self._shown = 0
+        self._total = 0
+        self._tail = ''
+        self._truncated = False
+        self._last_tail = 0.0
+
+    def _write(self, text):
+        try:
+            if self._log is None:
+                os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                self._log = open(self.log_path, "a", encoding="utf-8")
+            self._log.write(text)
+        except OSError as e:
+            logger.warning(f"Failed to write console log {self.log_path}: {e}")
+
+    def _tail_chunk(self):
+        self._last_tail = time.monotonic()
+        return {"type": "console", "format": "tail", "content": self._tail}
+
+    def feed(self, chunk):
+        """Chunks to pass on instead of chunk."""
+        if chunk.get('type') != 'console':
+            return [chunk]
+        if chunk.get('start', False):
+            self._reset()
+            self._block += 1
+            self._write(f"----- code block {self._block} -----\n")
+            return [chunk]
+        if chunk.get('format', '') == 'output':
+            return self._output(chunk)
+        if chunk.get('end', False) and self._truncated:
+            note = {
+                "type": "message",
+                "role": "assistant",
+                "content": f"[Show full output ({self._total / 1024:.0f} KB)]({self.log_url})\n",
+            }
+            return [self._tail_chunk(), chunk, note]
+        return [chunk]
+
+    def _output(self, chunk):
+        content = chunk.get('content') or ''
+        self._write(content)
+        self._total += len(content)
+        if not self._truncated:
+            room = CONSOLE_HEAD_CHARS - self._shown
+            if len(content) <= room:
+                self._shown += len(content)
+                return [chunk]
+            self._truncated = True
+            self._tail = content[room:][-CONSOLE_TAIL_CHARS:]
+            note = {"type": "console", "format": "output", "content": f"\n… output too long, showing its end …\n{OUTPUT_MARK}"}
+            return [dict(chunk, content=content[:room]), note, self._tail_chunk()]
+        self._tail = (self._tail + content)[-CONSOLE_TAIL_CHARS:]
+        if time.monotonic() - self._last_tail >= TAIL_INTERVAL:
+            return [self._tail_chunk()]
+        return []
+
+    def drain(self):
+        return []
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
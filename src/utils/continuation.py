@@ -0,0 +1,86 @@
+# continuation.py
+import os
+import json
+import logging
+
+from src.utils.router import models
+
+logger = logging.getLogger(__name__)
+
+# Requests after the first one that one answer may take when it keeps stopping at the output limit
+MAX_CONTINUATIONS = int(os.environ.get("PIPKA_MAX_CONTINUATIONS", "3"))
+# Anthropic caches prefixes from this size up; below it a cache point only costs
+CACHE_MIN_TOKENS = 1024
+CHARS_PER_TOKEN = 4
+CUT_NOTE = "\n\n[The answer was cut at the output limit.]\n"
+
+
+def _field(value, name):
+    # LiteLLM chunks are objects, replayed ones (llm_cache.py) dicts
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+def _choice(chunk):
+    choices = _field(chunk, 'choices')
+    return choices[0] if choices else None
+
+
+def _with_cache_point(messages):
+    """messages with the last one marked as the end of a cacheable prefix, when it is plain text."""
+    if not messages or not isinstance(messages[-1].get('content'), str):
+        return messages
+    last = dict(messages[-1], content=[{"type": "text", "text": messages[-1]['content'], "cache_control": {"type": "ephemeral"}}])
+    return messages[:-1] + [last]
+
+
+def continued_completions(completions, model, max_continuations=MAX_CONTINUATIONS, admit=None):
+    """Wrap a LiteLLM style completions(**params) generator so an answer stopped by the output limit goes on.
+
+    The text written so far is sent back as the start of the assistant's reply (prefill) and the model continues it;
+    the chunks of every request are streamed as one answer, so it ends up in one message. With prompt caching the
+    prefix is marked as cacheable, and continuations read it from the cache instead of paying for it again.
+    Answers that stop inside a tool call cannot be prefilled and are left as they are.
+    completions must call model itself: router.routed_completions wraps each model it tries (per_model), so the
+    continuations stay on the model that started the answer. admit(model, params) is called before each continuation.
+    """
+    capabilities = models().get(model, {}).get('capabilities', ())
+
+    def run(**params):
+        messages = list(params.get('messages') or [])
+        if 'prefill' not in capabilities:
+            yield from completions(**params)
+            return
+        if 'prompt_caching' in capabilities and \
+                len(json.dumps(messages, default=str)) // CHARS_PER_TOKEN >= CACHE_MIN_TOKENS:
+            messages = _with_cache_point(messages)
+        text = ''
+        for continuation in range(max_continuations + 1):
+            # Bedrock refuses a prefill ending in whitespace
+            prefill = [{"role": "assistant", "content": text.rstrip()}] if text.strip() else []
+            finish_reason, tool_call = None, False
+            request = dict(params, messages=messages + prefill)
+            try:
+                if continuation and admit is not None:
+                    admit(model, request)
+                for chunk in completions(**request):
+                    choice = _choice(chunk)
+                    if choice is not None:
+                        delta = _field(choice, 'delta')
+                        text += (_field(delta, 'content') or '') if delta is not None else ''
+                        tool_call = tool_call or bool(delta is not None and _field(delta, 'tool_calls'))
+                        finish_reason = _field(choice, 'finish_reason') or finish_reason
+                    yield chunk
+            except Exception as e:
+                # The answer so far is already streamed and another model cannot take the prefill, so it stays cut
+                if not continuation:
+                    raise
+                logger.warning(f"Continuation {continuation} of {model} failed: {e}")
+                break
+            if finish_reason != 'length' or tool_call or not text.strip():
+                return
+            if continuation < max_continuations:
+                logger.info(f"{model} hit the output limit, continuing ({continuation + 1}/{max_continuations})")
+        yield {"choices": [{"index": 0, "delta": {"role": "assistant", "content": CUT_NOTE}, "finish_reason": "length"}]}
+    return run
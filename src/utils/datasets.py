@@ -0,0 +1,280 @@
+# datasets.py
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+PROFILE_EXTENSIONS = {'csv', 'xls', 'xlsx'}
+PROFILES_DIR = '.profiles'
+COLUMNAR_DIR = '.columnar'
+CSV_BLOCK_BYTES = 16 * 1024 * 1024
+CSV_CHUNK_ROWS = 200_000
+SAMPLE_ROWS = 3
+MAX_SUMMARY_COLUMNS = 40
+MAX_CELL_CHARS = 60
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pipka-datasets")
+_lock = threading.Lock()
+_pending = set()
+# (path) -> (size, mtime_ns) of the last profile written, saves re-reading cache files on every rerun
+_profiled = {}
+
+
+def is_tabular(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in PROFILE_EXTENSIONS
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _cache_path(workspace_dir, filename):
+    return os.path.join(workspace_dir, PROFILES_DIR, f"{filename}.json")
+
+
+def columnar_paths(workspace_dir, filename):
+    """Parquet copies of a tabular file - one per sheet for Excel workbooks."""
+    directory = os.path.join(workspace_dir, COLUMNAR_DIR)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name == f"{filename}.parquet" or (name.startswith(f"{filename}.") and name.endswith(".parquet"))
+    )
+
+
+def _columnar_fresh(workspace_dir, filename):
+    paths = columnar_paths(workspace_dir, filename)
+    source_mtime = os.stat(os.path.join(workspace_dir, filename)).st_mtime_ns
+    return bool(paths) and all(os.stat(path).st_mtime_ns >= source_mtime for path in paths)
+
+
+def _short(value):
+    text = str(value)
+    return text if len(text) <= MAX_CELL_CHARS else text[:MAX_CELL_CHARS] + '…'
+
+
+class _ColumnStats:
+    """Accumulates per-column statistics chunk by chunk."""
+
+    def __init__(self):
+        self.rows = 0
+        self.dtypes = {}
+        self.nulls = {}
+        self.minimum = {}
+        self.maximum = {}
+        self.sums = {}
+        self.counts = {}
+        self.sample = []
+
+    def update(self, frame):
+        if not self.sample:
+            self.sample = [[_short(v) for v in row] for row in frame.head(SAMPLE_ROWS).itertuples(index=False)]
+        self.rows += len(frame)
+        for column, dtype in frame.dtypes.items():
+            column = str(column)
+            previous = self.dtypes.get(column)
+            # A column that changes type between chunks is reported as mixed text
+            self.dtypes[column] = str(dtype) if previous in (None, str(dtype)) else 'object'
+        for column, count in frame.isna().sum().items():
+            self.nulls[str(column)] = self.nulls.get(str(column), 0) + int(count)
+        numeric = frame.select_dtypes(include='number')
+        if not numeric.empty:
+            for column, value in numeric.min().dropna().items():
+                self.minimum[str(column)] = min(self.minimum.get(str(column), value), value)
+            for column, value in numeric.max().dropna().items():
+                self.maximum[str(column)] = max(self.maximum.get(str(column), value), value)
+            for column, value in numeric.sum().items():
+                self.sums[str(column)] = self.sums.get(str(column), 0) + float(value)
+            for column, value in numeric.count().items():
+                self.counts[str(column)] = self.counts.get(str(column), 0) + int(value)
+
+    def to_dict(self):
+        columns = []
+        for column, dtype in self.dtypes.items():
+            info = {"name": column, "dtype": dtype, "nulls": self.nulls.get(column, 0)}
+            if dtype != 'object' and self.counts.get(column):
+                info["min"] = _short(self.minimum[column])
+                info["max"] = _short(self.maximum[column])
+                info["mean"] = round(self.sums[column] / self.counts[column], 4)
+            columns.append(info)
+        return {"rows": self.rows, "columns": columns, "sample": self.sample}
+
+
+def profile_file(path):
+    """Profile a CSV (streamed in chunks) or an Excel workbook (per sheet)."""
+    extension = path.rsplit('.', 1)[1].lower()
+    tables = {}
+    if extension == 'csv':
+        stats = _ColumnStats()
+        for chunk in pd.read_csv(path, chunksize=CSV_CHUNK_ROWS, low_memory=False):
+            stats.update(chunk)
+        tables[''] = stats.to_dict()
+    else:
+        # Excel can't be read in chunks; workbooks are capped at ~1M rows per sheet anyway
+        for sheet, frame in pd.read_excel(path, sheet_name=None).items():
+            stats = _ColumnStats()
+            stats.update(frame)
+            tables[str(sheet)] = stats.to_dict()
+    size, mtime_ns = _file_stamp(path)
+    return {"file": os.path.basename(path), "size": size, "mtime_ns": mtime_ns, "tables": tables}
+
+
+def _write_profile(workspace_dir, filename):
+    path = os.path.join(workspace_dir, filename)
+    try:
+        profile = profile_file(path)
+        cache_path = _cache_path(workspace_dir, filename)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(f"{cache_path}.tmp", "w") as f:
+            json.dump(profile, f, default=str)
+        os.replace(f"{cache_path}.tmp", cache_path)
+        with _lock:
+            _profiled[path] = (profile["size"], profile["mtime_ns"])
+    except Exception as e:
+        logger.warning(f"Failed to profile {path}: {e}")
+    finally:
+        with _lock:
+            _pending.discard(path)
+
+
+def _csv_to_parquet(source, target, column_types=None):
+    # Streaming reader: only one block of rows is in memory at a time
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_BYTES),
+        convert_options=pa_csv.ConvertOptions(column_types=column_types or {}),
+    )
+    with pq.ParquetWriter(target, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+    return reader.schema
+
+
+def convert_to_columnar(workspace_dir, filename):
+    source = os.path.join(workspace_dir, filename)
+    directory = os.path.join(workspace_dir, COLUMNAR_DIR)
+    os.makedirs(directory, exist_ok=True)
+    for stale in columnar_paths(workspace_dir, filename):
+        os.remove(stale)
+
+    if filename.rsplit('.', 1)[1].lower() == 'csv':
+        target = os.path.join(directory, f"{filename}.parquet")
+        try:
+            _csv_to_parquet(source, f"{target}.tmp")
+        except pa.ArrowInvalid:
+            # Types guessed from the first block did not fit a later one - keep the columns as text
+            schema = pa_csv.open_csv(source).schema
+            _csv_to_parquet(source, f"{target}.tmp", {name: pa.string() for name in schema.names})
+        os.replace(f"{target}.tmp", target)
+    else:
+        for sheet, frame in pd.read_excel(source, sheet_name=None).items():
+            target = os.path.join(directory, f"{filename}.{sheet}.parquet")
+            frame.columns = [str(column) for column in frame.columns]
+            frame.to_parquet(f"{target}.tmp", index=False)
+            os.replace(f"{target}.tmp", target)
+
+
+def _write_columnar(workspace_dir, filename):
+    key = (os.path.join(workspace_dir, filename), COLUMNAR_DIR)
+    try:
+        convert_to_columnar(workspace_dir, filename)
+    except Exception as e:
+        logger.warning(f"Failed to convert {filename} to Parquet: {e}")
+    finally:
+        with _lock:
+            _pending.discard(key)
+
+
+def schedule_columnar(workspace_dir, filename):
+    key = (os.path.join(workspace_dir, filename), COLUMNAR_DIR)
+    with _lock:
+        if key in _pending:
+            return
+        _pending.add(key)
+    _executor.submit(_write_columnar, workspace_dir, filename)
+
+
+def get_profile(workspace_dir, filename):
+    """Return the cached profile, or None when it is missing or the file changed since."""
+    path = os.path.join(workspace_dir, filename)
+    try:
+        with open(_cache_path(workspace_dir, filename), "r") as f:
+            profile = json.load(f)
+        if (profile["size"], profile["mtime_ns"]) != _file_stamp(path):
+            return None
+        return profile
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def schedule_profile(workspace_dir, filename):
+    path = os.path.join(workspace_dir, filename)
+    with _lock:
+        if path in _pending:
+            return
+        _pending.add(path)
+    _executor.submit(_write_profile, workspace_dir, filename)
+
+
+def refresh_profiles(workspace_dir, columnar=False):
+    """Queue profiling (and optionally Parquet conversion) for new or changed tabular files.
+
+    Only stats files, so it is cheap on every rerun.
+    """
+    for entry in os.scandir(workspace_dir):
+        if not entry.is_file() or not is_tabular(entry.name):
+            continue
+        if columnar and not _columnar_fresh(workspace_dir, entry.name):
+            schedule_columnar(workspace_dir, entry.name)
+        stamp = (entry.stat().st_size, entry.stat().st_mtime_ns)
+        if _profiled.get(entry.path) == stamp:
+            continue
+        profile = get_profile(workspace_dir, entry.name)
+        if profile is not None:
+            _profiled[entry.path] = stamp
+        else:
+            schedule_profile(workspace_dir, entry.name)
+
+
+def profile_summary(profile, columnar=()):
+    lines = []
+    for table, info in profile["tables"].items():
+        name = f"{profile['file']}[{table}]" if table else profile['file']
+        lines.append(f"{name}: {info['rows']} rows x {len(info['columns'])} columns")
+        for column in info['columns'][:MAX_SUMMARY_COLUMNS]:
+            details = f"{column['dtype']}, nulls {column['nulls']}"
+            if 'mean' in column:
+                details += f", min {column['min']}, max {column['max']}, mean {column['mean']}"
+            lines.append(f"  - {column['name']} ({details})")
+        if len(info['columns']) > MAX_SUMMARY_COLUMNS:
+            lines.append(f"  - ... {len(info['columns']) - MAX_SUMMARY_COLUMNS} more columns")
+        if info['sample']:
+            lines.append(f"  sample rows: {info['sample']}")
+    for path in columnar:
+        lines.append(f"  Parquet copy (faster, use pandas.read_parquet): {os.path.join('.', path)}")
+    return '\n'.join(lines)
+
+
+def dataset_context(workspace_dir, prompt):
+    """Profiles of workspace files mentioned in the prompt, ready to append to the interpreter message."""
+    mentioned = []
+    lowered = prompt.lower()
+    for entry in os.scandir(workspace_dir):
+        if entry.is_file() and is_tabular(entry.name) and entry.name.lower() in lowered:
+            profile = get_profile(workspace_dir, entry.name)
+            if profile is not None:
+                columnar = columnar_paths(workspace_dir, entry.name) if _columnar_fresh(workspace_dir, entry.name) else []
+                mentioned.append(profile_summary(profile, columnar))
+    if not mentioned:
+        return ''
+    return f"\nAlready known about the files in './{workspace_dir}' (no need to inspect them again):\n" + '\n'.join(mentioned) + '\n'
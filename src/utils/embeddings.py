@@ -0,0 +1,64 @@
+# embeddings.py
+import os
+import re
+import json
+import hashlib
+import logging
+
+import boto3
+import numpy as np
+
+from src.utils.admission import admit
+
+logger = logging.getLogger(__name__)
+
+# 'bedrock' uses Titan text embeddings, 'local' a hashing embedder that needs no model or network
+EMBEDDINGS_BACKEND = os.environ.get("PIPKA_EMBEDDINGS", "bedrock")
+BEDROCK_EMBEDDING_MODEL = "amazon.titan-embed-text-v2:0"
+BEDROCK_REGION = os.environ.get("PIPKA_EMBEDDINGS_REGION", "us-east-1")
+DIMENSIONS = 512
+MAX_INPUT_CHARS = 8000
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+_bedrock_client = None
+
+
+def embedding_model():
+    """Name stored next to each vector - vectors of different models are never compared."""
+    return BEDROCK_EMBEDDING_MODEL if EMBEDDINGS_BACKEND == "bedrock" else f"local-hash-{DIMENSIONS}"
+
+
+def _local_embedding(text):
+    # Feature hashing of words and character trigrams; crude but deterministic and offline
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for word in _WORD.findall(text.lower()):
+        features = [word] + [word[i:i + 3] for i in range(max(len(word) - 2, 0))]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], 'little') % DIMENSIONS
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+    return vector
+
+
+def _bedrock_embedding(text):
+    global _bedrock_client
+    if _bedrock_client is None:
+        _bedrock_client = boto3.client('bedrock-runtime', region_name=BEDROCK_REGION)
+    admit(BEDROCK_EMBEDDING_MODEL, len(text) // 4)
+    response = _bedrock_client.invoke_model(
+        modelId=BEDROCK_EMBEDDING_MODEL,
+        body=json.dumps({"inputText": text, "dimensions": DIMENSIONS, "normalize": True}),
+        accept="application/json",
+        contentType="application/json",
+    )
+    return np.asarray(json.loads(response['body'].read())['embedding'], dtype=np.float32)
+
+
+def embed_texts(texts):
+    """Return an (n, DIMENSIONS) float32 matrix of unit-length rows."""
+    embed = _bedrock_embedding if EMBEDDINGS_BACKEND == "bedrock" else _local_embedding
+    matrix = np.zeros((len(texts), DIMENSIONS), dtype=np.float32)
+    for i, text in enumerate(texts):
+        matrix[i] = embed((text or ' ')[:MAX_INPUT_CHARS])
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
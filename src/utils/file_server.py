@@ -0,0 +1,244 @@
+# file_server.py
+import os
+import re
+import hmac
+import time
+import hashlib
+import logging
+import secrets
+import threading
+from urllib.parse import quote, unquote
+
+import streamlit as st
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from src.utils.file_utils import allowed_file
+from src.utils.datasets import is_tabular, schedule_profile
+from src.utils.uploads import MAX_CHUNK_SIZE, UploadError, UploadTooLarge, append_chunk, finish_upload, upload_offset
+from src.utils.workspace import USERS_DIR, WORKSPACE_DIR, QuotaExceeded, enforce_quota
+
+logger = logging.getLogger(__name__)
+
+# Only the user workspaces are served, never the database or other files next to them
+FILES_ROOT = os.path.join(WORKSPACE_DIR, USERS_DIR)
+FILE_SERVER_HOST = os.environ.get("PIPKA_FILES_HOST", "0.0.0.0")
+FILE_SERVER_PORT = int(os.environ.get("PIPKA_FILES_PORT", "8502"))
+# Public base URL of the file server, e.g. https://pipka.example.com:8502 when behind a proxy
+FILE_SERVER_URL = os.environ.get("PIPKA_FILES_URL", "")
+# Download links carry an HMAC of the path and their expiry. Workers on several hosts need the same
+# PIPKA_FILES_SECRET; without it one is generated on the workspace volume, next to (not in) the served files.
+FILES_SECRET = os.environ.get("PIPKA_FILES_SECRET", "")
+SECRET_FILE = os.path.join(WORKSPACE_DIR, '.files_secret')
+LINK_SECONDS = int(float(os.environ.get("PIPKA_FILES_LINK_HOURS", "24")) * 3600)
+# A link made within the same hour is the same link
+LINK_GRANULARITY = 3600
+# Pages allowed to call the upload endpoints from the browser: where the Streamlit app is served
+APP_ORIGINS = [origin.strip().rstrip('/') for origin in os.environ.get("PIPKA_APP_ORIGINS", "http://localhost:8501").split(',') if origin.strip()]
+_LINK = re.compile(r'/files/([^?\s)"\']+)\?expires=\d+&sig=[0-9a-f]+')
+
+_server_lock = threading.Lock()
+_server_thread = None
+_secret = None
+
+
+def _signing_key():
+    global _secret
+    if _secret is None:
+        if FILES_SECRET:
+            _secret = FILES_SECRET.encode()
+        else:
+            os.makedirs(WORKSPACE_DIR, exist_ok=True)
+            try:
+                fd = os.open(SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, 'w') as f:
+                    f.write(secrets.token_hex(32))
+            except FileExistsError:
+                # Made by another worker sharing the volume
+                pass
+            with open(SECRET_FILE) as f:
+                _secret = f.read().strip().encode()
+    return _secret
+
+
+def sign(message, expires):
+    return hmac.new(_signing_key(), f"{message}\n{expires}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def verify(message, expires, signature):
+    """True when signature was made by sign(message, expires) and expires is still ahead."""
+    try:
+        if int(expires) < time.time():
+            return False
+    except (TypeError, ValueError):
+        return False
+    return hmac.compare_digest(sign(message, int(expires)), signature or '')
+
+
+def _expiry():
+    return (int(time.time()) // LINK_GRANULARITY + 1) * LINK_GRANULARITY + LINK_SECONDS
+
+
+def _resolve(root, relative_path):
+    """Map a URL path onto a file inside root, refusing anything outside of it."""
+    full_path = os.path.realpath(os.path.join(root, relative_path))
+    if os.path.commonpath([full_path, root]) != root or not os.path.isfile(full_path):
+        return None
+    return full_path
+
+
+def space_token(workspace_dir):
+    """Token naming the workspace uploads go to; only the server can make one, so it cannot be pointed at another user."""
+    space = os.path.basename(os.path.normpath(workspace_dir))
+    expires = _expiry()
+    # 'space:' keeps these signatures apart from those of download links
+    return f"{space}.{expires}.{sign(f'space:{space}', expires)}"
+
+
+def _user_root(root, request):
+    """Workspace of the user the upload belongs to, from its signed ?token=."""
+    try:
+        space, expires, signature = request.query_params.get('token', '').rsplit('.', 2)
+    except ValueError:
+        return None
+    if not verify(f"space:{space}", expires, signature):
+        return None
+    path = os.path.join(root, os.path.basename(space))
+    if not space or not os.path.isdir(path):
+        return None
+    return path
+
+
+def create_app(root=FILES_ROOT):
+    os.makedirs(root, exist_ok=True)
+    root = os.path.realpath(root)
+
+    async def download(request):
+        relative_path = request.path_params['path']
+        if not verify(relative_path, request.query_params.get('expires'), request.query_params.get('sig')):
+            return PlainTextResponse("Link expired or invalid", status_code=403)
+        full_path = _resolve(root, relative_path)
+        if full_path is None:
+            return PlainTextResponse("Not found", status_code=404)
+        # FileResponse reads the file in chunks and answers Range requests,
+        # so big workspace artifacts never sit in the Python process.
+        if request.query_params.get('inline') and full_path.endswith('.log'):
+            # Console logs open in the browser instead of downloading
+            return FileResponse(full_path, media_type="text/plain; charset=utf-8")
+        return FileResponse(
+            full_path,
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(os.path.basename(full_path))}"},
+        )
+
+    async def upload_status(request):
+        user_root = _user_root(root, request)
+        if user_root is None:
+            return JSONResponse({"error": "Upload link expired or invalid, reload the page."}, status_code=403)
+        try:
+            return JSONResponse({"offset": upload_offset(user_root, request.path_params['upload_id'])})
+        except UploadError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+    async def upload_chunk(request):
+        # PUT /uploads/<id>?token=<space token>&name=<file>&offset=<n>&total=<n>, body is the next chunk.
+        # A client resumes by asking GET /uploads/<id>?token=<space token> for the offset and sending the rest.
+        upload_id = request.path_params['upload_id']
+        user_root = _user_root(root, request)
+        if user_root is None:
+            return JSONResponse({"error": "Upload link expired or invalid, reload the page."}, status_code=403)
+        filename = os.path.basename(request.query_params.get('name', ''))
+        if not allowed_file(filename):
+            return JSONResponse({"error": "File type not allowed."}, status_code=400)
+        try:
+            offset = int(request.query_params.get('offset', 0))
+            total = int(request.query_params['total'])
+            if offset < 0 or offset >= max(total, 1):
+                raise ValueError("offset outside the upload")
+            # At most up to the declared total, and never a body larger than one chunk
+            max_bytes = min(total - offset, MAX_CHUNK_SIZE)
+            if int(request.headers.get('content-length') or 0) > max_bytes:
+                raise UploadTooLarge(f"Chunk larger than {max_bytes} bytes.")
+            # On every chunk: what is stored, the part received so far included, and the rest of the declared total
+            enforce_quota(user_root, total - offset)
+            size = await append_chunk(user_root, upload_id, offset, request.stream(), max_bytes)
+            if size < total:
+                return JSONResponse({"offset": size})
+            status, duplicate_of = finish_upload(user_root, upload_id, filename)
+            if status == "stored" and is_tabular(filename):
+                schedule_profile(user_root, filename)
+            return JSONResponse({"offset": size, "done": True, "status": status, "duplicate_of": duplicate_of})
+        except (KeyError, ValueError):
+            return JSONResponse({"error": "Missing or invalid offset/total."}, status_code=400)
+        except QuotaExceeded as e:
+            return JSONResponse({"error": str(e)}, status_code=507)
+        except UploadTooLarge as e:
+            return JSONResponse({"error": str(e)}, status_code=413)
+        except UploadError as e:
+            # Client re-reads the offset with GET and continues from there
+            return JSONResponse({"error": str(e)}, status_code=409)
+
+    return Starlette(
+        routes=[
+            Route("/files/{path:path}", download, methods=["GET", "HEAD"]),
+            Route("/uploads/{upload_id}", upload_status, methods=["GET"]),
+            Route("/uploads/{upload_id}", upload_chunk, methods=["PUT"]),
+        ],
+        # The uploader runs in a Streamlit component iframe, on the app's origin rather than the file server's
+        middleware=[Middleware(CORSMiddleware, allow_origins=APP_ORIGINS, allow_methods=["GET", "HEAD", "PUT"])],
+    )
+
+
+def start_file_server(root=FILES_ROOT, host=FILE_SERVER_HOST, port=FILE_SERVER_PORT):
+    """Start the workspace file server once per process in a daemon thread."""
+    global _server_thread
+    with _server_lock:
+        if _server_thread is not None:
+            return
+        config = uvicorn.Config(create_app(root), host=host, port=port, lifespan="off", log_level="warning")
+        server = uvicorn.Server(config)
+        _server_thread = threading.Thread(target=_run_server, args=(server,), name="pipka-file-server", daemon=True)
+        _server_thread.start()
+
+
+def _run_server(server):
+    try:
+        server.run()
+    except (OSError, SystemExit) as e:
+        # Another worker on this host already serves the workspace
+        logger.warning(f"File server not started on port {server.config.port}: {e}")
+
+
+def file_server_url():
+    if FILE_SERVER_URL:
+        return FILE_SERVER_URL.rstrip('/')
+    host = st.context.headers.get("Host", "localhost").split(':')[0]
+    return f"http://{host}:{FILE_SERVER_PORT}"
+
+
+def file_url(path, inline=False, base=None):
+    """Signed download link for a file inside a user workspace; pass base outside of the Streamlit script thread."""
+    relative_path = os.path.relpath(path, FILES_ROOT)
+    expires = _expiry()
+    return f"{base or file_server_url()}/files/{quote(relative_path)}?expires={expires}&sig={sign(relative_path, expires)}" + \
+        ("&inline=1" if inline else "")
+
+
+def refresh_links(text, workspace_dir):
+    """text with the download links into workspace_dir signed again, for answers saved before their links expired.
+
+    Links into other workspaces are left as they are, a message cannot be used to get them signed.
+    """
+    space = os.path.basename(os.path.normpath(workspace_dir))
+
+    def resign(match):
+        relative_path = unquote(match.group(1))
+        if relative_path.split('/', 1)[0] != space:
+            return match.group(0)
+        expires = _expiry()
+        return f"/files/{match.group(1)}?expires={expires}&sig={sign(relative_path, expires)}"
+    return _LINK.sub(resign, text) if text and '/files/' in text else text
@@ -0,0 +1,104 @@
+# image_output.py
+import io
+import os
+import base64
+import logging
+from collections import deque
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+IMAGES_DIR = '.images'
+# Longest side of the inline preview; the original stays on disk
+PREVIEW_MAX_SIDE = 1024
+IMAGE_FORMATS = {'base64.png': 'png', 'base64.jpeg': 'jpeg', 'base64.jpg': 'jpeg', 'base64.gif': 'gif', 'base64.webp': 'webp'}
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pipka-images")
+
+
+def _needs_flattening(image):
+    # Transparent plots are unreadable on the dark theme, they get a white background
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _preview(data, mime):
+    """(preview mime, preview base64) - the original bytes when they are fine as they are."""
+    image = Image.open(io.BytesIO(data))
+    # Image.open only reads the header, the pixels are decoded when needed
+    if max(image.size) <= PREVIEW_MAX_SIDE and not _needs_flattening(image):
+        return mime, base64.b64encode(data).decode()
+    if _needs_flattening(image):
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, 'white')
+        image.paste(rgba, mask=rgba.getchannel('A'))
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE))
+    buffered = io.BytesIO()
+    image.save(buffered, format='PNG')
+    return 'image/png', base64.b64encode(buffered.getvalue()).decode()
+
+
+class ImageOutput:
+    """Turns image chunks into previews on a worker pool, keeping the order of all chunks.
+
+    feed() returns the chunks that are ready, so reading the interpreter stream never waits for an image.
+    """
+
+    def __init__(self, workspace_dir, url_for=None):
+        self.workspace_dir = os.path.realpath(workspace_dir)
+        self.directory = os.path.join(workspace_dir, IMAGES_DIR)
+        self.url_for = url_for
+        self._pending = deque()
+        self._count = 0
+
+    def _original_path(self, extension):
+        self._count += 1
+        return os.path.join(self.directory, f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{os.getpid()}_{self._count}.{extension}")
+
+    def _convert(self, path, encoded=None):
+        try:
+            if encoded is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            else:
+                # binascii.Error is a ValueError
+                data = base64.b64decode(encoded)
+                os.makedirs(self.directory, exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(data)
+            extension = os.path.splitext(path)[1][1:].lower()
+            mime, preview = _preview(data, f"image/{'jpeg' if extension == 'jpg' else extension}")
+            # Only files inside the workspace can be linked through the file server
+            inside = os.path.commonpath([os.path.realpath(path), self.workspace_dir]) == self.workspace_dir
+            url = self.url_for(path) if self.url_for and inside else None
+            return {"type": "image", "format": "preview", "mime": mime, "content": preview, "url": url}
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning(f"Failed to prepare image output: {e}")
+            return {"type": "message", "role": "assistant", "content": f"\n[Image could not be shown: {e}]\n"}
+
+    def feed(self, chunk):
+        if chunk.get('type') == 'image' and chunk.get('content'):
+            image_format = chunk.get('format', '')
+            if image_format in IMAGE_FORMATS:
+                chunk = _executor.submit(self._convert, self._original_path(IMAGE_FORMATS[image_format]), chunk['content'])
+            elif image_format == 'path' and os.path.isfile(chunk['content']):
+                chunk = _executor.submit(self._convert, chunk['content'])
+        self._pending.append(chunk)
+        ready = []
+        while self._pending and not (isinstance(self._pending[0], Future) and not self._pending[0].done()):
+            item = self._pending.popleft()
+            ready.append(item.result() if isinstance(item, Future) else item)
+        return ready
+
+    def drain(self):
+        """The chunks still waiting for their images, in order; blocks until they are converted."""
+        ready = [item.result() if isinstance(item, Future) else item for item in self._pending]
+        self._pending.clear()
+        return ready
+
+    def close(self):
+        pass
@@ -0,0 +1,367 @@
+# jobs.py
+import os
+import time
+import uuid
+import asyncio
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.data.database import (append_job_chunks, create_job, delete_finished_jobs, finish_job, get_job,
+                               get_job_chunks, get_running_job, get_running_workers, interrupt_expired_jobs, interrupt_jobs,
+                               is_job_cancel_requested, renew_jobs, request_job_cancel, save_chat, update_chat_content)
+from src.data.models import Chat
+from src.utils.admission import PRIORITY_CHAT, admission_context
+from src.utils.kernels import interpreter_lock, kernel_processes
+from src.utils.process_limits import cpu_snapshot, kill_tree, turn_usage
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.25
+FLUSH_CHUNKS = 50
+# The answer row is rewritten as a whole, so less often than chunks are appended
+CHAT_SAVE_INTERVAL = 2.0
+POLL_INTERVAL = 0.1
+KEEP_FINISHED_JOBS = 24 * 3600
+WATCHDOG_INTERVAL = 0.5
+
+# Jobs of workers on this host that are gone are looked for this often
+SWEEP_INTERVAL = 60
+# Workers renew the lease of their running jobs this often; a job not renewed for JOB_LEASE_SECONDS lost its worker,
+# whatever host it ran on (a recreated container comes back under another host name and never sweeps the old one's jobs)
+LEASE_RENEW_INTERVAL = 10
+JOB_LEASE_SECONDS = int(os.environ.get("PIPKA_JOB_LEASE_SECONDS", "120"))
+# A job being tailed has its worker checked this often
+LIVENESS_INTERVAL = 2.0
+INTERRUPTED_NOTE = "\n\n[Interrupted: the worker running this answer stopped]\n"
+
+
+def _start_ticks(pid):
+    """Start time of process pid in clock ticks since boot, None when it is not running or there is no /proc."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Field 22; the command name before it is in parentheses and may contain spaces
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+WORKER_HOST = socket.gethostname()
+# With its start time a worker is told apart from a later process that got the same pid
+WORKER = f"{WORKER_HOST}:{os.getpid()}:{_start_ticks(os.getpid()) or 0}"
+
+# Turns of different conversations run side by side, each on its own interpreter
+MAX_CONCURRENT_TURNS = int(os.environ.get("PIPKA_MAX_TURNS", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TURNS, thread_name_prefix="pipka-jobs")
+# Turns on the same interpreter run one after another, every conversation has its own (see kernels.py).
+# Several processes (see docker-compose.yml) share jobs through the database.
+_last_sweep = None
+_init_lock = threading.Lock()
+_renewer = None
+# job id -> (cancel event, interpreter, reason list)
+_active = {}
+
+
+class ExecutionLimits:
+    """Per-turn limits for code the interpreter runs; 0 switches a limit off.
+
+    cpu_seconds counts CPU the kernel and its children use during the turn, memory_mb their resident memory.
+    """
+
+    def __init__(self, wall_seconds=0, cpu_seconds=0, memory_mb=0):
+        self.wall_seconds = wall_seconds
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+
+
+def _worker_alive(worker):
+    """True while the process of a worker on this host runs; worker is host:pid:start (host:pid before)."""
+    pid, *start = worker[len(WORKER_HOST) + 1:].split(':')
+    try:
+        pid = int(pid)
+    except ValueError:
+        return False
+    if start and start[0] != '0' and os.path.isdir('/proc'):
+        return _start_ticks(pid) == start[0]
+    if pid == os.getpid():
+        # An earlier process with this pid; this one has not run any job under that name
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def sweep_jobs(force=False):
+    """Mark running jobs of workers on this host that are gone as interrupted; live siblings keep theirs.
+
+    Runs at most every SWEEP_INTERVAL unless forced; the first call of a process, at startup, always runs.
+    """
+    global _last_sweep
+    # Turns starting together must not mark each other's new jobs as interrupted
+    with _init_lock:
+        if not force and _last_sweep is not None and time.monotonic() - _last_sweep < SWEEP_INTERVAL:
+            return
+        _last_sweep = time.monotonic()
+        interrupt_jobs([worker for worker in get_running_workers(WORKER_HOST) if worker != WORKER and not _worker_alive(worker)])
+        interrupt_expired_jobs(time.time() - JOB_LEASE_SECONDS)
+
+
+def _orphaned(job):
+    """True when job is marked running but its worker is gone: the process exited (on this host) or the lease ran out."""
+    worker = job.get('worker') or ''
+    if job['status'] != 'running' or worker == WORKER:
+        return False
+    if worker.startswith(f"{WORKER_HOST}:") and not _worker_alive(worker):
+        return True
+    return (job.get('renewed') or 0) < time.time() - JOB_LEASE_SECONDS
+
+
+def _renew_leases():
+    while True:
+        time.sleep(LEASE_RENEW_INTERVAL)
+        try:
+            renew_jobs(list(_active))
+        except Exception as e:
+            logger.warning(f"Failed to renew the leases of running jobs: {e}")
+
+
+def _start_renewer():
+    global _renewer
+    with _init_lock:
+        if _renewer is None:
+            _renewer = threading.Thread(target=_renew_leases, name="pipka-job-leases", daemon=True)
+            _renewer.start()
+
+
+def _interrupt_orphaned(job):
+    """Mark job interrupted when its worker is gone; True when it was."""
+    if job is None or not _orphaned(job):
+        return False
+    logger.warning(f"Job {job['id']} of {job['worker']} has no worker any more, marking it interrupted")
+    interrupt_jobs([job['worker']])
+    return True
+
+
+def running_job(conversation_id):
+    """Id of the conversation's running job; None also when its worker is gone, the job is then marked interrupted."""
+    sweep_jobs()
+    job_id = get_running_job(conversation_id)
+    if job_id and _interrupt_orphaned(get_job(job_id)):
+        return None
+    return job_id
+
+
+def _watchdog(job_id, cancel, interpreter, limits):
+    """Stop the turn when its code goes over the wall-clock, CPU or memory limit, or another worker asks to.
+
+    Usage is sampled every WATCHDOG_INTERVAL rather than put on the kernel as rlimits: the kernel outlives the turn,
+    RLIMIT_CPU would add up over all its turns and RLIMIT_AS counts address space that numpy and mmap reserve.
+    """
+    started = time.monotonic()
+    baseline = cpu_snapshot(kernel_processes(interpreter)) if limits.cpu_seconds else {}
+    last = {}
+    while not cancel.wait(WATCHDOG_INTERVAL):
+        if is_job_cancel_requested(job_id):
+            cancel_job(job_id)
+            continue
+        if limits.cpu_seconds or limits.memory_mb:
+            cpu, memory = turn_usage(kernel_processes(interpreter), baseline, last)
+            if limits.cpu_seconds and cpu > limits.cpu_seconds:
+                cancel_job(job_id, f"CPU limit of {limits.cpu_seconds} s reached")
+                continue
+            if limits.memory_mb and memory > limits.memory_mb:
+                cancel_job(job_id, f"memory limit of {limits.memory_mb} MB reached")
+                continue
+        if limits.wall_seconds and time.monotonic() - started > limits.wall_seconds:
+            cancel_job(job_id, f"time limit of {limits.wall_seconds} s reached")
+
+
+def _through(stages, chunks):
+    for stage in stages:
+        chunks = [out for chunk in chunks for out in stage.feed(chunk)]
+    return chunks
+
+
+def _drain(stages):
+    chunks = []
+    for stage in stages:
+        chunks = [out for chunk in chunks for out in stage.feed(chunk)] + stage.drain()
+    return chunks
+
+
+def _run_turn(job_id, chat_id, interpreter, message, format_response, limits, stages, user_id, priority):
+    full_response = ""
+    buffer, next_seq, last_flush = [], 0, time.monotonic()
+    last_save = last_flush
+    status, error = 'done', None
+    cancel, _, reason = _active[job_id]
+
+    def queue_notice(place):
+        # Written at once, the turn shows nothing else while its model call waits in the queue
+        nonlocal buffer, next_seq, last_flush
+        buffer.append({"role": "computer", "type": "queue", "content": place})
+        append_job_chunks(job_id, next_seq, buffer)
+        next_seq += len(buffer)
+        buffer, last_flush = [], time.monotonic()
+
+    try:
+        with interpreter_lock(interpreter), admission_context(user_id, priority, queue_notice):
+            watchdog = threading.Thread(target=_watchdog, args=(job_id, cancel, interpreter, limits), name=f"pipka-watchdog-{job_id}", daemon=True)
+            watchdog.start()
+            # Cancelled while waiting for the interpreter - don't even start
+            stream = interpreter.chat([{"role": "user", "type": "message", "content": message}], display=False, stream=True) \
+                if not cancel.is_set() else iter(())
+            for chunk in stream:
+                if cancel.is_set():
+                    # Closing the generator also closes the LLM stream
+                    stream.close()
+                    break
+                for chunk in _through(stages, [chunk]):
+                    full_response = format_response(chunk, full_response)
+                    buffer.append(chunk)
+                if len(buffer) >= FLUSH_CHUNKS or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                    append_job_chunks(job_id, next_seq, buffer)
+                    next_seq += len(buffer)
+                    buffer, last_flush = [], time.monotonic()
+                if last_flush - last_save >= CHAT_SAVE_INTERVAL:
+                    # What streamed so far survives a crash of the worker
+                    update_chat_content(chat_id, full_response)
+                    last_save = last_flush
+    except Exception as e:
+        if not cancel.is_set():
+            logger.error(f"Job {job_id} failed: {e}")
+            status, error = 'error', str(e)
+            buffer.append({"type": "message", "role": "assistant", "content": f"\n\nError: {e}\n", "end": True})
+            full_response += f"\n\nError: {e}\n"
+    finally:
+        try:
+            for chunk in _drain(stages):
+                full_response = format_response(chunk, full_response)
+                buffer.append(chunk)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed to finish its output: {e}")
+        for stage in stages:
+            stage.close()
+        if cancel.is_set():
+            status, error = 'cancelled', reason[0] if reason else None
+            note = f"\n\n[Stopped: {error}]\n" if error else "\n\n[Stopped]\n"
+            buffer.append({"type": "message", "role": "assistant", "content": note, "end": True})
+            full_response += note
+        else:
+            cancel.set()
+        _active.pop(job_id, None)
+        if buffer:
+            append_job_chunks(job_id, next_seq, buffer)
+        # Saved by the worker, so the answer is kept even when nobody is watching the page
+        update_chat_content(chat_id, full_response)
+        finish_job(job_id, status, error)
+
+
+def start_turn(conversation_id, interpreter, message, format_response, limits=None, stages=(), user_id=None,
+               priority=PRIORITY_CHAT):
+    """Run one interpreter turn in the background; returns the job id to tail.
+
+    stages (e.g. ConsoleLimiter, ImageOutput) rewrite the streamed chunks before they are stored, in order.
+    Each has feed(chunk) -> chunks, drain() -> chunks held back until the end, and close().
+    Model calls of the turn queue for Bedrock as user_id at priority (see admission.py); while one waits,
+    "queue" chunks carry its place in the queue, 0 when it got through.
+    """
+    sweep_jobs()
+    _start_renewer()
+    delete_finished_jobs(time.time() - KEEP_FINISHED_JOBS)
+    job_id = str(uuid.uuid4())
+    # The answer gets its row up front and is filled in while it streams
+    chat_id = save_chat(Chat(conversation_id, "assistant", ""))
+    create_job(job_id, conversation_id, WORKER, chat_id)
+    _active[job_id] = (threading.Event(), interpreter, [])
+    _executor.submit(_run_turn, job_id, chat_id, interpreter, message, format_response, limits or ExecutionLimits(), list(stages),
+                     user_id, priority)
+    return job_id
+
+
+def cancel_job(job_id, reason=None):
+    """Stop a running turn: end the LLM stream and kill the code it is running, including child processes."""
+    active = _active.get(job_id)
+    if active is None:
+        if _interrupt_orphaned(get_job(job_id)):
+            return True
+        # Running in another worker process - its watchdog sees the request
+        request_job_cancel(job_id)
+        return True
+    cancel, interpreter, reasons = active
+    if cancel.is_set():
+        return False
+    if reason:
+        reasons.append(reason)
+    cancel.set()
+    # Found before terminating, which forgets the language processes
+    pids = kernel_processes(interpreter)
+    try:
+        interpreter.computer.terminate()
+    except Exception as e:
+        logger.warning(f"Failed to terminate interpreter languages: {e}")
+    # Kernels of other conversations keep running
+    kill_tree(pids)
+    return True
+
+
+def tail_job(job_id, after_seq=-1):
+    """Yield the job's chunks from the start (or after_seq) until it finishes; works after a page reload too.
+
+    A job whose worker is gone is marked interrupted and ends with a note saying so.
+    """
+    checked = time.monotonic()
+    while True:
+        job = get_job(job_id)
+        chunks = get_job_chunks(job_id, after_seq)
+        for seq, chunk in chunks:
+            after_seq = seq
+            yield chunk
+        if job is None or job['status'] != 'running':
+            # Chunks written between the status read and the chunk read were yielded above
+            if not chunks:
+                return
+            continue
+        if time.monotonic() - checked >= LIVENESS_INTERVAL:
+            checked = time.monotonic()
+            if _interrupt_orphaned(job):
+                yield {"type": "message", "role": "assistant", "content": INTERRUPTED_NOTE, "end": True}
+                return
+        if not chunks:
+            time.sleep(POLL_INTERVAL)
+
+
+async def tail_job_async(job_id, after_seq=-1, heartbeat=0):
+    """tail_job for asyncio servers, yielding (seq, chunk); the database is read in worker threads.
+
+    With heartbeat, (None, None) is yielded after that many seconds without chunks, e.g. to keep a connection alive.
+    """
+    idle_since = checked = time.monotonic()
+    while True:
+        job = await asyncio.to_thread(get_job, job_id)
+        chunks = await asyncio.to_thread(get_job_chunks, job_id, after_seq)
+        for seq, chunk in chunks:
+            after_seq = seq
+            yield seq, chunk
+        if chunks:
+            idle_since = time.monotonic()
+        if job is None or job['status'] != 'running':
+            if not chunks:
+                return
+            continue
+        if time.monotonic() - checked >= LIVENESS_INTERVAL:
+            checked = time.monotonic()
+            if await asyncio.to_thread(_interrupt_orphaned, job):
+                yield after_seq + 1, {"type": "message", "role": "assistant", "content": INTERRUPTED_NOTE, "end": True}
+                return
+        if not chunks:
+            if heartbeat and time.monotonic() - idle_since >= heartbeat:
+                idle_since = time.monotonic()
+                yield None, None
+            await asyncio.sleep(POLL_INTERVAL)
@@ -0,0 +1,227 @@
+# kernels.py
+import os
+import time
+import logging
+import threading
+
+from src.utils.console_output import OUTPUT_MARK
+from src.utils.process_limits import descendants, kill_tree, rss_mb
+
+logger = logging.getLogger(__name__)
+
+# 0 switches a limit off. Idle kernels are closed after the TTL; over the memory cap
+# (all kernels of this process together) the least recently used idle ones are closed first.
+KERNEL_IDLE_MINUTES = int(os.environ.get("PIPKA_KERNEL_IDLE_MINUTES", "30"))
+KERNEL_MEMORY_MB = int(os.environ.get("PIPKA_KERNEL_MEMORY_MB", "4096"))
+REAPER_INTERVAL = 60
+SUMMARY_MAX_VARIABLES = 40
+SUMMARY_TIMEOUT = 5
+
+_SUMMARY_CODE = f'''
+def _pipka_summary():
+    import types
+    skip = {{'In', 'Out', 'exit', 'quit', 'get_ipython'}}
+    for name, value in list(globals().items()):
+        if name.startswith('_') or name in skip:
+            continue
+        kind = type(value).__name__
+        if isinstance(value, types.ModuleType):
+            text = f"module {{value.__name__}}"
+        elif isinstance(value, (types.FunctionType, type)):
+            text = kind
+        elif hasattr(value, 'shape') and hasattr(value, 'dtype') or hasattr(value, 'columns'):
+            text = f"{{kind}} shape {{tuple(getattr(value, 'shape', ()))}}"
+            if hasattr(value, 'columns'):
+                columns = [str(c) for c in list(value.columns)[:10]]
+                text += f", columns {{columns}}" + (" ..." if len(value.columns) > 10 else "")
+        elif isinstance(value, (bool, int, float, complex)) or value is None or isinstance(value, str) and len(value) <= 60:
+            text = f"{{kind}} = {{value!r}}"
+        elif hasattr(value, '__len__'):
+            text = f"{{kind}} of length {{len(value)}}"
+        else:
+            text = kind
+        print("{OUTPUT_MARK}" + name + ": " + text)
+_pipka_summary()
+del _pipka_summary
+'''
+
+_lock = threading.Lock()
+# conversation id -> Kernel
+_kernels = {}
+# conversation id -> why its kernel was closed, told to the model once
+_closed = {}
+_reaper = None
+
+
+class Kernel:
+    """An interpreter with its own language processes, kept alive between the turns of one conversation."""
+
+    def __init__(self, conversation_id):
+        # Imported with the first kernel: jobs.py and the API use this module before any interpreter is needed
+        from interpreter import OpenInterpreter
+
+        self.conversation_id = conversation_id
+        self.interpreter = OpenInterpreter()
+        # Held while a turn runs; the reaper never closes a kernel it cannot take
+        self.interpreter.pipka_lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.closed_because = _closed.pop(conversation_id, None)
+
+
+def interpreter_lock(interpreter):
+    """The lock serializing turns on interpreter; interpreters not made here get one too."""
+    lock = getattr(interpreter, 'pipka_lock', None)
+    if lock is None:
+        with _lock:
+            lock = getattr(interpreter, 'pipka_lock', None)
+            if lock is None:
+                lock = interpreter.pipka_lock = threading.Lock()
+    return lock
+
+
+def _active_languages(interpreter):
+    try:
+        return list(interpreter.computer.terminal._active_languages.values())
+    except AttributeError:
+        return []
+
+
+def _language_pid(language):
+    # Jupyter based languages (Python) run a kernel, the others a plain subprocess
+    manager = getattr(language, 'km', None)
+    if manager is not None:
+        process = getattr(getattr(manager, 'provisioner', None), 'process', None) or getattr(manager, 'kernel', None)
+    else:
+        process = getattr(language, 'process', None)
+    return getattr(process, 'pid', None)
+
+
+def kernel_processes(interpreter):
+    """Pids of the language processes of interpreter and everything they started.
+
+    Languages whose process cannot be found are left out rather than guessed, a guess could hit other processes.
+    """
+    pids = []
+    for language in _active_languages(interpreter):
+        pid = _language_pid(language)
+        if pid is None:
+            logger.debug(f"No process found for {type(language).__name__}, it is not limited or stopped with the turn")
+            continue
+        pids.append(pid)
+        pids.extend(descendants(pid))
+    return pids
+
+
+def kernel_for(conversation_id):
+    """The conversation's kernel interpreter, started when it has none."""
+    with _lock:
+        kernel = _kernels.get(conversation_id)
+        if kernel is None:
+            kernel = _kernels[conversation_id] = Kernel(conversation_id)
+        kernel.last_used = time.monotonic()
+    _start_reaper()
+    return kernel.interpreter
+
+
+def _close(kernel, reason):
+    pids = kernel_processes(kernel.interpreter)
+    try:
+        kernel.interpreter.computer.terminate()
+    except Exception as e:
+        logger.warning(f"Failed to terminate kernel of {kernel.conversation_id}: {e}")
+    kill_tree(pids)
+    logger.info(f"Closed kernel of {kernel.conversation_id}: {reason}")
+
+
+def close_kernel(conversation_id, reason=None):
+    with _lock:
+        kernel = _kernels.pop(conversation_id, None)
+        if kernel is not None and reason:
+            _closed[conversation_id] = reason
+    if kernel is not None:
+        _close(kernel, reason or "closed")
+
+
+def _reap():
+    now = time.monotonic()
+    with _lock:
+        kernels = sorted(_kernels.values(), key=lambda kernel: kernel.last_used)
+    usage = {kernel: sum(rss_mb(pid) for pid in kernel_processes(kernel.interpreter)) for kernel in kernels}
+    total = sum(usage.values())
+    for kernel in kernels:
+        idle = KERNEL_IDLE_MINUTES and now - kernel.last_used > KERNEL_IDLE_MINUTES * 60
+        if idle:
+            reason = f"idle for more than {KERNEL_IDLE_MINUTES} minutes"
+        elif KERNEL_MEMORY_MB and total > KERNEL_MEMORY_MB:
+            reason = f"kernels used more than {KERNEL_MEMORY_MB} MB of memory"
+        else:
+            continue
+        lock = interpreter_lock(kernel.interpreter)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            with _lock:
+                # Used again since the snapshot above
+                if _kernels.get(kernel.conversation_id) is not kernel or kernel.last_used > now:
+                    continue
+                _kernels.pop(kernel.conversation_id)
+                _closed[kernel.conversation_id] = reason
+            _close(kernel, reason)
+            total -= usage[kernel]
+        finally:
+            lock.release()
+
+
+def _run_reaper():
+    while True:
+        time.sleep(REAPER_INTERVAL)
+        try:
+            _reap()
+        except Exception as e:
+            logger.error(f"Kernel reaper failed: {e}")
+
+
+def _start_reaper():
+    global _reaper
+    with _lock:
+        if _reaper is None and (KERNEL_IDLE_MINUTES or KERNEL_MEMORY_MB):
+            _reaper = threading.Thread(target=_run_reaper, name="pipka-kernels", daemon=True)
+            _reaper.start()
+
+
+def _variables(interpreter):
+    """Summary lines of the variables defined in the Python kernel; [] when it is not running or busy."""
+    if not any(getattr(language, 'name', '').lower() == 'python' for language in _active_languages(interpreter)):
+        return []
+    lock = interpreter_lock(interpreter)
+    if not lock.acquire(timeout=SUMMARY_TIMEOUT):
+        return []
+    try:
+        output = interpreter.computer.run('python', _SUMMARY_CODE, display=False)
+    except Exception as e:
+        logger.warning(f"Failed to summarize kernel variables: {e}")
+        return []
+    finally:
+        lock.release()
+    text = ''.join(chunk.get('content') or '' for chunk in output if chunk.get('format') == 'output')
+    return [line[len(OUTPUT_MARK):] for line in text.splitlines() if line.startswith(OUTPUT_MARK)]
+
+
+def kernel_context(conversation_id):
+    """Prompt section telling the model what its Python session still holds from earlier turns."""
+    with _lock:
+        kernel = _kernels.get(conversation_id)
+    if kernel is None:
+        return ""
+    context = ""
+    if kernel.closed_because:
+        context += (f"Your Python session was restarted ({kernel.closed_because}); "
+                    "variables and imports from earlier turns are gone, load what you need again.\n ---\n")
+        kernel.closed_because = None
+    variables = _variables(kernel.interpreter)
+    if variables:
+        shown = variables[:SUMMARY_MAX_VARIABLES]
+        more = f"\n... and {len(variables) - len(shown)} more" if len(variables) > len(shown) else ""
+        context += ("Your Python session from earlier turns is still running; these variables and imports are defined, "
+                    "use them instead of loading the data again:\n" + '\n'.join(shown) + more + "\n ---\n")
+    return context
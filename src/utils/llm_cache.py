@@ -0,0 +1,169 @@
+# llm_cache.py
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import closing
+
+from src.utils.workspace import WORKSPACE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Off unless switched on in the sidebar (or the API request); this turns it on by default
+ENABLED_BY_DEFAULT = os.environ.get("PIPKA_LLM_CACHE", "0") == "1"
+CACHE_FILE = os.path.join(WORKSPACE_DIR, '.llm_cache.db')
+TTL_SECONDS = float(os.environ.get("PIPKA_LLM_CACHE_HOURS", "24")) * 3600
+MAX_ENTRIES = int(os.environ.get("PIPKA_LLM_CACHE_ENTRIES", "5000"))
+# Above this the same request is meant to give a different answer each time
+MAX_TEMPERATURE = 0.3
+# Expired and least recently used entries are deleted every so many writes
+EVICT_EVERY = 50
+# Request parameters that change the answer, besides the model, temperature and messages
+KEY_PARAMS = ('top_p', 'max_tokens', 'stop', 'tools', 'functions', 'tool_choice', 'response_format')
+
+_lock = threading.Lock()
+_ready = False
+_writes = 0
+
+
+class CacheStats:
+    """Model calls of one turn and how many of them the cache answered."""
+
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.saved_seconds = 0.0
+
+    def as_dict(self):
+        return {"llm_calls": self.calls, "cache_hits": self.hits, "seconds_saved": round(self.saved_seconds, 1)}
+
+
+def cacheable(temperature):
+    return temperature is not None and float(temperature) <= MAX_TEMPERATURE
+
+
+def _normalize(value):
+    # Whitespace at line ends and message ids do not change what the model is asked
+    if isinstance(value, str):
+        return re.sub(r'[ \t]+(?=\n)', '', value.replace('\r\n', '\n')).strip()
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items() if key not in ('id', 'cache_control')}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def request_key(user_id, model, temperature, system, messages, **params):
+    # The user is part of the key: one user's answers, which may quote their files, are never replayed to another
+    payload = {
+        "user": user_id,
+        "model": model,
+        "temperature": round(float(temperature), 2),
+        "system": _normalize(system),
+        "messages": _normalize(messages),
+        "params": {name: _normalize(value) for name, value in params.items() if value is not None},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _connect():
+    global _ready
+    connection = sqlite3.connect(CACHE_FILE, timeout=10)
+    if not _ready:
+        with _lock:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS responses "
+                               "(key TEXT PRIMARY KEY, model TEXT, value BLOB, created REAL, used REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+            connection.commit()
+            _ready = True
+    return connection
+
+
+def get(key):
+    """The stored value, or None when there is none younger than the TTL."""
+    now = time.time()
+    try:
+        with closing(_connect()) as connection, connection:
+            row = connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > TTL_SECONDS:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            connection.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(row[0]))
+    except (sqlite3.Error, zlib.error, ValueError) as e:
+        logger.warning(f"LLM cache read failed: {e}")
+        return None
+
+
+def put(key, model, value):
+    """Store a JSON serializable value; evicts expired and least recently used entries now and then."""
+    global _writes
+    try:
+        data = zlib.compress(json.dumps(value).encode())
+    except (TypeError, ValueError) as e:
+        logger.warning(f"LLM response of {model} not cached: {e}")
+        return
+    now = time.time()
+    with _lock:
+        _writes += 1
+        evict = (_writes - 1) % EVICT_EVERY == 0
+    try:
+        with closing(_connect()) as connection, connection:
+            connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, model, data, now, now))
+            if evict:
+                connection.execute("DELETE FROM responses WHERE created < ?", (now - TTL_SECONDS,))
+                connection.execute("DELETE FROM responses WHERE key IN "
+                                   "(SELECT key FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)", (MAX_ENTRIES,))
+    except sqlite3.Error as e:
+        logger.warning(f"LLM cache write failed: {e}")
+
+
+def _plain(chunk):
+    # LiteLLM streams pydantic objects; they are stored, and replayed, as the dicts they read like
+    if hasattr(chunk, 'model_dump'):
+        return chunk.model_dump()
+    return json.loads(json.dumps(chunk))
+
+
+def cached_completions(completions, user_id, model, temperature=None, stats=None):
+    """Wrap a LiteLLM style completions(**params) generator so a repeated low temperature request replays the stored stream.
+
+    The key uses model (the chosen one, not the one a fallback answered with), so 'auto' turns share their entries.
+    A stream is stored only when it was read to its end.
+    """
+    def run(**params):
+        if stats is not None:
+            stats.calls += 1
+        request_temperature = params.get('temperature', temperature)
+        if not cacheable(request_temperature):
+            yield from completions(**params)
+            return
+        key = request_key(user_id, model, request_temperature, None, params.get('messages'),
+                          **{name: params.get(name) for name in KEY_PARAMS})
+        cached = get(key)
+        if cached is not None:
+            if stats is not None:
+                stats.hits += 1
+                stats.saved_seconds += cached.get('seconds', 0.0)
+            yield from cached['chunks']
+            return
+        started = time.monotonic()
+        chunks = []
+        for chunk in completions(**params):
+            if chunks is not None:
+                try:
+                    chunks.append(_plain(chunk))
+                except (TypeError, ValueError):
+                    chunks = None
+            yield chunk
+        if chunks:
+            put(key, model, {"chunks": chunks, "seconds": time.monotonic() - started})
+    return run
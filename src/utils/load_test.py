@@ -0,0 +1,167 @@
+"""Load test of the headless API: python -m src.utils.load_test --clients 50 --turns 3
+
+Without --url the API runs in this process on a throwaway workspace, with a stubbed model that streams a
+canned answer (text, a code block and its output) at a given speed, so no Bedrock calls are made.
+With --url it drives a running server; the model is then whatever that server uses.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import secrets
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+
+import httpx
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubInterpreter:
+    """Stands in for an Open Interpreter: chat() streams a canned answer, words at a fixed rate."""
+
+    def __init__(self, first_token_seconds, tokens, token_seconds):
+        self.first_token_seconds = first_token_seconds
+        self.tokens = tokens
+        self.token_seconds = token_seconds
+        self.llm = SimpleNamespace()
+        self.computer = SimpleNamespace(terminate=lambda: None)
+        self.messages = []
+
+    def chat(self, messages, display=False, stream=True):
+        time.sleep(self.first_token_seconds)
+        yield {"role": "assistant", "type": "message", "start": True}
+        for i in range(self.tokens):
+            yield {"role": "assistant", "type": "message", "content": f"word{i} "}
+            time.sleep(self.token_seconds)
+        yield {"role": "assistant", "type": "message", "end": True}
+        yield {"role": "assistant", "type": "code", "format": "python", "start": True}
+        yield {"role": "assistant", "type": "code", "format": "python", "content": "print(sum(range(10)))"}
+        yield {"role": "assistant", "type": "code", "format": "python", "end": True}
+        yield {"role": "computer", "type": "console", "start": True}
+        yield {"role": "computer", "type": "console", "format": "output", "content": "45\n"}
+        yield {"role": "computer", "type": "console", "end": True}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_stub_server(args):
+    # Everything the server writes (database, workspaces) goes to a temporary directory
+    os.environ.setdefault("PIPKA_MODELS_FILE", os.path.join(REPO_DIR, "models.json"))
+    os.chdir(tempfile.mkdtemp(prefix="pipka-load-test-"))
+    os.makedirs("workspace")
+    sys.path.insert(0, REPO_DIR)
+    # Read when the API module is imported; clients sign their user tokens with it
+    args.token = args.token or secrets.token_hex(16)
+    os.environ["PIPKA_API_TOKEN"] = args.token
+    import uvicorn
+    from src.utils.api_server import create_app
+
+    interpreters = {}
+
+    def interpreter_for(conversation_id):
+        return interpreters.setdefault(conversation_id, StubInterpreter(args.first_token, args.tokens, args.token_delay))
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(interpreter_for), host="127.0.0.1", port=port,
+                                           lifespan="off", log_level="warning"))
+    threading.Thread(target=server.run, name="pipka-load-test-server", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    print(f"Stub server on port {port}, workspace in {os.getcwd()}")
+    return f"http://127.0.0.1:{port}"
+
+
+async def _turn(client, user, conversation_id, index):
+    """(seconds to the first chunk, seconds to done, chunks, conversation id, error)."""
+    started = time.monotonic()
+    first, chunks, status = None, 0, None
+    body = {"message": f"Load test message {index}", "recall_token_budget": 0}
+    if conversation_id:
+        body["conversation_id"] = conversation_id
+    async with client.stream("POST", "/chat", json=body) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return None, None, 0, conversation_id, f"HTTP {response.status_code}: {response.text[:200]}"
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                data = json.loads(line[6:])
+                if event == "job":
+                    conversation_id = data["conversation_id"]
+                elif event == "chunk":
+                    chunks += 1
+                    if first is None:
+                        first = time.monotonic() - started
+                elif event == "done":
+                    status = data["status"]
+    error = None if status == "done" else f"turn ended with status {status}"
+    return first, time.monotonic() - started, chunks, conversation_id, error
+
+
+async def _client(base_url, index, turns, results, token):
+    from src.utils.api_server import user_token
+    user = f"load-test-{index}@example.com"
+    conversation_id = None
+    headers = {"Authorization": f"Bearer {user_token(user, token)}"}
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, headers=headers) as client:
+        for turn in range(turns):
+            try:
+                first, total, chunks, conversation_id, error = await _turn(client, user, conversation_id, turn)
+            except httpx.HTTPError as e:
+                first, total, chunks, error = None, None, 0, str(e)
+            results.append((first, total, chunks, error))
+
+
+def _percentiles(values):
+    if not values:
+        return "-"
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(p * len(values)))]
+    return f"p50 {pick(0.5):.3f} s, p95 {pick(0.95):.3f} s, p99 {pick(0.99):.3f} s, max {values[-1]:.3f} s"
+
+
+async def _run(base_url, args):
+    results = []
+    started = time.monotonic()
+    await asyncio.gather(*[_client(base_url, i, args.turns, results, args.token) for i in range(args.clients)])
+    elapsed = time.monotonic() - started
+    errors = [error for *_, error in results if error]
+    print(f"{len(results)} turns by {args.clients} clients in {elapsed:.1f} s ({len(results) / elapsed:.1f} turns/s), "
+          f"{sum(chunks for _, _, chunks, _ in results)} chunks, {len(errors)} errors")
+    print(f"first chunk: {_percentiles([first for first, *_ in results if first is not None])}")
+    print(f"whole turn:  {_percentiles([total for _, total, _, error in results if total is not None and not error])}")
+    for error in sorted(set(errors))[:10]:
+        print(f"error: {error}")
+    return 1 if errors else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="API to test, e.g. http://localhost:8503; default: in-process server with a stubbed model")
+    parser.add_argument("--token", default=os.environ.get("PIPKA_API_TOKEN", ""),
+                        help="PIPKA_API_TOKEN of the server, every client signs its own user token with it")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients, each with its own user and conversation")
+    parser.add_argument("--turns", type=int, default=3, help="turns per client, one after another")
+    parser.add_argument("--first-token", type=float, default=0.5, help="stub: seconds until the first token")
+    parser.add_argument("--tokens", type=int, default=100, help="stub: words per answer")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="stub: seconds between words")
+    args = parser.parse_args()
+    if args.url and not args.token:
+        parser.error("--url needs --token (or PIPKA_API_TOKEN)")
+    base_url = args.url.rstrip('/') if args.url else _start_stub_server(args)
+    sys.exit(asyncio.run(_run(base_url, args)))
+
+
+if __name__ == "__main__":
+    main()
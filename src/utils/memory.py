@@ -0,0 +1,94 @@
+# memory.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.data.database import get_chats_by_ids, get_chats_without_embedding, get_embeddings, save_embeddings, strip_images
+from src.utils.admission import PRIORITY_BACKGROUND, admission_context
+from src.utils.embeddings import embed_texts, embedding_model
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+MIN_SIMILARITY = 0.25
+MAX_SNIPPET_CHARS = 1200
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipka-memory")
+_lock = threading.Lock()
+_pending = set()
+
+
+def index_chats(user_id, batch_size=64):
+    """Embed stored chats that have no vector yet; only new rows are touched."""
+    model = embedding_model()
+    while True:
+        rows = get_chats_without_embedding(user_id, model, batch_size)
+        if not rows:
+            return
+        vectors = embed_texts([strip_images(content) for _, content in rows])
+        save_embeddings(model, [(chat_id, vector.tobytes()) for (chat_id, _), vector in zip(rows, vectors)])
+        if len(rows) < batch_size:
+            return
+
+
+def _index(user_id):
+    try:
+        # Embedding calls wait behind the user's chat turns
+        with admission_context(user_id, PRIORITY_BACKGROUND):
+            index_chats(user_id)
+    except Exception as e:
+        logger.warning(f"Indexing chats of {user_id} failed: {e}")
+    finally:
+        with _lock:
+            _pending.discard(user_id)
+
+
+def schedule_index(user_id):
+    """Embed the user's unindexed chats in the background; a turn never waits for the backlog."""
+    with _lock:
+        if user_id in _pending:
+            return
+        _pending.add(user_id)
+    _executor.submit(_index, user_id)
+
+
+def recall(user_id, query, token_budget, exclude=(), top_k=8):
+    """Most relevant past messages of the user that fit into token_budget, best match first.
+
+    Only chats indexed so far are searched; new ones are indexed in the background for later turns.
+    """
+    if token_budget <= 0:
+        return []
+    try:
+        schedule_index(user_id)
+        stored = get_embeddings(user_id, embedding_model(), {item.get("id") for item in exclude})
+        if not stored:
+            return []
+        chat_ids = [chat_id for chat_id, _ in stored]
+        matrix = np.frombuffer(b''.join(vector for _, vector in stored), dtype=np.float32).reshape(len(stored), -1)
+        scores = matrix @ embed_texts([query])[0]
+        best = [i for i in np.argsort(-scores)[:top_k * 2] if scores[i] >= MIN_SIMILARITY]
+        if not best:
+            return []
+        chats = get_chats_by_ids([chat_ids[i] for i in best])
+    except Exception as e:
+        logger.warning(f"Memory recall failed: {e}")
+        return []
+
+    excluded_contents = {item.get("content") for item in exclude}
+    budget = token_budget * CHARS_PER_TOKEN
+    snippets = []
+    for i in best:
+        chat = chats.get(chat_ids[i])
+        if chat is None or chat["content"] in excluded_contents:
+            continue
+        text = strip_images(chat["content"])[:MAX_SNIPPET_CHARS]
+        if len(text) > budget:
+            break
+        budget -= len(text)
+        snippets.append({**chat, "content": text, "score": float(scores[i])})
+        if len(snippets) == top_k:
+            break
+    return snippets
@@ -0,0 +1,249 @@
+# packages.py
+import os
+import sys
+import json
+import venv
+import logging
+import threading
+import subprocess
+import sysconfig
+from importlib import metadata
+
+from src.utils.workspace import WORKSPACE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Per user, in the user's workspace on the volume, so it outlives container restarts and no user imports another's code
+PACKAGES_DIR = '.packages'
+WHEELS_DIR = 'wheels'
+PIP_CACHE_DIR = 'cache'
+RECORD_FILE = 'installed.json'
+# A venv only works with the Python it was made with, so the version is part of its name
+VENV_NAME = f"venv-py{sys.version_info.major}.{sys.version_info.minor}"
+# Where all users' packages went before they were kept apart; read once to move a user's record over
+SHARED_RECORD_FILE = os.path.join(WORKSPACE_DIR, PACKAGES_DIR, RECORD_FILE)
+PIP_TIMEOUT = 900
+
+_lock = threading.Lock()
+# real path of a workspace -> its environment is being or was prepared in this process
+_prepared = set()
+# site-packages directory -> (state of the site directories, installed_packages() result)
+_installed = {}
+_scan_lock = threading.Lock()
+# Held while a language process starts with a user's environment in os.environ
+_environment_lock = threading.RLock()
+
+
+def _packages_dir(workspace_dir):
+    return os.path.join(os.path.abspath(workspace_dir), PACKAGES_DIR)
+
+
+def _venv_dir(workspace_dir):
+    return os.path.join(_packages_dir(workspace_dir), VENV_NAME)
+
+
+def _venv_site_packages(workspace_dir):
+    venv_dir = _venv_dir(workspace_dir)
+    return sysconfig.get_path('purelib', vars={'base': venv_dir, 'platbase': venv_dir})
+
+
+def _venv_python(workspace_dir):
+    return os.path.join(_venv_dir(workspace_dir), 'bin', 'python')
+
+
+def environment(workspace_dir):
+    """Environment variables pointing pip and the kernel's code at the user's package layer."""
+    packages_dir = _packages_dir(workspace_dir)
+    venv_dir = _venv_dir(workspace_dir)
+    return {
+        'PIP_CACHE_DIR': os.path.join(packages_dir, PIP_CACHE_DIR),
+        'PIP_FIND_LINKS': os.path.join(packages_dir, WHEELS_DIR),
+        'VIRTUAL_ENV': venv_dir,
+        # pip in a shell installs into the venv, and the kernel imports from it
+        'PATH': f"{os.path.join(venv_dir, 'bin')}{os.pathsep}{os.environ.get('PATH', '')}",
+        'PYTHONPATH': os.pathsep.join(filter(None, [_venv_site_packages(workspace_dir), os.environ.get('PYTHONPATH')])),
+    }
+
+
+def _site_state(path):
+    # Installing or removing a distribution adds or removes its .dist-info directory
+    state = []
+    for directory in path:
+        try:
+            state.append((directory, os.stat(directory).st_mtime_ns))
+        except OSError:
+            continue
+    return tuple(state)
+
+
+def installed_packages(workspace_dir):
+    """{normalized name: version} of everything the user's kernel code can import, their venv included."""
+    site = _venv_site_packages(workspace_dir)
+    path = [site] + sys.path
+    # Reading every distribution's metadata takes a while and runs twice per turn;
+    # turns starting together wait for one scan instead of all scanning at once
+    with _scan_lock:
+        state = _site_state(path)
+        cached = _installed.get(site)
+        if cached is None or cached[0] != state:
+            packages = {}
+            for distribution in metadata.distributions(path=path):
+                name = distribution.metadata['Name']
+                if name:
+                    # The first one found wins, like on import
+                    packages.setdefault(name.lower().replace('_', '-'), distribution.version)
+            cached = _installed[site] = (state, packages)
+        return dict(cached[1])
+
+
+def _load_record(workspace_dir, user_id=None):
+    try:
+        with open(os.path.join(_packages_dir(workspace_dir), RECORD_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    if not user_id:
+        return {}
+    try:
+        with open(SHARED_RECORD_FILE, 'r') as f:
+            return json.load(f).get(user_id) or {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_record(workspace_dir, record):
+    path = os.path.join(_packages_dir(workspace_dir), RECORD_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(record, f, indent=1, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def _pip(workspace_dir, *args):
+    command = [_venv_python(workspace_dir), '-m', 'pip', '--disable-pip-version-check', *args]
+    result = subprocess.run(command, capture_output=True, text=True, timeout=PIP_TIMEOUT,
+                            env=dict(os.environ, **environment(workspace_dir)))
+    if result.returncode != 0:
+        logger.warning(f"{' '.join(command[3:])} failed: {result.stderr.strip()[-500:]}")
+    return result.returncode == 0
+
+
+def _cache_wheels(workspace_dir, requirements):
+    # pip's own cache keeps the wheels it built, the wheelhouse makes them installable without an index
+    wheels = os.path.join(_packages_dir(workspace_dir), WHEELS_DIR)
+    os.makedirs(wheels, exist_ok=True)
+    _pip(workspace_dir, 'wheel', '--no-deps', '--wheel-dir', wheels, *requirements)
+
+
+def _restore(workspace_dir, record):
+    """Install what the user installed before and is missing now - from their wheelhouse when possible."""
+    present = installed_packages(workspace_dir)
+    missing = [f"{name}=={version}" for name, version in sorted(record.items()) if present.get(name) != version]
+    if not missing:
+        return
+    logger.info(f"Restoring {len(missing)} packages into {_venv_dir(workspace_dir)}")
+    wheels = os.path.join(_packages_dir(workspace_dir), WHEELS_DIR)
+    if not _pip(workspace_dir, 'install', '--no-deps', '--no-index', '--find-links', wheels, *missing):
+        _pip(workspace_dir, 'install', '--no-deps', '--find-links', wheels, *missing)
+
+
+def _prepare(workspace_dir, user_id):
+    try:
+        if not os.path.exists(_venv_python(workspace_dir)):
+            # System site packages stay visible, the venv only holds what the user adds
+            venv.create(_venv_dir(workspace_dir), system_site_packages=True, with_pip=True)
+        record = _load_record(workspace_dir, user_id)
+        if record:
+            _save_record(workspace_dir, record)
+        _restore(workspace_dir, record)
+    except Exception as e:
+        logger.error(f"Failed to prepare the package environment of {workspace_dir}: {e}")
+
+
+def prepare_environment(workspace_dir, user_id=None):
+    """Make sure the user's package layer exists, rebuilding it in the background; once per workspace and process."""
+    key = os.path.realpath(workspace_dir)
+    with _lock:
+        if key in _prepared:
+            return
+        _prepared.add(key)
+    # Exists before any kernel starts: Python skips sys.path entries that are missing when it starts
+    os.makedirs(_venv_site_packages(workspace_dir), exist_ok=True)
+    threading.Thread(target=_prepare, args=(workspace_dir, user_id), name="pipka-packages", daemon=True).start()
+
+
+def _with_environment(language, variables):
+    """Subclass of an Open Interpreter language class whose processes start with variables in their environment.
+
+    Languages read os.environ when they start their process (Jupyter in __init__, the others in start_process),
+    so it is swapped for that moment, under a lock, instead of for the whole worker.
+    """
+    def started(method):
+        def run(self, *args, **kwargs):
+            with _environment_lock:
+                saved = {name: os.environ.get(name) for name in variables}
+                os.environ.update(variables)
+                try:
+                    return method(self, *args, **kwargs)
+                finally:
+                    # Only the variables set here: other threads keep reading the rest meanwhile
+                    for name, value in saved.items():
+                        if value is None:
+                            os.environ.pop(name, None)
+                        else:
+                            os.environ[name] = value
+        return run
+
+    namespace = {'__init__': started(language.__init__), 'pipka_language': language, 'pipka_environment': variables}
+    if hasattr(language, 'start_process'):
+        namespace['start_process'] = started(language.start_process)
+    return type(language.__name__, (language,), namespace)
+
+
+def use_environment(interpreter, workspace_dir, user_id=None):
+    """Have the language processes interpreter starts from now on use the user's package layer.
+
+    Processes already running keep the environment they started with; a kernel belongs to one conversation,
+    so to one user, and is bound on its first turn.
+    """
+    prepare_environment(workspace_dir, user_id)
+    variables = environment(workspace_dir)
+    try:
+        terminal = interpreter.computer.terminal
+        languages = terminal.languages
+    except AttributeError:
+        logger.warning("This Open Interpreter has no terminal languages, installed packages are not kept per user")
+        return
+    if all(getattr(language, 'pipka_environment', None) == variables for language in languages):
+        return
+    terminal.languages = [_with_environment(getattr(language, 'pipka_language', language), variables) for language in languages]
+
+
+class PackageRecorder:
+    """Job stage that records the packages a turn installed for the user and caches their wheels."""
+
+    def __init__(self, user_id, workspace_dir):
+        self.user_id = user_id
+        self.workspace_dir = workspace_dir
+        self._before = installed_packages(workspace_dir)
+
+    def feed(self, chunk):
+        return [chunk]
+
+    def drain(self):
+        return []
+
+    def close(self):
+        added = {name: version for name, version in installed_packages(self.workspace_dir).items()
+                 if self._before.get(name) != version}
+        if not added:
+            return
+        with _lock:
+            record = _load_record(self.workspace_dir, self.user_id)
+            record.update(added)
+            _save_record(self.workspace_dir, record)
+        logger.info(f"Recorded packages for {self.user_id}: {added}")
+        threading.Thread(
+            target=_cache_wheels, args=(self.workspace_dir, [f"{name}=={version}" for name, version in added.items()]),
+            name="pipka-wheels", daemon=True
+        ).start()
@@ -0,0 +1,99 @@
+# process_limits.py
+import os
+import time
+import signal
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+KILL_GRACE_SECONDS = 2
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _read_stat(pid):
+    with open(f"/proc/{pid}/stat", "r") as f:
+        # The command name may contain spaces, fields after it are fixed
+        return f.read().rsplit(')', 1)[1].split()
+
+
+def descendants(pid=None):
+    """All live descendant pids of pid (this process by default), read from /proc."""
+    pid = pid or os.getpid()
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            children.setdefault(int(_read_stat(entry)[1]), []).append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    found, stack = [], list(children.get(pid, []))
+    while stack:
+        child = stack.pop()
+        found.append(child)
+        stack.extend(children.get(child, []))
+    return found
+
+
+def _alive(pid):
+    try:
+        return _read_stat(pid)[0] != 'Z'
+    except (OSError, IndexError):
+        return False
+
+
+def cpu_seconds(pid):
+    stat = _read_stat(pid)
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+    return (int(stat[11]) + int(stat[12])) / CLOCK_TICKS
+
+
+def rss_mb(pid):
+    """Resident memory of a process in MB, 0 when it is gone."""
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / (1024 * 1024)
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def cpu_snapshot(pids):
+    """{pid: CPU seconds used so far} of those pids that still run."""
+    snapshot = {}
+    for pid in pids:
+        try:
+            snapshot[pid] = cpu_seconds(pid)
+        except (OSError, IndexError, ValueError):
+            continue
+    return snapshot
+
+
+def turn_usage(pids, baseline, last):
+    """(CPU seconds used since baseline, resident MB now) of pids.
+
+    baseline is the cpu_snapshot from the start of the turn, pids started later count from 0. last keeps the CPU
+    seconds each pid was last seen with, so processes that exited during the turn still count.
+    """
+    last.update(cpu_snapshot(pids))
+    return sum(used - baseline.get(pid, 0.0) for pid, used in last.items()), sum(rss_mb(pid) for pid in pids)
+
+
+def kill_tree(pids):
+    """SIGTERM the processes, then SIGKILL whatever is still alive after a grace period."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        alive = []
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+                alive.append(pid)
+            except ProcessLookupError:
+                continue
+            except PermissionError as e:
+                logger.warning(f"Failed to kill process {pid}: {e}")
+        if not alive or sig == signal.SIGKILL:
+            return
+        deadline = time.monotonic() + KILL_GRACE_SECONDS
+        while time.monotonic() < deadline and any(_alive(pid) for pid in alive):
+            time.sleep(0.1)
+        pids = [pid for pid in alive if _alive(pid)]
@@ -12,9 +12,14 @@ class PROMPTS:
         But when you have to create a file because the user ask for it, you have to **ALWAYS* create it *WITHIN* the folder *'./workspace'*,
         that is in the current directory even if the user ask you to write in another part of the directory, 
         do not ask to the user if they want to write it there.
-        You can access the internet. You can install new packages. Try to install all necessary packages in one command at the beginning.
+        You can access the internet. You can install new packages. Packages installed with pip are kept between sessions,
+        so first check which of the needed packages are already importable and install only the missing ones, in one command.
         When a user refers to a filename, always they're likely referring to an existing file in the folder *'./workspace'*
         that is located in the directory you're currently executing code in.
+        A CSV/Excel file in './workspace' may have a Parquet copy in './workspace/.columnar/' named after it (e.g. 'data.csv.parquet',
+        'book.xlsx.Sheet1.parquet'); when it exists, load it with pandas.read_parquet instead of parsing the original again.
+        Your Python session is kept between messages of the same conversation: variables, loaded data and imports from
+        earlier code blocks are still there (you're told which), so reuse them instead of reading the files again.
         In general, choose packages that have the most universal chance to be already installed and to work across multiple applications.
         Packages like ffmpeg and pandoc that are well-supported and powerful.
         Write messages to the user in Markdown. Write code on multiple lines with proper indentation for readability.
@@ -38,9 +43,14 @@ class PROMPTS:
         But when you have to create a file because the user ask for it, you have to **ALWAYS* create it *WITHIN* the folder *'./workspace'* that is in 
         the current directory even if the user ask you to write in another part of the directory, do not ask to the user if they want to write it there.
         You can access the internet. 
-        You can install new packages only after confirmation. Try to install all necessary packages in one command at the beginning.
+        You can install new packages only after confirmation. Packages installed with pip are kept between sessions,
+        so first check which of the needed packages are already importable and install only the missing ones, in one command.
         When a user refers to a filename, always they're likely referring to an existing file in the folder *'./workspace'* or 
         is located in the directory you're currently executing code in.
+        A CSV/Excel file in './workspace' may have a Parquet copy in './workspace/.columnar/' named after it (e.g. 'data.csv.parquet',
+        'book.xlsx.Sheet1.parquet'); when it exists, load it with pandas.read_parquet instead of parsing the original again.
+        Your Python session is kept between messages of the same conversation: variables, loaded data and imports from
+        earlier code blocks are still there (you're told which), so reuse them instead of reading the files again.
         In general, choose packages that have the most universal chance to be already installed and to work across multiple applications.
         Packages like ffmpeg and pandoc that are well-supported and powerful.
         Write messages to the user in Markdown. Write code on multiple lines with proper indentation for readability.
@@ -67,7 +77,8 @@ class PROMPTS:
         But when you have to create a file because the user ask for it, you have to **ALWAYS* create it *WITHIN* the folder *'./workspace'*,
         that is in the current directory even if the user ask you to write in another part of the directory, 
         do not ask to the user if they want to write it there.
-        You can access the internet. You can install new packages. Try to install all necessary packages in one command at the beginning.
+        You can access the internet. You can install new packages. Packages installed with pip are kept between sessions,
+        so first check which of the needed packages are already importable and install only the missing ones, in one command.
         When a user refers to a filename, always they're likely referring to an existing file in the folder *'./workspace'*
         that is located in the directory you're currently executing code in.
         In general, choose packages that have the most universal chance to be already installed and to work across multiple applications.
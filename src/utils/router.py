@@ -0,0 +1,233 @@
+# router.py
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+MODELS_FILE = os.environ.get("PIPKA_MODELS_FILE", "models.json")
+# Model setting that lets the router pick per turn
+AUTO_MODEL = 'auto'
+TIERS = ('small', 'medium', 'large')
+# Calls remembered per model for its error rate and latency
+STATS_WINDOW = 20
+STATS_MAX_AGE = 600
+# A throttled model is skipped for this long, doubling while it stays throttled
+COOLDOWN_SECONDS = 30
+MAX_COOLDOWN_SECONDS = 300
+# Used by the reasoning chain; other models with the 'reasoning' capability are its fallbacks
+REASONING_MODEL = "anthropic.claude-3-5-sonnet-20241022-v2:0"
+# A request that does not answer within this long is given up and the next model is tried
+REQUEST_TIMEOUT = int(os.environ.get("PIPKA_LLM_TIMEOUT", "120"))
+
+# Errors worth another model: throttling, overload, timeouts. Anything else is the request's fault.
+RETRYABLE = re.compile(r'throttl|rate.?limit|too many requests|overloaded|service.?unavailable|timed? ?out|timeout|'
+                       r'model.?not.?ready|internal.?server|\b(429|500|502|503|504)\b', re.IGNORECASE)
+COMPLEX_HINTS = re.compile(r'```|\b(code|script|debug|error|traceback|exception|refactor|implement|algorithm|optimi[sz]e|'
+                           r'analy[sz]e|analysis|dataset|csv|excel|xlsx|parquet|sql|plot|chart|graph|regression|'
+                           r'statistic|prove|architecture|design|compare|step by step)\b', re.IGNORECASE)
+
+_lock = threading.Lock()
+_config = None
+# model id -> _Health
+_health = {}
+
+
+class _Health:
+    def __init__(self):
+        self.calls = deque(maxlen=STATS_WINDOW)  # (time, ok, seconds to the first chunk or None)
+        self.cooldown = 0.0
+        self.blocked_until = 0.0
+
+    def _recent(self):
+        oldest = time.time() - STATS_MAX_AGE
+        return [call for call in self.calls if call[0] >= oldest]
+
+    def error_rate(self):
+        calls = self._recent()
+        return sum(1 for _, ok, _ in calls if not ok) / len(calls) if calls else 0.0
+
+    def latency(self):
+        latencies = sorted(latency for _, ok, latency in self._recent() if ok and latency is not None)
+        return latencies[len(latencies) // 2] if latencies else None
+
+
+def _load():
+    global _config
+    if _config is None:
+        try:
+            with open(MODELS_FILE, "r") as file:
+                config = json.load(file)
+            _config = {'bedrock': config['bedrock'], 'services': config.get('services', {})}
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Failed to load {MODELS_FILE}: {e}")
+            _config = {'bedrock': {}, 'services': {}}
+    return _config
+
+
+def models():
+    """{model id: settings} of the chat models in models.json, read once."""
+    return _load()['bedrock']
+
+
+def services():
+    """{service: settings} of the other AWS services in models.json (speech, images, embeddings), for their limits."""
+    return _load()['services']
+
+
+def litellm_model(model):
+    # Cross-region inference profiles, like the sidebar always used
+    return f"bedrock/us.{model}"
+
+
+def bedrock_model(model):
+    return f"us.{model}"
+
+
+def max_output_tokens(model=AUTO_MODEL):
+    """Longest answer the model can write in one request; for 'auto' the longest of any model."""
+    if model == AUTO_MODEL:
+        return max([settings.get('max_output_tokens', 4096) for settings in models().values()], default=4096)
+    return models().get(model, {}).get('max_output_tokens', 4096)
+
+
+def max_tokens_for(model, max_tokens):
+    return min(max_tokens, max_output_tokens(model))
+
+
+def _stats(model):
+    with _lock:
+        return _health.setdefault(model, _Health())
+
+
+def record_success(model, latency):
+    health = _stats(model)
+    with _lock:
+        health.calls.append((time.time(), True, latency))
+        health.cooldown = 0.0
+
+
+def record_failure(model, retryable):
+    health = _stats(model)
+    with _lock:
+        health.calls.append((time.time(), False, None))
+        if retryable:
+            health.cooldown = min(MAX_COOLDOWN_SECONDS, health.cooldown * 2 or COOLDOWN_SECONDS)
+            health.blocked_until = time.time() + health.cooldown
+
+
+def is_retryable(error):
+    return bool(RETRYABLE.search(f"{type(error).__name__} {error}"))
+
+
+def health_report():
+    """{model: {"error_rate", "latency", "blocked"}} for display."""
+    now = time.time()
+    with _lock:
+        items = list(_health.items())
+    return {model: {"error_rate": health.error_rate(), "latency": health.latency(), "blocked": health.blocked_until > now}
+            for model, health in items}
+
+
+def estimate_tier(prompt, history_chars=0):
+    """Tier a turn needs: short chat goes to a small model, code, data and long tasks to bigger ones."""
+    score = 0
+    if len(prompt) > 1500:
+        score += 2
+    elif len(prompt) > 300:
+        score += 1
+    score += min(2, len(COMPLEX_HINTS.findall(prompt)))
+    if history_chars > 12000:
+        score += 1
+    return TIERS[0] if score == 0 else TIERS[1] if score <= 2 else TIERS[2]
+
+
+def _rank(model, settings, now):
+    health = _stats(model)
+    blocked = health.blocked_until > now
+    latency = health.latency() or 0.0
+    cost = settings.get('cost', {})
+    # Healthy first; then fewer errors, lower latency, lower price
+    return (blocked, round(health.error_rate(), 1), round(latency), cost.get('input', 0) + cost.get('output', 0))
+
+
+def candidates(model=AUTO_MODEL, prompt='', history_chars=0, needs=()):
+    """Models to try in order: the chosen (or routed) one first, then healthy fallbacks.
+
+    With model 'auto' the turn's tier is estimated from the prompt; otherwise the chosen model leads and
+    fallbacks come from its tier, then the tiers above, then below.
+    """
+    available = {name: settings for name, settings in models().items()
+                 if all(need in settings.get('capabilities', ()) for need in needs)}
+    if not available:
+        return [model] if model != AUTO_MODEL else []
+    if model == AUTO_MODEL or model not in available:
+        tier = estimate_tier(prompt, history_chars) if model == AUTO_MODEL else models().get(model, {}).get('tier', TIERS[-1])
+        first = []
+    else:
+        tier = available[model].get('tier', TIERS[-1])
+        first = [model]
+    wanted = TIERS.index(tier) if tier in TIERS else len(TIERS) - 1
+    now = time.time()
+
+    def order(name):
+        level = TIERS.index(available[name].get('tier', TIERS[-1]))
+        # Same tier, then escalate, then fall back to smaller models
+        distance = level - wanted if level >= wanted else len(TIERS) + wanted - level
+        blocked, *rest = _rank(name, available[name], now)
+        return (blocked, distance, *rest)
+
+    others = sorted((name for name in available if name not in first), key=order)
+    if first and _stats(first[0]).blocked_until > now:
+        # A throttled choice goes behind the healthy alternatives
+        return [name for name in others if _stats(name).blocked_until <= now] + first + \
+               [name for name in others if _stats(name).blocked_until > now]
+    return first + others
+
+
+def routed_completions(completions, models_to_try, max_tokens=None, admit=None, per_model=None):
+    """Wrap a LiteLLM style completions(**params) generator so a throttled or failing model falls back to the next one.
+
+    Only errors before the first chunk fall back - a half streamed answer cannot be continued by another model.
+    admit(model, params), e.g. admission.admit_completion, is called before every attempt and may block.
+    per_model(completions, model) -> completions wraps the call of each model tried, for wrappers that depend on the
+    model's capabilities (continuation.continued_completions).
+    """
+    def run(**params):
+        if not models_to_try:
+            yield from completions(**params)
+            return
+        last_error = None
+        for model in models_to_try:
+            attempt = dict(params, model=litellm_model(model))
+            attempt.setdefault('timeout', REQUEST_TIMEOUT)
+            if max_tokens:
+                attempt['max_tokens'] = max_tokens_for(model, max_tokens)
+            if admit is not None:
+                admit(model, attempt)
+            call = per_model(completions, model) if per_model is not None else completions
+            started = time.monotonic()
+            streamed = False
+            try:
+                for chunk in call(**attempt):
+                    if not streamed:
+                        streamed = True
+                        record_success(model, time.monotonic() - started)
+                    yield chunk
+                if not streamed:
+                    record_success(model, time.monotonic() - started)
+                return
+            except Exception as e:
+                retryable = is_retryable(e)
+                record_failure(model, retryable)
+                if streamed or not retryable:
+                    raise
+                logger.warning(f"{model} failed ({e}), trying the next model")
+                last_error = e
+        if last_error is not None:
+            raise last_error
+    return run
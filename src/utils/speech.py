@@ -0,0 +1,89 @@
+# speech.py
+import os
+import logging
+from io import BytesIO
+
+import boto3
+import speech_recognition as sr
+
+from src.utils.admission import admit
+from src.utils.audio import MIME_TYPES
+
+logger = logging.getLogger(__name__)
+
+POLLY_REGION = 'eu-central-1'
+# Polly OutputFormat: mp3 plays everywhere, ogg_opus and ogg_vorbis are smaller but Safari does not play them
+AUDIO_FORMAT = os.environ.get("PIPKA_TTS_FORMAT", "mp3")
+# Bytes read from Polly's stream at a time
+CHUNK_SIZE = 16384
+LANGUAGE_VOICES = {
+    'en-US': ('Amy', 'neural'),
+    'cs-CZ': ('Jitka', 'neural'),
+    'sk-SK': ('Jitka', 'neural'),  # Using Czech voice for Slovak
+    'ro-RO': ('Carmen', 'standard'),
+    'de-DE': ('Vicki', 'neural'),
+    'fr-FR': ('Lea', 'neural'),
+    'en-IN': ('Kajal', 'neural')
+}
+
+_polly_client = None
+
+
+def _polly():
+    # boto3 clients are thread-safe, one serves every session
+    global _polly_client
+    if _polly_client is None:
+        _polly_client = boto3.client('polly', region_name=POLLY_REGION)
+    return _polly_client
+
+
+def synthesize(text, language, audio_format=None):
+    """Start Polly speaking text in language.
+
+    Returns (MIME type, iterator of audio chunks); the chunks are read from Polly's stream as it produces them,
+    so they can be passed on before the whole text is synthesized. None when Polly refuses the request.
+    """
+    audio_format = audio_format or AUDIO_FORMAT
+    voice_id, engine = LANGUAGE_VOICES.get(language, ('Amy', 'standard'))
+    try:
+        admit('polly')
+        response = _polly().synthesize_speech(
+            Text=text,
+            OutputFormat=audio_format,
+            VoiceId=voice_id,
+            Engine=engine
+        )
+    except Exception as e:
+        logger.error(f"Error in text_to_speech: {e}")
+        return None
+
+    def chunks():
+        try:
+            yield from response['AudioStream'].iter_chunks(CHUNK_SIZE)
+        except Exception as e:
+            logger.error(f"Polly audio stream broke off: {e}")
+        finally:
+            response['AudioStream'].close()
+    return MIME_TYPES.get(audio_format, 'application/octet-stream'), chunks()
+
+
+def text_to_speech(text, language, audio_format=None):
+    """(MIME type, audio bytes) of text spoken in language; None when Polly fails."""
+    speech = synthesize(text, language, audio_format)
+    if speech is None:
+        return None
+    mime_type, chunks = speech
+    audio = b''.join(chunks)
+    return (mime_type, audio) if audio else None
+
+
+def transcribe_audio(audio_bytes, language):
+    recognizer = sr.Recognizer()
+    with sr.AudioFile(BytesIO(audio_bytes)) as source:
+        audio = recognizer.record(source)
+    try:
+        return recognizer.recognize_google(audio, language=language)
+    except sr.UnknownValueError:
+        return "Speech Recognition could not understand audio"
+    except sr.RequestError as e:
+        return f"Could not request results from Speech Recognition service; {e}"
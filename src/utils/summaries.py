@@ -0,0 +1,101 @@
+# summaries.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.data.database import get_summary, save_summary, strip_images
+from src.utils.admission import PRIORITY_BACKGROUND, admit
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MODEL = "bedrock/us.anthropic.claude-3-5-haiku-20241022-v1:0"
+SUMMARY_MAX_TOKENS = 700
+# History above this size is compressed, the newest KEEP_RECENT_MESSAGES always stay verbatim
+SUMMARY_TRIGGER_TOKENS = 6000
+KEEP_RECENT_MESSAGES = 6
+CHARS_PER_TOKEN = 4
+MAX_MESSAGE_CHARS = 3000
+
+SUMMARY_SYSTEM_PROMPT = """You maintain a running summary of a conversation between a user and PIPKA, an AI assistant that writes and runs code.
+Merge the previous summary with the new messages into one updated summary. Keep facts that later turns may need:
+the user's goals and preferences, file names and paths, data shapes, decisions made, code that worked, errors and their fixes, open tasks.
+Drop small talk and raw console output. Write compact bullet points, at most 400 words."""
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipka-summaries")
+_lock = threading.Lock()
+_pending = set()
+
+
+def estimate_tokens(messages):
+    return sum(len(str(message.get('content', ''))) for message in messages) // CHARS_PER_TOKEN
+
+
+def _transcript(messages):
+    return '\n'.join(
+        f"{message.get('role', '').capitalize()}: {strip_images(str(message.get('content', '')))[:MAX_MESSAGE_CHARS]}"
+        for message in messages
+    )
+
+
+def _recent_start(messages):
+    # Start the verbatim tail on a user message so no answer is separated from its question
+    start = max(len(messages) - KEEP_RECENT_MESSAGES, 0)
+    while start > 0 and messages[start].get('role') != 'user':
+        start -= 1
+    return start
+
+
+def _summarize(conversation_id, previous_summary, messages, covered_until, user_id=None):
+    # Imported here: litellm takes seconds to import and compact_history, called on every turn, does not need it
+    from litellm import completion
+    try:
+        # Runs in the background, so any waiting chat or image call goes first; charged to the conversation's user
+        admit(SUMMARY_MODEL, estimate_tokens(messages) + SUMMARY_MAX_TOKENS, user_id=user_id, priority=PRIORITY_BACKGROUND)
+        response = completion(
+            model=SUMMARY_MODEL,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0,
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Previous summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{_transcript(messages)}"},
+            ],
+        )
+        save_summary(conversation_id, response.choices[0].message.content, covered_until)
+    except Exception as e:
+        logger.warning(f"Failed to summarize conversation {conversation_id}: {e}")
+    finally:
+        with _lock:
+            _pending.discard(conversation_id)
+
+
+def schedule_summary(conversation_id, messages, user_id=None):
+    """Fold messages that fell out of the recent window into the stored summary, in the background."""
+    summary, covered = get_summary(conversation_id)
+    covered_until = _recent_start(messages)
+    if covered_until <= covered:
+        return
+    with _lock:
+        if conversation_id in _pending:
+            return
+        _pending.add(conversation_id)
+    _executor.submit(_summarize, conversation_id, summary, messages[covered:covered_until], covered_until, user_id)
+
+
+def compact_history(conversation_id, messages, user_id=None):
+    """Summary of older turns + messages the summary does not cover yet, once the history gets long.
+
+    Never waits for the model: until a background summary catches up the uncovered messages are kept verbatim.
+    The summary's model call queues as user_id's background work (admission.py).
+    """
+    if estimate_tokens(messages) <= SUMMARY_TRIGGER_TOKENS:
+        return list(messages)
+    schedule_summary(conversation_id, messages, user_id)
+    summary, covered = get_summary(conversation_id)
+    if not summary or covered > len(messages):
+        return list(messages)
+    summary_message = {
+        "role": "user",
+        "type": "message",
+        "content": f"Summary of the earlier part of this conversation:\n{summary}",
+    }
+    return [summary_message] + list(messages[covered:])
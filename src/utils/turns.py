@@ -0,0 +1,215 @@
+# turns.py
+import os
+import base64
+from io import BytesIO
+
+from PIL import Image
+
+from src.utils.admission import admit_completion
+from src.utils.console_output import OUTPUT_MARK, ConsoleLimiter, new_console_log_path
+from src.utils.continuation import continued_completions
+from src.utils.datasets import dataset_context
+from src.utils.file_server import file_url
+from src.utils.image_output import ImageOutput
+from src.utils.jobs import ExecutionLimits
+from src.utils.kernels import kernel_context
+from src.utils.llm_cache import CacheStats, cached_completions
+from src.utils.memory import recall
+from src.utils.packages import PackageRecorder, use_environment
+from src.utils.prompts import PROMPTS
+from src.utils.router import candidates, litellm_model, max_tokens_for, models, routed_completions
+from src.utils.summaries import compact_history
+from src.utils.workspace import localize_prompt
+
+# Setting up and reading a chat turn without Streamlit, shared by the UI and the HTTP API (api_server.py)
+
+
+class TurnSettings:
+    """The LLM settings of the sidebar, for one turn."""
+
+    def __init__(self, model, temperature=0.1, max_tokens=1024, auto_run=False, language='en-US', custom_instructions='',
+                 system_message=None, recall_pairs=4, recall_token_budget=800, limits=None, response_cache=False):
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.auto_run = auto_run
+        self.language = language
+        self.custom_instructions = custom_instructions
+        # None = the default prompt for auto_run
+        self.system_message = system_message
+        self.recall_pairs = recall_pairs
+        self.recall_token_budget = recall_token_budget
+        self.limits = limits or ExecutionLimits()
+        # Repeated low temperature requests are answered from llm_cache.py
+        self.response_cache = response_cache
+
+
+def configure_interpreter(interpreter, conversation_id, history, workspace_dir, settings, prompt='', user_id=None):
+    """Prepare interpreter for the next turn of the conversation; history is the messages before the new prompt.
+
+    The response cache is used only when user_id is given, its entries are kept apart per user.
+    """
+    interpreter.conversation_filename = conversation_id
+    interpreter.conversation_history = True
+    interpreter.messages = compact_history(conversation_id, history, user_id)
+    # The router picks the model for the prompt ('auto') and the fallbacks for when it is throttled or slow
+    models_to_try = candidates(settings.model, prompt, sum(len(str(message.get('content', ''))) for message in history))
+    model = models_to_try[0] if models_to_try else settings.model
+    interpreter.llm.model = litellm_model(model)
+    interpreter.llm.temperature = settings.temperature
+    interpreter.llm.max_tokens = max_tokens_for(model, settings.max_tokens)
+    # Open Interpreter trims the history to fit this
+    interpreter.llm.context_window = models().get(model, {}).get('context_window')
+    interpreter.llm.modify_params = True
+    # Detected again for the model in use, they differ between models
+    interpreter.llm.supports_vision = None
+    interpreter.llm.supports_functions = None
+    completions = getattr(interpreter.llm, 'pipka_completions', None) or getattr(interpreter.llm, 'completions', None)
+    if completions is not None:
+        interpreter.llm.pipka_completions = completions
+        # Queued with the other sessions' calls, see admission.py; the job sets the user and priority.
+        # Answers stopped by max_tokens go on in the same message, as the model that answered supports it
+        interpreter.llm.completions = routed_completions(
+            completions, models_to_try, settings.max_tokens, admit_completion,
+            per_model=lambda completions, model: continued_completions(completions, model, admit=admit_completion))
+    # Read by the TurnMetrics stage of the turn
+    interpreter.llm.pipka_cache_stats = CacheStats() if settings.response_cache and user_id else None
+    if completions is not None and interpreter.llm.pipka_cache_stats is not None:
+        interpreter.llm.completions = cached_completions(interpreter.llm.completions, user_id, settings.model, settings.temperature,
+                                                         interpreter.llm.pipka_cache_stats)
+
+    interpreter.stream = True
+    interpreter.verbose = True
+
+    default_message = PROMPTS.system_message_run if settings.auto_run else PROMPTS.system_message_confirm
+    interpreter.llm.system_message = localize_prompt(settings.system_message or default_message, workspace_dir)
+    interpreter.auto_run = settings.auto_run
+    interpreter.system_message = localize_prompt(default_message, workspace_dir)
+    if settings.auto_run:
+        instructions = f"You have female voice. NEVER ask user for confirmation before running code, you can run it! Talk to user in {settings.language} language. {settings.custom_instructions}"
+    else:
+        instructions = f"You have female voice. First write code do not run it and only show it to user. ALWAYS ask user for permission to run any code! Talk to user in {settings.language} language. {settings.custom_instructions}"
+    interpreter.custom_instructions = localize_prompt(instructions, workspace_dir)
+
+    interpreter.computer.emit_images = True
+    # pip installs of the kernel's code go into the user's own package layer
+    use_environment(interpreter, workspace_dir, user_id)
+
+
+def build_message(prompt, user_id, conversation_id, workspace_dir, messages, settings):
+    """The prompt with the recent transcript, recalled older messages and workspace context; messages end with prompt."""
+    recent_messages = messages[-2 * settings.recall_pairs:]
+    memory = '\n'.join(
+        [f"{i['role'].capitalize()}: {i['content']}" for i in recent_messages]
+    ).replace('User', '\nUser')
+    prompt_with_memory = f"user's request:{prompt}. --- \nBelow is the transcript of your past conversation with the user: {memory} ---\n"
+    recalled = recall(user_id, prompt, settings.recall_token_budget, exclude=recent_messages)
+    if recalled:
+        snippets = '\n'.join([f"{i['role'].capitalize()}: {i['content']}" for i in recalled])
+        prompt_with_memory += f"Older messages from your conversations with the user that may be relevant: \n{snippets}\n ---\n"
+    prompt_with_memory += dataset_context(workspace_dir, prompt)
+    prompt_with_memory += kernel_context(conversation_id)
+    return prompt_with_memory
+
+
+class TurnMetrics:
+    """Job stage ending the turn with a "metrics" chunk: model calls and how many the response cache answered."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def feed(self, chunk):
+        return [chunk]
+
+    def drain(self):
+        if not self.stats.calls:
+            return []
+        return [{"role": "assistant", "type": "metrics", "content": self.stats.as_dict()}]
+
+    def close(self):
+        pass
+
+
+def turn_stages(workspace_dir, user_id, files_base, interpreter=None):
+    """Job stages rewriting the interpreter output before it is stored, see jobs.start_turn."""
+    # Long program output is cut in the answer, the whole of it stays in a log file
+    console_log = new_console_log_path(workspace_dir)
+    console = ConsoleLimiter(console_log, file_url(console_log, inline=True, base=files_base))
+    # Plots are shown as previews; converted off the stream, originals kept in the workspace
+    images = ImageOutput(workspace_dir, lambda path: file_url(path, base=files_base))
+    stages = [console, images, PackageRecorder(user_id, workspace_dir)]
+    stats = getattr(getattr(interpreter, 'llm', None), 'pipka_cache_stats', None)
+    if stats is not None:
+        stages.append(TurnMetrics(stats))
+    return stages
+
+
+def metrics_caption(metrics):
+    """One line about the cache for a turn's metrics chunk, or '' when it answered nothing."""
+    if not metrics or not metrics.get('cache_hits'):
+        return ''
+    return (f"{metrics['cache_hits']} of {metrics['llm_calls']} model calls answered from the response cache, "
+            f"about {metrics['seconds_saved']:.1f} s saved")
+
+
+def format_response(chunk, full_response):
+    if chunk['type'] == "message":
+        full_response += chunk.get("content", "")
+        if chunk.get('end', False):
+            full_response += "\n"
+    elif chunk['type'] == "code":
+        if chunk.get('start', False):
+            full_response += "```python\n"
+        full_response += chunk.get('content', '')
+        if chunk.get('end', False):
+            full_response += "\n```\n"
+    elif chunk['type'] == "confirmation":
+        if chunk.get('start', False):
+            full_response += "```python\n"
+        full_response += chunk.get('content', {}).get('code', '')
+        if chunk.get('end', False):
+            full_response += "```\n"
+    elif chunk['type'] == "console":
+        if chunk.get('start', False):
+            full_response += "```python\n"
+        if chunk.get('format', '') == "active_line":
+            console_content = chunk.get('content', '')
+            if console_content is None:
+                full_response += "No output available on console."
+        if chunk.get('format', '') == "output":
+            console_content = chunk.get('content', '')
+            full_response += console_content
+        if chunk.get('format', '') == "tail":
+            # Newest end of a long output replaces the previous one, so the answer stays small
+            cut = full_response.rfind(OUTPUT_MARK)
+            full_response = (full_response[:cut] if cut != -1 else full_response) + OUTPUT_MARK + chunk.get('content', '')
+        if chunk.get('end', False):
+            full_response += "\n```\n"
+    elif chunk['type'] == "image":
+        if chunk.get('start', False) or chunk.get('end', False):
+            full_response += "\n"
+        else:
+            image_format = chunk.get('format', '')
+            if image_format == 'preview':
+                full_response += f"![Image](data:{chunk.get('mime', 'image/png')};base64,{chunk.get('content', '')})\n"
+                if chunk.get('url'):
+                    full_response += f"[Full size image]({chunk['url']})\n"
+            elif image_format == 'base64.png':
+                image_content = chunk.get('content', '')
+                if image_content:
+                    image = Image.open(BytesIO(base64.b64decode(image_content))).convert("RGBA")
+                    new_image = Image.new("RGB", image.size, "white")
+                    new_image.paste(image, mask=image.getchannel("A"))
+                    buffered = BytesIO()
+                    new_image.save(buffered, format="PNG")
+                    img_str = base64.b64encode(buffered.getvalue()).decode()
+                    full_response += f"![Image](data:image/png;base64,{img_str})\n"
+            elif image_format == 'path':
+                # Přidáno: Zobrazení obrázku z lokální cesty
+                image_path = chunk.get('content', '')
+                if image_path and os.path.exists(image_path):
+                    with open(image_path, "rb") as image_file:
+                        encoded_string = base64.b64encode(image_file.read()).decode()
+                        ext = os.path.splitext(image_path)[1][1:].lower()
+                        full_response += f"![Image](data:image/{ext};base64,{encoded_string})\n"
+    return full_response
@@ -0,0 +1,170 @@
+# uploads.py
+import os
+import re
+import json
+import fcntl
+import hashlib
+import threading
+
+from src.utils.workspace import update_file_usage
+
+UPLOADS_DIR = '.uploads'
+INDEX_FILE = 'index.json'
+CHUNK_SIZE = 1024 * 1024
+# Largest body of one PUT; st_uploader sends 8 MB chunks
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+_UPLOAD_ID = re.compile(r'^[A-Za-z0-9_-]{8,128}$')
+
+# Running sha256 per upload, so each chunk is hashed once while it streams in
+_hashers = {}
+_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+def _uploads_dir(workspace_dir):
+    path = os.path.join(workspace_dir, UPLOADS_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _part_path(workspace_dir, upload_id):
+    if not _UPLOAD_ID.match(upload_id):
+        raise UploadError("Invalid upload id.")
+    return os.path.join(_uploads_dir(workspace_dir), f"{upload_id}.part")
+
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(block)
+    return hasher
+
+
+def _load_index(workspace_dir):
+    try:
+        with open(os.path.join(_uploads_dir(workspace_dir), INDEX_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(workspace_dir, index):
+    path = os.path.join(_uploads_dir(workspace_dir), INDEX_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def upload_offset(workspace_dir, upload_id):
+    part = _part_path(workspace_dir, upload_id)
+    return os.path.getsize(part) if os.path.exists(part) else 0
+
+
+def _hasher_for(upload_id, part, offset):
+    hasher, hashed = _hashers.get(upload_id, (None, -1))
+    if hashed != offset:
+        # Server restarted or chunk replayed - rebuild the running hash from disk
+        hasher = _hash_file(part) if offset else hashlib.sha256()
+    return hasher
+
+
+async def append_chunk(workspace_dir, upload_id, offset, stream, max_bytes=MAX_CHUNK_SIZE):
+    """Append an async byte stream at offset; returns the new size of the partial upload.
+
+    The part file is locked from the offset check until the chunk is written, so a second request for the
+    same upload (a retry racing the original, or another worker on the shared volume) is refused, not interleaved.
+    A stream longer than max_bytes is refused with UploadTooLarge and nothing of it is kept.
+    """
+    part = _part_path(workspace_dir, upload_id)
+    with open(part, "ab") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError("Another request is writing this upload.")
+        try:
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise UploadError(f"Expected offset {current}.")
+            with _lock:
+                hasher = _hasher_for(upload_id, part, offset)
+                _hashers[upload_id] = (hasher, -1)
+            size = offset
+            async for block in stream:
+                if size + len(block) - offset > max_bytes:
+                    f.truncate(offset)
+                    with _lock:
+                        _hashers.pop(upload_id, None)
+                    raise UploadTooLarge(f"Chunk larger than {max_bytes} bytes.")
+                f.write(block)
+                hasher.update(block)
+                size += len(block)
+            f.flush()
+            with _lock:
+                _hashers[upload_id] = (hasher, size)
+            # The quota of the next chunk counts what arrived so far
+            update_file_usage(workspace_dir, part)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return size
+
+
+def _existing_copy(workspace_dir, index, digest):
+    relative = index.get(digest)
+    if relative and os.path.isfile(os.path.join(workspace_dir, relative)):
+        return relative
+    return None
+
+
+def _place(workspace_dir, source, filename, digest):
+    """Move source to filename unless identical content is already there.
+
+    Returns (status, duplicate_of). Content that already exists under another
+    name is reported but still stored: hard links would make an edit of one
+    file silently change the other.
+    """
+    index = _load_index(workspace_dir)
+    target = os.path.join(workspace_dir, filename)
+    existing = _existing_copy(workspace_dir, index, digest)
+
+    if os.path.isfile(target) and os.path.getsize(target) == os.path.getsize(source) \
+            and _hash_file(target).hexdigest() == digest:
+        os.remove(source)
+        status = "unchanged"
+    else:
+        os.replace(source, target)
+        status = "stored"
+
+    if not existing:
+        index[digest] = filename
+        _save_index(workspace_dir, index)
+    return status, existing if existing != filename else None
+
+
+def finish_upload(workspace_dir, upload_id, filename):
+    part = _part_path(workspace_dir, upload_id)
+    with _lock:
+        hasher, hashed = _hashers.pop(upload_id, (None, -1))
+    if hasher is None or hashed != os.path.getsize(part):
+        hasher = _hash_file(part)
+    digest = hasher.hexdigest()
+    return _place(workspace_dir, part, filename, digest)
+
+
+def store_file(workspace_dir, fileobj, filename):
+    """Stream a file-like object into the workspace, hashing on the fly and skipping identical content."""
+    part = os.path.join(_uploads_dir(workspace_dir), f"{hashlib.sha256(filename.encode()).hexdigest()[:32]}.part")
+    hasher = hashlib.sha256()
+    with open(part, "wb") as f:
+        for block in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+            f.write(block)
+            hasher.update(block)
+    return _place(workspace_dir, part, filename, hasher.hexdigest())
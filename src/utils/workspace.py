@@ -0,0 +1,217 @@
+# workspace.py
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+WORKSPACE_DIR = 'workspace'
+USERS_DIR = 'users'
+ACCESS_FILE = '.access.json'
+# 0 switches a quota off. Over the soft quota regenerable artifacts are evicted,
+# over the hard quota uploads and new images are refused.
+SOFT_QUOTA_MB = int(os.environ.get("PIPKA_QUOTA_SOFT_MB", "5120"))
+HARD_QUOTA_MB = int(os.environ.get("PIPKA_QUOTA_HARD_MB", "10240"))
+# Files changed in place do not touch their directory, so rescan everything now and then
+FULL_SCAN_INTERVAL = 600
+# Outputs and caches that can be produced again; everything else is user data and is never evicted
+CANVAS_PREFIX = 'nova_canvas_'
+CACHE_DIRS = ('.profiles', '.columnar', '.console')
+STALE_UPLOAD_SECONDS = 24 * 3600
+
+_lock = threading.Lock()
+# real path of a workspace root -> _Usage
+_usage = {}
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class _Usage:
+    def __init__(self):
+        self.dirs = {}     # relative dir -> (mtime_ns, {file name: size}, [subdir names])
+        self.total = 0
+        self.scanned = 0.0
+        self.dirty = True
+
+
+def user_workspace(user_id):
+    """The user's own workspace root, e.g. workspace/users/ai_mirecek.org-1a2b3c4d."""
+    slug = re.sub(r'[^\w.@-]', '_', user_id or 'nobody').strip('.') or 'nobody'
+    digest = hashlib.sha256((user_id or '').encode()).hexdigest()[:8]
+    path = os.path.join(WORKSPACE_DIR, USERS_DIR, f"{slug[:64]}-{digest}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _scan_dir(usage, root, relative, full, visited):
+    path = os.path.join(root, relative)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return
+    visited.add(relative)
+    cached = usage.dirs.get(relative)
+    if cached and cached[0] == mtime and not full:
+        # Nothing added or removed here - keep the sizes, only look deeper
+        _, files, subdirs = cached
+    else:
+        files, subdirs = {}, []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif entry.is_file(follow_symlinks=False):
+                            files[entry.name] = entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            return
+        usage.dirs[relative] = (mtime, files, subdirs)
+    usage.total += sum(files.values())
+    for name in subdirs:
+        _scan_dir(usage, root, os.path.join(relative, name), full, visited)
+
+
+def disk_usage(root):
+    """Bytes used under root. Only directories whose mtime changed are listed again."""
+    with _lock:
+        usage = _usage.setdefault(os.path.realpath(root), _Usage())
+        full = usage.dirty or time.time() - usage.scanned > FULL_SCAN_INTERVAL
+        visited = set()
+        usage.total = 0
+        _scan_dir(usage, root, '', full, visited)
+        # Forget directories that are gone
+        usage.dirs = {relative: entry for relative, entry in usage.dirs.items() if relative in visited}
+        if full:
+            usage.scanned, usage.dirty = time.time(), False
+        return usage.total
+
+
+def update_file_usage(root, path):
+    """Take the new size of a file that grew or shrank in place (e.g. an upload being appended to) without a rescan."""
+    directory, name = os.path.split(os.path.relpath(path, root))
+    with _lock:
+        usage = _usage.get(os.path.realpath(root))
+        cached = usage.dirs.get(directory) if usage else None
+        # A file the cache has not seen yet is found by the next scan, its directory changed
+        if cached and name in cached[1]:
+            try:
+                cached[1][name] = os.path.getsize(path)
+            except OSError:
+                usage.dirty = True
+
+
+def invalidate_usage(root):
+    """Sizes may have changed without touching directories (e.g. code rewrote a file) - rescan fully next time."""
+    with _lock:
+        _usage.setdefault(os.path.realpath(root), _Usage()).dirty = True
+
+
+def _load_access(root):
+    try:
+        with open(os.path.join(root, ACCESS_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def touch_artifact(root, relative):
+    """Record that an artifact was used, so eviction takes older ones first."""
+    access = _load_access(root)
+    access[relative] = time.time()
+    try:
+        with open(os.path.join(root, ACCESS_FILE), "w") as f:
+            json.dump(access, f)
+    except OSError as e:
+        logger.warning(f"Failed to record access to {relative}: {e}")
+
+
+def _tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                continue
+    return total
+
+
+def _evictable(root):
+    """(last use, relative path) of artifacts that can be regenerated."""
+    access = _load_access(root)
+    candidates = []
+    for entry in os.scandir(root):
+        if entry.is_dir() and entry.name.startswith(CANVAS_PREFIX):
+            candidates.append(entry.name)
+        elif entry.is_dir() and entry.name in CACHE_DIRS:
+            candidates.extend(os.path.join(entry.name, name) for name in os.listdir(entry.path))
+    uploads = os.path.join(root, '.uploads')
+    if os.path.isdir(uploads):
+        cutoff = time.time() - STALE_UPLOAD_SECONDS
+        candidates.extend(os.path.join('.uploads', name) for name in os.listdir(uploads)
+                          if name.endswith('.part') and os.path.getmtime(os.path.join(uploads, name)) < cutoff)
+    result = []
+    for relative in candidates:
+        try:
+            last_use = max(os.path.getmtime(os.path.join(root, relative)), access.get(relative, 0))
+        except OSError:
+            continue
+        result.append((last_use, relative))
+    return sorted(result)
+
+
+def evict(root, target_bytes):
+    """Delete least recently used regenerable artifacts until usage is at most target_bytes; returns bytes freed."""
+    used = disk_usage(root)
+    freed = 0
+    for _, relative in _evictable(root):
+        if used - freed <= target_bytes:
+            break
+        path = os.path.join(root, relative)
+        size = _tree_size(path)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"Failed to evict {path}: {e}")
+            continue
+        logger.info(f"Evicted {path} ({size} bytes)")
+        freed += size
+    if freed:
+        invalidate_usage(root)
+    return freed
+
+
+def enforce_quota(root, incoming=0):
+    """Make room for incoming bytes. Evicts down to the soft quota; raises QuotaExceeded above the hard one."""
+    soft, hard = SOFT_QUOTA_MB * 1024 * 1024, HARD_QUOTA_MB * 1024 * 1024
+    used = disk_usage(root)
+    if soft and used + incoming > soft:
+        used -= evict(root, max(soft - incoming, 0))
+    if hard and used + incoming > hard:
+        raise QuotaExceeded(f"Workspace quota of {HARD_QUOTA_MB} MB exceeded, delete some files first.")
+    return used
+
+
+def quota_status(root):
+    """(used bytes, soft bytes, hard bytes) for the UI; 0 means no quota."""
+    return disk_usage(root), SOFT_QUOTA_MB * 1024 * 1024, HARD_QUOTA_MB * 1024 * 1024
+
+
+def localize_prompt(text, root):
+    """Point the './workspace' the prompts talk about to the user's own workspace."""
+    return text.replace("./workspace", f"./{root}")
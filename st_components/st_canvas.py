@@ -16,6 +16,11 @@ from boto3.session import Session
 
 from streamlit_extras.stylable_container import stylable_container
 
+from src.utils.admission import PRIORITY_IMAGE, AdmissionTimeout, admission_context, admit
+from src.utils.canvas_sweep import CONTACT_SHEET, MAX_SWEEP_IMAGES, cfg_scales, contact_sheet, random_seeds, run_sweep, sweep_grid
+from src.utils.canvas_tiles import fits_canvas, process_tiled
+from src.utils.workspace import CANVAS_PREFIX, QuotaExceeded, enforce_quota, touch_artifact
+
 from  datetime import datetime
 
 import base64
@@ -80,6 +85,8 @@ def save_base64_images(base64_images, output_directory, base_name="image"):
     return images
 
 logger = logging.getLogger(__name__)
+# Sizes offered in sweep mode besides the one set with the sliders
+SWEEP_SIZES = ["1024x1024", "1024x768", "768x1024", "1280x720", "720x1280", "1920x1072"]
 # boto has a default timeout of 60 seconds which can be
 # surpassed when generating multiple images.
 config = Config(read_timeout=300)
@@ -208,6 +215,7 @@ class BedrockImageGenerator:
         self,
         inference_params: Dict[str, Any],
         model_id: str = DEFAULT_MODEL_ID,
+        record: bool = True,
     ) -> Dict[str, Any]:
         """Generate images using AWS Bedrock's image generation models.
 
@@ -222,6 +230,8 @@ class BedrockImageGenerator:
             inference_params (Dict[str, Any]): Dictionary containing the parameters for image generation.
                 Must include required fields as per AWS Bedrock's API specifications.
             model_id (str): The model ID to use for generation. Defaults to DEFAULT_MODEL_ID.
+            record (bool): Save the request and response JSON files. Tiles of a large image
+                (see run_tiled) are not recorded one by one, they would overwrite each other.
 
         Returns:
             Dict[str, Any]: Dictionary containing the complete response from the model, including
@@ -239,7 +249,11 @@ class BedrockImageGenerator:
 
             # Prepare and save request
             body_json = json.dumps(inference_params, indent=2)
-            self._save_json_to_file(json.loads(body_json), "request.json")
+            if record:
+                self._save_json_to_file(json.loads(body_json), "request.json")
+
+            # Image requests wait behind chat turns when Bedrock is busy
+            admit(model_id, priority=PRIORITY_IMAGE)
 
             # Make the API call
             response = self.bedrock_client.invoke_model(
@@ -250,13 +264,15 @@ class BedrockImageGenerator:
             )
 
             # Save response metadata
-            self._save_json_to_file(
-                response.get("ResponseMetadata", {}), "response_metadata.json"
-            )
+            if record:
+                self._save_json_to_file(
+                    response.get("ResponseMetadata", {}), "response_metadata.json"
+                )
 
             # Process and save response body
             response_body = json.loads(response.get("body").read())
-            self._save_json_to_file(response_body, "response_body.json")
+            if record:
+                self._save_json_to_file(response_body, "response_body.json")
 
             # Log request ID for tracking
             request_id = response.get("ResponseMetadata", {}).get("RequestId")
@@ -274,9 +290,13 @@ class BedrockImageGenerator:
 
             return response_body
 
+        except AdmissionTimeout as e:
+            logger.error(str(e))
+            raise ImageGenerationError(str(e)) from e
+
         except (BotoCoreError, ClientError) as e:
             logger.error(f"AWS service error: {str(e)}")
-            if hasattr(e, "response"):
+            if hasattr(e, "response") and record:
                 self._save_json_to_file(e.response, "error_response.json")
             raise ImageGenerationError(
                 "Failed to generate images: AWS service error"
@@ -394,21 +414,49 @@ def image_manipulator():
                 if total_pixels >= 4194304:
                     st.warning("Total pixel count must be less than 4,194,304.")
 
+            # Sweep mode: one prompt gives an image for every seed, cfgScale and size picked here, generated concurrently
+            st.session_state['img_sweep'] = st.checkbox('Sweep seeds, cfgScale and sizes', value=st.session_state.get('img_sweep', False))
+            if st.session_state['img_sweep']:
+                st.session_state['img_sweep_seeds'] = st.slider(
+                    'Seeds (the first is the random seed above)', min_value=1, max_value=8,
+                    value=st.session_state.get('img_sweep_seeds', 4), step=1
+                )
+                st.session_state['img_sweep_cfg'] = st.slider(
+                    'cfgScale range', min_value=1.1, max_value=10.0,
+                    value=st.session_state.get('img_sweep_cfg', (4.0, 8.0)), step=0.1
+                )
+                st.session_state['img_sweep_cfg_steps'] = st.slider(
+                    'cfgScale values', min_value=1, max_value=5,
+                    value=st.session_state.get('img_sweep_cfg_steps', 3), step=1
+                )
+                current_size = f"{st.session_state.get('img_width', 1024)}x{st.session_state.get('img_height', 1024)}"
+                size_options = list(dict.fromkeys([current_size] + SWEEP_SIZES))
+                st.session_state['img_sweep_sizes'] = st.multiselect(
+                    'Sizes', size_options,
+                    default=[size for size in st.session_state.get('img_sweep_sizes', [current_size]) if size in size_options] or [current_size]
+                )
+                st.caption(f"{len(sweep_settings())} images per prompt")
+                if st.session_state['img_sweep_seeds'] * len(st.session_state['img_sweep_sizes']) * \
+                        len(cfg_scales(*st.session_state['img_sweep_cfg'], st.session_state['img_sweep_cfg_steps'])) > MAX_SWEEP_IMAGES:
+                    st.warning(f"A sweep makes at most {MAX_SWEEP_IMAGES} images, the rest are left out.")
+
             st.write("**Previously generated images**")
         
             if 'current_directory' not in st.session_state:
                 st.session_state['current_directory'] = None
 
-            items = [item for item in os.listdir("workspace") if os.path.isdir(os.path.join("workspace", item)) and item.startswith("nova_canvas_")]
+            workspace_dir = st.session_state['workspace_dir']
+            items = [item for item in os.listdir(workspace_dir) if os.path.isdir(os.path.join(workspace_dir, item)) and item.startswith(CANVAS_PREFIX)]
             #print(items)
             items.sort(key=lambda x: x.split('_'), reverse=True)
             #print(items)
             for item in items:
-                item_path = os.path.join("workspace", item)
-                shortened_name = item[len("nova_canvas_"):]
+                item_path = os.path.join(workspace_dir, item)
+                shortened_name = item[len(CANVAS_PREFIX):]
                 col1, col2 = st.columns([4, 1])
                 with col1:
                     if st.button(shortened_name):
+                        touch_artifact(workspace_dir, item)
                         st.session_state['current_directory'] = item_path
                         st.rerun()
                 with col2:
@@ -420,6 +468,153 @@ def image_manipulator():
 
 
 
+def new_output_directory():
+    """Fresh nova_canvas_* directory in the user's workspace; stops the script when the workspace is full."""
+    workspace_dir = st.session_state['workspace_dir']
+    try:
+        enforce_quota(workspace_dir)
+    except QuotaExceeded as e:
+        st.error(str(e))
+        st.stop()
+    generation_id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    return os.path.join(workspace_dir, f"{CANVAS_PREFIX}{generation_id}")
+
+
+def _no_mask_found(error):
+    """True when Nova Canvas refused a request because its maskPrompt matched nothing in the image."""
+    cause = error.__cause__
+    if isinstance(cause, ClientError):
+        details = cause.response.get("Error", {})
+        return details.get("Code") == "ValidationException" and "mask" in details.get("Message", "").lower()
+    return "mask" in str(error).lower()
+
+
+def run_tiled(image, task_params, mode, keep_unmasked=False):
+    """Process an image Nova Canvas does not take in one request tile by tile, at full resolution.
+
+    task_params(tile_base64) gives the request for one tile. With keep_unmasked a tile in which the maskPrompt finds
+    nothing keeps its original pixels, the object is usually in only some of the tiles.
+    Returns the path of the result, or None when a tile failed.
+    """
+    output_directory = new_output_directory()
+    os.makedirs(output_directory, exist_ok=True)
+    generator = BedrockImageGenerator(output_directory=output_directory)
+    unmasked = []
+
+    def process_tile(tile_base64):
+        try:
+            response = generator.generate_images(task_params(tile_base64), record=False)
+            if not response.get("images"):
+                raise ImageGenerationError(response.get("error") or "No image returned for a tile")
+        except ImageGenerationError as e:
+            if keep_unmasked and _no_mask_found(e):
+                unmasked.append(tile_base64)
+                return tile_base64
+            raise
+        return response["images"][0]
+
+    image_path = os.path.join(output_directory, "image_1.png")
+    progress = st.progress(0.0, text="Processing tiles...")
+    try:
+        # Tiles run in worker threads, the place in the queue could not be shown from there
+        with admission_context(st.session_state.user_id, PRIORITY_IMAGE):
+            tiles = process_tiled(image, process_tile, image_path, mode,
+                                  on_progress=lambda done, total: progress.progress(done / total, text=f"Processed {done} of {total} tiles"))
+    except ImageGenerationError as e:
+        progress.empty()
+        shutil.rmtree(output_directory, ignore_errors=True)
+        st.error(f"Failed to process the image: {e}")
+        return None
+    progress.empty()
+    if unmasked and len(unmasked) == tiles:
+        shutil.rmtree(output_directory, ignore_errors=True)
+        st.error("Failed to process the image: the prompt did not match anything in it.")
+        return None
+    # The tiles' own images are left out, the request is kept for the history like for other generations
+    request = task_params("")
+    request["tiling"] = {"tiles": tiles, "width": image.size[0], "height": image.size[1]}
+    with open(os.path.join(output_directory, "request.json"), "w") as f:
+        json.dump(request, f, indent=2)
+    return image_path
+
+
+def sweep_settings():
+    """The seed, cfgScale, width and height of every image of a sweep, from the sidebar."""
+    seeds = random_seeds(st.session_state.get('img_sweep_seeds', 4), st.session_state.get('img_random_seed'))
+    scales = cfg_scales(*st.session_state.get('img_sweep_cfg', (4.0, 8.0)), st.session_state.get('img_sweep_cfg_steps', 3))
+    sizes = [tuple(int(side) for side in size.split('x')) for size in st.session_state.get('img_sweep_sizes', [])]
+    return sweep_grid(seeds, scales, sizes)
+
+
+def run_sweep_generation(inference_params):
+    """Generate inference_params once for every sweep setting, concurrently, into one output directory.
+
+    Saves image_<n>.png per setting, a contact sheet and request.json with the settings of every image under "sweep".
+    Returns the output directory and the sweep entries, or None when no image was generated.
+    """
+    grid = sweep_settings()
+    if not grid:
+        st.error("Pick at least one valid size for the sweep.")
+        return None
+    output_directory = new_output_directory()
+    os.makedirs(output_directory, exist_ok=True)
+    generator = BedrockImageGenerator(output_directory=output_directory)
+
+    def generate(settings):
+        config = dict(inference_params["imageGenerationConfig"], **settings)
+        response = generator.generate_images(dict(inference_params, imageGenerationConfig=config), record=False)
+        if not response.get("images"):
+            raise ImageGenerationError(response.get("error") or "No image returned")
+        return response["images"][0]
+
+    entries = [dict(settings, file=None) for settings in grid]
+    progress = st.progress(0.0, text=f"Generating {len(grid)} images...")
+    # Requests run in worker threads, the place in the queue could not be shown from there
+    with admission_context(st.session_state.user_id, PRIORITY_IMAGE):
+        for done, (index, image_base64, error) in enumerate(run_sweep(grid, generate), 1):
+            if image_base64:
+                save_base64_image(image_base64, output_directory, "image", f"_{index + 1}")
+                entries[index]["file"] = f"image_{index + 1}.png"
+            else:
+                entries[index]["error"] = error
+            progress.progress(done / len(grid), text=f"Generated {done} of {len(grid)} images")
+    progress.empty()
+    if not any(entry["file"] for entry in entries):
+        shutil.rmtree(output_directory, ignore_errors=True)
+        st.error(f"Failed to generate the images: {entries[0].get('error')}")
+        return None
+    contact_sheet(output_directory, entries)
+    request = dict(inference_params, imageGenerationConfig=dict(inference_params["imageGenerationConfig"], **grid[0]), sweep=entries)
+    with open(os.path.join(output_directory, "request.json"), "w") as f:
+        json.dump(request, f, indent=2)
+    return output_directory, entries
+
+
+def show_sweep(directory, entries, columns=4):
+    """Thumbnails of a sweep with their settings; a button under each takes them over to the sidebar."""
+    failed = [entry for entry in entries if not entry.get("file")]
+    entries = [entry for entry in entries if entry.get("file")]
+    for row in range(0, len(entries), columns):
+        for column, entry in zip(st.columns(columns), entries[row:row + columns]):
+            with column:
+                st.image(os.path.join(directory, entry["file"]), use_container_width=True,
+                         caption=f"seed {entry['seed']}, cfgScale {entry['cfgScale']}, {entry['width']}x{entry['height']}")
+                if st.button("Use these settings", key=f"sweep_use_{directory}_{entry['file']}"):
+                    st.session_state['img_random_seed'] = entry['seed']
+                    st.session_state['img_cfgscale'] = entry['cfgScale']
+                    st.session_state['img_width'] = entry['width']
+                    st.session_state['img_height'] = entry['height']
+                    st.session_state['img_sweep'] = False
+                    st.rerun()
+    if failed:
+        st.warning(f"{len(failed)} of {len(failed) + len(entries)} images failed: {failed[0].get('error')}")
+    sheet_path = os.path.join(directory, CONTACT_SHEET)
+    if os.path.exists(sheet_path):
+        with open(sheet_path, 'rb') as f:
+            st.download_button("Download contact sheet", f.read(), file_name=CONTACT_SHEET, mime="image/png",
+                               key=f"sweep_sheet_{directory}")
+
+
 def show_image_manipulator():
     st.title("Image Manipulator - Do whatever Nova Canvas can do")
     st.info("👉 This part of PIPKA aims to create and manipulate with images together with Nova Canvas model 🤘")
@@ -451,6 +646,8 @@ def show_image_manipulator():
         
         # Get the image dimensions
         width, height = image.size
+        # Sizes Nova Canvas does not take in one request (too large, a side under 320 px) are processed in tiles
+        tiled = not fits_canvas(width, height)
         
         # Adjust dimensions to be divisible by 16
         width = (width // 16) * 16
@@ -466,20 +663,32 @@ def show_image_manipulator():
         
         # Display the image
         st.image(image, caption='Uploaded Image', use_container_width=True)
+        if tiled:
+            st.info(f"The image ({image.size[0]}x{image.size[1]}) is not a size Nova Canvas takes at once, it will be processed in overlapping tiles at full resolution.")
 
         source_image_base64 = base64.b64encode(image_bytes).decode('utf-8')
 
         col1, col2 = st.columns([1, 1])
         with col1:
-            if st.button("Background removal"):
+            background_removal = st.button("Background removal")
+            if background_removal and tiled:
+                image_path = run_tiled(image, lambda tile: {
+                    "taskType": "BACKGROUND_REMOVAL",
+                    "backgroundRemovalParams": {
+                        "image": tile,
+                    },
+                }, 'RGBA')
+                if image_path:
+                    st.image(image_path, caption='Generated Image', use_container_width=True)
+                    st.success(f"Image saved in {os.path.dirname(image_path)}")
+            elif background_removal:
                 inference_params = {
                     "taskType": "BACKGROUND_REMOVAL",
                     "backgroundRemovalParams": {
                         "image": source_image_base64,
                     },
                 }
-                generation_id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                output_directory = f"workspace/nova_canvas_{generation_id}"
+                output_directory = new_output_directory()
                 generator = BedrockImageGenerator(output_directory=output_directory)
                 with st.spinner('Generating image...'):
                     response = generator.generate_images(inference_params)
@@ -501,7 +710,26 @@ def show_image_manipulator():
                         st.rerun()
         with col2:
             col2_prompt = st.text_area("...", max_chars=512, label_visibility="collapsed")
-            if st.button("Manipulate by prompt"):
+            manipulate = st.button("Manipulate by prompt")
+            if manipulate and tiled:
+                image_path = run_tiled(image, lambda tile: {
+                    "taskType": "INPAINTING",
+                    "inPaintingParams": {
+                        "image": tile,
+                        "maskPrompt": col2_prompt
+                    },
+                    "imageGenerationConfig": {
+                        "numberOfImages": 1,
+                        "quality": "standard",
+                        "cfgScale": st.session_state.get('img_cfgscale', 6.5),
+                        # One seed for every tile keeps them alike
+                        "seed": st.session_state.get('img_random_seed', 42),
+                    },
+                }, 'RGB', keep_unmasked=True)
+                if image_path:
+                    st.image(image_path, caption='Generated Image', use_container_width=True)
+                    st.success(f"Image saved in {os.path.dirname(image_path)}")
+            elif manipulate:
                 
                 inference_params = {
                     "taskType": "INPAINTING",
@@ -517,8 +745,7 @@ def show_image_manipulator():
                     },
 
                 }
-                generation_id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                output_directory = f"workspace/nova_canvas_{generation_id}"
+                output_directory = new_output_directory()
                 generator = BedrockImageGenerator(output_directory=output_directory)
                 with st.spinner('Generating image...'):
                     response = generator.generate_images(inference_params)
@@ -573,9 +800,16 @@ def show_image_manipulator():
             },
         }
 
+        if st.session_state.get('img_sweep'):
+            sweep = run_sweep_generation(inference_params)
+            if sweep:
+                # Shown like a history entry below, so its buttons still work after the rerun they cause
+                st.session_state['current_directory'] = sweep[0]
+                st.rerun()
+            st.stop()
+
         # Define an output directory with a unique name
-        generation_id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        output_directory = f"workspace/nova_canvas_{generation_id}"
+        output_directory = new_output_directory()
 
         # Create the generator
         generator = BedrockImageGenerator(output_directory=output_directory)
@@ -610,13 +844,23 @@ def show_image_manipulator():
         image_path = os.path.join(current_dir, "image_1.png")
         request_path = os.path.join(current_dir, "request.json")
     
-        if os.path.exists(image_path):
-            image = Image.open(image_path)
-            st.image(image, caption='Generated Image', use_container_width=True)
-
+        request_data = None
         if os.path.exists(request_path):
             with open(request_path, 'r') as file:
                 request_data = json.load(file)
+
+        if request_data and request_data.get('sweep'):
+            st.write(f"Sweep of {len(request_data['sweep'])} images")
+            show_sweep(current_dir, request_data['sweep'])
+            st.json(request_data,expanded=False)
+            if st.button("Clear Screen"):
+                st.session_state['current_directory'] = False
+                st.rerun()
+        elif os.path.exists(image_path):
+            image = Image.open(image_path)
+            st.image(image, caption='Generated Image', use_container_width=True)
+
+        if request_data and not request_data.get('sweep'):
             st.json(request_data,expanded=False)
                         
             # Uložení relevantních dat do session state
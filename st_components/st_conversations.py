@@ -1,7 +1,10 @@
 
 # Database
-from src.data.database import create_tables, get_all_conversations, get_chats_by_conversation_id, save_conversation, save_chat, delete_conversation
+from src.data.database import create_tables, get_all_conversations, get_chats_by_conversation_id, save_conversation, save_chat, delete_conversation, search_chats
 from src.data.models import Conversation
+from src.utils.jobs import sweep_jobs
+from src.utils.kernels import close_kernel
+from st_components.st_interpreter import attach_kernel
 import uuid
 
 # Streamlit
@@ -11,6 +14,8 @@ from streamlit_option_menu import option_menu
 def init_conversations():
     #DATABASE
     create_tables()
+    # Answers that were running when PIPKA was restarted are marked interrupted, not waited for
+    sweep_jobs()
     conversations = list(reversed(get_all_conversations(st.session_state.user_id)))
     conversation_options = [f"{conversation['name']}" for conversation in conversations]
     return conversations, conversation_options
@@ -19,6 +24,7 @@ def conversation_navigation():
     conversations, conversation_options = init_conversations()
     with st.expander(label="Conversations", expanded=False):
         create_conversation(conversation_options)
+        search_conversations(conversations)
         navigate_past_conversations(conversations, conversation_options)
         delete_current_conversation()
 
@@ -36,12 +42,31 @@ def create_conversation(conversation_options):
             st.success(f"Conversation '{new_conversation_name}' added successfully!")
             st.rerun()
 
+def search_conversations(conversations):
+    query = st.text_input("Search in conversations:", key='conversation_search')
+    if not query.strip():
+        return
+    results = search_chats(st.session_state.user_id, query)
+    if not results:
+        st.caption("Nothing found.")
+    for result in results:
+        label = f"{result['conversation_name']} · {result['role']}: {result['snippet']}"
+        if st.button(label, key=f"search_result_{result['chat_id']}"):
+            for index, element in enumerate(conversations):
+                if element["id"] == result["conversation_id"]:
+                    st.session_state['menu_manual_select'] = index
+                    break
+            st.session_state['jump_to_chat'] = result['chat_id']
+            st.rerun()
+
 def navigate_past_conversations(conversations, conversation_options):
     if len(conversation_options) > 0:
         icons_conversations = ['chat-right-dots-fill'] * len(conversation_options)
+        # Set by a search result to switch the menu to its conversation
+        manual_select = st.session_state.pop('menu_manual_select', None)
         selected_conversation = option_menu(
             "Conversations", conversation_options , 
-            default_index=0, menu_icon='chat',
+            default_index=0, menu_icon='chat', manual_select=manual_select,
             icons=icons_conversations,
             styles={
                 "icon": {"color": "#FEFEFE", "font-size": "12px"}, 
@@ -50,6 +75,8 @@ def navigate_past_conversations(conversations, conversation_options):
             },
             key='menu'
         )
+        if manual_select is not None:
+            selected_conversation = conversation_options[manual_select]
 
         if(selected_conversation):
             for element in conversations:
@@ -57,9 +84,11 @@ def navigate_past_conversations(conversations, conversation_options):
                     st.session_state['current_conversation'] = element
                     break
             st.session_state.messages = get_chats_by_conversation_id(st.session_state['current_conversation']["id"])
+            attach_kernel()
     
 def delete_current_conversation():
     if 'current_conversation' in st.session_state and st.button("Delete Current Conversation", type='primary'):
         delete_conversation(st.session_state['current_conversation']["id"])
+        close_kernel(st.session_state['current_conversation']["id"])
         del st.session_state['current_conversation']
         st.rerun()
\ No newline at end of file
@@ -1,33 +1,43 @@
 import streamlit as st
-from src.utils.prompts import PROMPTS
+from src.utils.kernels import kernel_for
+from src.utils.jobs import ExecutionLimits
+from src.utils.llm_cache import ENABLED_BY_DEFAULT
+from src.utils.turns import TurnSettings, configure_interpreter
 
 
-def setup_interpreter():
-    try:
-        st.session_state['interpreter'].reset()
-    except:
-        pass
-        
-    st.session_state['interpreter'].conversation_filename = st.session_state['current_conversation']["id"]
-    st.session_state['interpreter'].conversation_history = True
-    st.session_state['interpreter'].messages = st.session_state.get(
-        'messages',
-        st.session_state.get('mensajes',[])
-    )
-    st.session_state['interpreter'].llm.model = f"bedrock/us.{st.session_state['model']}"
-    st.session_state['interpreter'].llm.temperature = st.session_state['temperature']
-    st.session_state['interpreter'].llm.max_tokens = st.session_state['max_tokens']
-    st.session_state['interpreter'].llm.system_message = st.session_state['system_message']
-    st.session_state['interpreter'].llm.modify_params=True 
+def attach_kernel():
+    # Every conversation keeps its own interpreter and code kernel, so loaded data survives between turns
+    st.session_state['interpreter'] = kernel_for(st.session_state['current_conversation']["id"])
+
 
-    st.session_state['interpreter'].stream =  True
-    st.session_state['interpreter'].verbose =  True
+def turn_settings():
+    return TurnSettings(
+        model=st.session_state['model'],
+        temperature=st.session_state['temperature'],
+        max_tokens=st.session_state['max_tokens'],
+        auto_run=st.session_state['kill_umans'] == "Yes",
+        language=st.session_state.get('stt_language', 'en-US'),
+        custom_instructions=st.session_state.get('cust_inst', ' '),
+        system_message=st.session_state['system_message'],
+        recall_pairs=st.session_state['num_pair_messages_recall'],
+        recall_token_budget=st.session_state.get('recall_token_budget', 0),
+        limits=ExecutionLimits(
+            wall_seconds=st.session_state.get('exec_wall_minutes', 0) * 60,
+            cpu_seconds=st.session_state.get('exec_cpu_seconds', 0),
+            memory_mb=st.session_state.get('exec_memory_mb', 0),
+        ),
+        response_cache=st.session_state.get('response_cache', ENABLED_BY_DEFAULT),
+    )
 
-    if st.session_state['kill_umans'] == "Yes":
-        st.session_state['interpreter'].auto_run = True
-        st.session_state['interpreter'].system_message = PROMPTS.system_message_run
-    else:
-        st.session_state['interpreter'].auto_run = False
-        st.session_state['interpreter'].system_message = PROMPTS.system_message_confirm
 
-    st.session_state['interpreter'].computer.emit_images = True
+def setup_interpreter(prompt=''):
+    attach_kernel()
+    configure_interpreter(
+        st.session_state['interpreter'],
+        st.session_state['current_conversation']["id"],
+        st.session_state.get('messages', st.session_state.get('mensajes', [])),
+        st.session_state['workspace_dir'],
+        turn_settings(),
+        prompt,
+        st.session_state.user_id,
+    )
@@ -1,11 +1,17 @@
 import streamlit as st
+from streamlit.components.v1 import html
 
 from st_components.st_conversations import init_conversations
-from st_components.st_messages import chat_with_interpreter
+from st_components.st_messages import chat_with_interpreter, queue_notice
 from st_components.st_canvas import show_image_manipulator
 
 from src.data.database import get_chats_by_conversation_id, save_conversation
 from src.data.models import Conversation
+from src.utils.admission import PRIORITY_IMAGE, PRIORITY_REASONING, AdmissionTimeout, admission_context, admit, estimate_tokens
+from src.utils.llm_cache import ENABLED_BY_DEFAULT as CACHE_BY_DEFAULT, CacheStats, cacheable, get as get_cached, put as put_cached, request_key
+from src.utils.file_server import refresh_links
+from src.utils.turns import metrics_caption
+from src.utils.router import REASONING_MODEL, bedrock_model, candidates, is_retryable, max_tokens_for, record_failure, record_success
 import uuid
 
 import instructor
@@ -20,6 +26,8 @@ import imghdr
 #import litellm
 import os
 
+REASONING_TEMPERATURE = 0.2
+
 class StepResponse(BaseModel):
     title: str
     content: str
@@ -32,10 +40,28 @@ def prepare_reasoning_chain():
     client = instructor.from_anthropic(AnthropicBedrock())
     #client = instructor.from_litellm(completion)
 
+    use_cache = st.session_state.get('response_cache', CACHE_BY_DEFAULT) and cacheable(REASONING_TEMPERATURE)
+    stats = CacheStats()
+
     def make_api_call(system_prompt, messages, max_tokens, is_final_answer=False):
         #print(messages)
         #print('entering make_api_call')
+        stats.calls += 1
+        key = request_key(st.session_state.user_id, REASONING_MODEL, REASONING_TEMPERATURE, system_prompt, messages, max_tokens=max_tokens)
+        cached = get_cached(key) if use_cache else None
+        if cached is not None:
+            stats.hits += 1
+            stats.saved_seconds += cached['seconds']
+            return StepResponse(**cached['response'])
         for attempt in range(3):
+            # Picked again on every attempt, a throttled model drops behind its healthy fallbacks
+            model = (candidates(REASONING_MODEL, needs=('reasoning',)) or [REASONING_MODEL])[0]
+            try:
+                admit(model, estimate_tokens(messages, max_tokens))
+            except AdmissionTimeout as e:
+                st.error(str(e))
+                return StepResponse(title="Error", content=str(e), next_action="final_answer", confidence=0.5)
+            started = time.monotonic()
             try:
                 #litellm.modify_params=True
 
@@ -43,13 +69,10 @@ def prepare_reasoning_chain():
                 #response = client.messages.create(
                 #response = client.converse(
                 response = client.chat.completions.create(
-                    model="us.anthropic.claude-3-5-sonnet-20241022-v2:0",
-                    #model="bedrock/anthropic.claude-3-5-sonnet-20241022-v2:0",
-                    #model="bedrock/anthropic.claude-3-5-haiku-20241022-v1:0",
-                    ##model="bedrock/anthropic.claude-3-5-sonnet-20240620-v1:0",
+                    model=bedrock_model(model),
                     #betas=["pdfs-2024-09-25", "prompt-caching-2024-07-31", "token-counting-2024-11-01", ],
-                    max_tokens=max_tokens,
-                    temperature=0.2,
+                    max_tokens=max_tokens_for(model, max_tokens),
+                    temperature=REASONING_TEMPERATURE,
                     top_p=0.99,
                     system=system_prompt,
                     messages=messages,
@@ -57,8 +80,12 @@ def prepare_reasoning_chain():
                 )
                 #print(response.stopReason)
                 #print(response)
+                record_success(model, time.monotonic() - started)
+                if use_cache:
+                    put_cached(key, model, {"response": response.model_dump(), "seconds": time.monotonic() - started})
                 return response
             except Exception as e:
+                record_failure(model, is_retryable(e))
                 st.error(f'{str(e)}')
                 print(f'{str(e)}')
 
@@ -101,6 +128,7 @@ def prepare_reasoning_chain():
         
         while step_count <= max_steps:
             start_time = time.time()
+            hits = stats.hits
             step_data = make_api_call(system_prompt, messages, max_tokens)
             end_time = time.time()
             thinking_time = end_time - start_time
@@ -109,7 +137,8 @@ def prepare_reasoning_chain():
             steps.append((f"Step {step_count}: {step_data.title}", 
                             step_data.content, 
                             thinking_time, 
-                            step_data.confidence))
+                            step_data.confidence,
+                            stats.hits > hits))
             
             messages.append({"role": "assistant", "content": step_data.model_dump_json()})
             
@@ -126,15 +155,17 @@ def prepare_reasoning_chain():
         messages.append({"role": "user", "content": "Please provide a comprehensive final answer based on your reasoning above, summarizing key points and addressing any uncertainties."})
         
         start_time = time.time()
+        hits = stats.hits
         final_data = make_api_call(system_prompt, messages, 750, is_final_answer=True)
         end_time = time.time()
         thinking_time = end_time - start_time
         total_thinking_time += thinking_time
         
-        steps.append(("Final Answer", final_data.content, thinking_time, final_data.confidence))
+        steps.append(("Final Answer", final_data.content, thinking_time, final_data.confidence, stats.hits > hits))
 
         yield steps, total_thinking_time
 
+    generate_response.stats = stats
     return generate_response
 
 def st_main():
@@ -147,7 +178,8 @@ def st_main():
             show_reasoning_chain()
 
         elif st.session_state.get('show_image_manipulator', True):
-            show_image_manipulator()
+            with admission_context(st.session_state.user_id, PRIORITY_IMAGE, queue_notice()):
+                show_image_manipulator()
 
         else:    
 
@@ -196,6 +228,8 @@ def show_reasoning_chain():
                                 st.write(step[1])
                                 st.write(f"Confidence: {step[3]:.2f}")
                                 st.write(f"Thinking time: {step[2]:.2f} seconds")
+                                if step[4]:
+                                    st.caption("From the response cache")
 
             bedrock_message = [
                 {
@@ -256,11 +290,14 @@ def show_reasoning_chain():
             #print(len(bedrock_message))
 
             reasoning_chain = prepare_reasoning_chain()
-            for steps, total_time in reasoning_chain(bedrock_message, max_steps=max_steps, max_tokens=max_tokens):
-                process_steps(steps)
+            with admission_context(st.session_state.user_id, PRIORITY_REASONING, queue_notice(st.empty())):
+                for steps, total_time in reasoning_chain(bedrock_message, max_steps=max_steps, max_tokens=max_tokens):
+                    process_steps(steps)
 
             if total_time:
                 st.chat_message("assistant").write(f"Total thinking time: {total_time:.2f} seconds")
+                if metrics_caption(reasoning_chain.stats.as_dict()):
+                    st.caption(metrics_caption(reasoning_chain.stats.as_dict()))
                 if st.button('New reasoning'):
                     st.session_state['show_reasoning_chain'] = True
                     st.session_state['chat_ready'] = True
@@ -282,11 +319,17 @@ def create_or_get_current_conversation():
         st.session_state.messages = get_chats_by_conversation_id(st.session_state['current_conversation']["id"])
 
 def render_messages():
+    jump_to_chat = st.session_state.pop('jump_to_chat', None)
     for msg in st.session_state.messages:
+        if jump_to_chat and msg.get("id") == jump_to_chat:
+            st.markdown(f'<div id="chat-{jump_to_chat}"></div>', unsafe_allow_html=True)
+            st.caption("🔎 Search result")
         if msg["role"] == "user":
             st.chat_message(msg["role"]).markdown(f'<p>{msg["content"]}</p>', True)
         elif msg["role"] == "assistant":
-            st.chat_message(msg["role"]).markdown(msg["content"])
+            st.chat_message(msg["role"]).markdown(refresh_links(msg["content"], st.session_state['workspace_dir']))
+    if jump_to_chat:
+        html(f"<script>window.parent.document.getElementById('chat-{jump_to_chat}')?.scrollIntoView({{behavior: 'smooth'}});</script>", height=0)
 
 def introduction():
     st.warning("👉 Set your AWS Bedrock model, parameters and press \'Save Changes 🚀\' buttonek 🤘")
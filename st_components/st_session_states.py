@@ -5,6 +5,7 @@ import os
 from interpreter import interpreter
 
 from src.utils.prompts import PROMPTS
+from src.utils.workspace import user_workspace
 
 def init_session_states():
     if 'models' not in st.session_state:
@@ -17,6 +18,8 @@ def init_session_states():
     if 'user_id' not in st.session_state:
         #st.session_state['user_id'] = str(uuid.uuid4())
         st.session_state['user_id'] = os.environ.get("USEREK", "nobody@trustsoft.eu")
+    if 'workspace_dir' not in st.session_state:
+        st.session_state['workspace_dir'] = user_workspace(st.session_state['user_id'])
     if 'interpreter' not in st.session_state:
         st.session_state['interpreter'] = interpreter
     if 'kill_umans' not in st.session_state:
@@ -29,9 +32,8 @@ def init_session_states():
         st.session_state['audio_queue'] = []
     if 'cust_inst' not in st.session_state:
         st.session_state['cust_inst'] = ''
-
-    if 'token_limit_reached' not in st.session_state:
-        st.session_state.token_limit_reached = False
+    if 'columnar_ingest' not in st.session_state:
+        st.session_state['columnar_ingest'] = False
 
     if 'show_reasoning_chain' not in st.session_state:
         st.session_state['show_reasoning_chain'] = False
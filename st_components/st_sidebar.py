@@ -11,6 +11,14 @@ from random import randint
 from st_components.st_canvas import image_manipulator
 from st_components.st_conversations import conversation_navigation
 from src.utils.file_utils import display_directory_tree, render_directory_tree, allowed_file, ALLOWED_EXTENSIONS
+from src.utils.file_server import file_url
+from src.utils.uploads import store_file
+from src.utils.datasets import is_tabular, refresh_profiles, schedule_profile
+from src.utils.workspace import QuotaExceeded, enforce_quota, quota_status
+from src.utils.router import AUTO_MODEL, health_report, max_output_tokens
+from src.utils.admission import queue_report
+from src.utils.llm_cache import ENABLED_BY_DEFAULT as CACHE_BY_DEFAULT, MAX_TEMPERATURE, TTL_SECONDS
+from st_components.st_uploader import chunked_uploader
 
 import os
 
@@ -106,29 +114,31 @@ def about_us():
     #st.write(st.session_state['cust_inst'])
 
 def file_manager():
-    workspace_dir = 'workspace'
+    workspace_dir = st.session_state['workspace_dir']
     with st.expander(label="File Manager", expanded=False):
-        st.write("Manage files in the **workspace** folder")
+        st.write("Manage files in your **workspace** folder")
+        used, soft, hard = quota_status(workspace_dir)
+        if hard:
+            st.progress(min(used / hard, 1.0), text=f"{used / 1024 ** 2:.0f} MB of {hard / 1024 ** 2:.0f} MB used")
+        if soft and used > soft:
+            st.warning("Workspace is over its soft quota, old generated images and caches are removed automatically.")
 
 #        tree = display_directory_tree(workspace_dir)
 #        render_directory_tree(tree)
 
         # Seznam souborů s ikonami pro stažení a smazání
+        st.session_state['columnar_ingest'] = st.checkbox(
+            "Keep Parquet copies of CSV/Excel files (faster analysis)",
+            value=st.session_state.get('columnar_ingest', False))
+
         files = list_files(workspace_dir)
+        refresh_profiles(workspace_dir, columnar=st.session_state['columnar_ingest'])
         for file in files:
             col1, col2, col3 = st.columns([4, 1, 1])
             col1.write(file)
             
-            # Ikona pro stažení
-            if col2.button("💾", key=f"download_{file}"):
-                with open(os.path.join(workspace_dir, file), "rb") as f:
-                    st.download_button(
-                        label="Download",
-                        data=f.read(),
-                        file_name=file,
-                        mime="application/octet-stream",
-                        key=f"download_button_{file}"
-                    )
+            # Ikona pro stažení - soubor streamuje file server, ne Streamlit
+            col2.link_button("💾", file_url(os.path.join(workspace_dir, file)))
             
             # Ikona pro smazání
             if col3.button("❌", key=f"delete_{file}"):
@@ -140,13 +150,25 @@ def file_manager():
         uploaded_file = st.file_uploader("Choose a file to upload", type=list(ALLOWED_EXTENSIONS))
         if uploaded_file is not None:
             if allowed_file(uploaded_file.name):
-                with open(os.path.join(workspace_dir, uploaded_file.name), "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                st.success(f"File {uploaded_file.name} has been uploaded successfully!")
-                st.rerun()
+                try:
+                    enforce_quota(workspace_dir, uploaded_file.size)
+                    status, duplicate_of = store_file(workspace_dir, uploaded_file, os.path.basename(uploaded_file.name))
+                except QuotaExceeded as e:
+                    st.error(str(e))
+                    status, duplicate_of = None, None
+                if duplicate_of:
+                    st.info(f"File {uploaded_file.name} has the same content as {duplicate_of}.")
+                # Uploader keeps the file between reruns - only rerun when something was written
+                if status == "stored":
+                    if is_tabular(uploaded_file.name):
+                        schedule_profile(workspace_dir, os.path.basename(uploaded_file.name))
+                    st.success(f"File {uploaded_file.name} has been uploaded successfully!")
+                    st.rerun()
             else:
                 st.error("File type not allowed.")
 
+        chunked_uploader(workspace_dir)
+
 
 def set_bedrock_credentials():
     st.markdown("""
@@ -174,21 +196,39 @@ def set_bedrock_credentials():
     """, unsafe_allow_html=True)
 
     with st.expander(label="LLM Settings", expanded=(not st.session_state['chat_ready'])):
+        bedrock_models = st.session_state['models']['bedrock']
         model = st.selectbox(
             label='Amazon Bedrock model',
-            options=list(st.session_state['models']['bedrock'].keys()),
+            # Auto lets the router pick a small model for simple messages and a large one for complex tasks
+            options=[AUTO_MODEL] + list(bedrock_models.keys()),
+            format_func=lambda option: 'Auto (picked per message)' if option == AUTO_MODEL else option,
             index=0,
             # disabled= not st.session_state.openai_key # Comment: Why?
         )
-        context_window = st.session_state['models']['bedrock'][model]['context_window']
+        if model == AUTO_MODEL:
+            context_window = max(settings['context_window'] for settings in bedrock_models.values())
+        else:
+            context_window = bedrock_models[model]['context_window']
+        # For auto clamped to the routed model's own limit per message; longer answers are continued automatically
+        output_limit = max_output_tokens(model)
+        throttled = [name for name, health in health_report().items() if health['blocked']]
+        if throttled:
+            st.caption(f"Throttled right now, answered by fallbacks: {', '.join(throttled)}")
+        queued = queue_report()
+        if queued:
+            st.caption(f"Waiting for Bedrock: {', '.join(f'{service} ({count})' for service, count in queued.items())}")
 
         temperature = st.slider('Tempeture (0 - precise .. 1 - creative)', min_value=0.01, max_value=1.0
                                     , value=st.session_state.get('temperature', 0.1), step=0.01)
-        max_tokens = st.slider('Max output tokens', min_value=1, max_value=context_window
-                                    , value=st.session_state.get('max_tokens', 1024), step=1)
+        max_tokens = st.slider('Max output tokens', min_value=1, max_value=output_limit
+                                    , value=min(st.session_state.get('max_tokens', 1024), output_limit), step=1)
 
         num_pair_messages_recall = st.slider(
-            'Memory Size: user-assistant message pairs', min_value=1, max_value=20, value=10)
+            'Memory Size: user-assistant message pairs', min_value=1, max_value=20,
+            value=st.session_state.get('num_pair_messages_recall', 4))
+        recall_token_budget = st.slider(
+            'Recall from older messages (tokens, 0 = off)', min_value=0, max_value=4000,
+            value=st.session_state.get('recall_token_budget', 800), step=100)
 
         col1, col2, col3 = st.columns([2, 1, 1])  
         with col1:
@@ -233,6 +273,16 @@ def set_bedrock_credentials():
         )
 
         talk = st.checkbox('Please, talk to me')
+        response_cache = st.checkbox('Reuse answers to repeated requests', value=st.session_state.get('response_cache', CACHE_BY_DEFAULT),
+                                     help=f'Only at temperature {MAX_TEMPERATURE} or lower. Answers are kept for {TTL_SECONDS / 3600:g} hours.')
+
+        with st.popover("Execution limits"):
+            exec_wall_minutes = st.number_input('Wall time per answer (minutes, 0 = unlimited)', min_value=0, max_value=24*60,
+                                                value=st.session_state.get('exec_wall_minutes', 0), step=1)
+            exec_cpu_seconds = st.number_input('CPU time of executed code (seconds, 0 = unlimited)', min_value=0, max_value=24*3600,
+                                               value=st.session_state.get('exec_cpu_seconds', 0), step=10)
+            exec_memory_mb = st.number_input('Memory of executed code (MB, 0 = unlimited)', min_value=0, max_value=1024*1024,
+                                             value=st.session_state.get('exec_memory_mb', 0), step=256)
 
         kill_umans = st.selectbox(
             label='Kill all humans?',
@@ -254,8 +304,13 @@ def set_bedrock_credentials():
             st.session_state['context_window'] = context_window
             st.session_state['stt_language'] = stt_language
             st.session_state['num_pair_messages_recall'] = num_pair_messages_recall
+            st.session_state['recall_token_budget'] = recall_token_budget
             st.session_state['kill_umans'] = kill_umans
             st.session_state['talk'] = talk
+            st.session_state['response_cache'] = response_cache
+            st.session_state['exec_wall_minutes'] = exec_wall_minutes
+            st.session_state['exec_cpu_seconds'] = exec_cpu_seconds
+            st.session_state['exec_memory_mb'] = exec_memory_mb
             st.session_state['cust_inst'] = cust_inst
             st.session_state['chat_ready'] = True
             st.session_state['show_reasoning_chain'] = False
@@ -0,0 +1,99 @@
+import streamlit as st
+from streamlit.components.v1 import html
+
+from src.utils.file_server import APP_ORIGINS, file_server_url, space_token
+from src.utils.file_utils import ALLOWED_EXTENSIONS
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+UPLOADER_TEMPLATE = """
+<style>
+    body { font-family: "Source Sans Pro", sans-serif; font-size: 12px; color: #fefefe; margin: 0; }
+    input { color: #fefefe; }
+    div.row { margin-top: 4px; }
+</style>
+<input type="file" id="files" accept="__ACCEPT__" multiple>
+<div id="status"></div>
+<script>
+const BASE = "__BASE__";
+const TOKEN = encodeURIComponent("__TOKEN__");
+const CHUNK = __CHUNK__;
+const sleep = (ms) => new Promise(r => setTimeout(r, ms));
+
+// Same file (name, size, mtime) -> same id, so a reload resumes instead of starting over
+function uploadId(file) {
+    const key = `${file.name}:${file.size}:${file.lastModified}`;
+    let a = 0x811c9dc5, b = 0x01000193;
+    for (let i = 0; i < key.length; i++) {
+        a = Math.imul(a ^ key.charCodeAt(i), 16777619) >>> 0;
+        b = Math.imul(b ^ key.charCodeAt(i), 2246822519) >>> 0;
+    }
+    return a.toString(16).padStart(8, "0") + b.toString(16).padStart(8, "0");
+}
+
+async function serverOffset(id) {
+    while (true) {
+        try {
+            const res = await fetch(`${BASE}/uploads/${id}?token=${TOKEN}`);
+            return (await res.json()).offset || 0;
+        } catch (e) {
+            await sleep(2000);
+        }
+    }
+}
+
+async function upload(file, row) {
+    const id = uploadId(file);
+    let offset = await serverOffset(id);
+    while (true) {
+        const url = `${BASE}/uploads/${id}?token=${TOKEN}&name=${encodeURIComponent(file.name)}&offset=${offset}&total=${file.size}`;
+        let res, body;
+        try {
+            res = await fetch(url, { method: "PUT", body: file.slice(offset, Math.min(offset + CHUNK, file.size)) });
+            body = await res.json();
+        } catch (e) {
+            row.textContent = `${file.name}: connection lost, resuming...`;
+            offset = await serverOffset(id);
+            continue;
+        }
+        if (res.status === 409) {
+            offset = await serverOffset(id);
+            continue;
+        }
+        if (!res.ok) {
+            row.textContent = `${file.name}: ${body.error}`;
+            return;
+        }
+        offset = body.offset;
+        row.textContent = `${file.name}: ${Math.floor(100 * offset / Math.max(file.size, 1))} %`;
+        if (body.done) {
+            const note = body.duplicate_of ? ` (same content as ${body.duplicate_of})` : "";
+            row.textContent = `${file.name}: ${body.status}${note}`;
+            return;
+        }
+    }
+}
+
+document.getElementById("files").addEventListener("change", async (event) => {
+    for (const file of event.target.files) {
+        const row = document.createElement("div");
+        row.className = "row";
+        document.getElementById("status").appendChild(row);
+        await upload(file, row);
+    }
+});
+</script>
+"""
+
+
+def chunked_uploader(workspace_dir):
+    st.caption("Large files - uploaded in chunks, resumable after reload")
+    origin = st.context.headers.get("Origin")
+    if origin and origin.rstrip('/') not in APP_ORIGINS:
+        st.warning(f"The file server does not accept uploads from {origin}, add it to PIPKA_APP_ORIGINS.")
+    markup = (UPLOADER_TEMPLATE
+              .replace("__BASE__", file_server_url())
+              .replace("__TOKEN__", space_token(workspace_dir))
+              .replace("__CHUNK__", str(CHUNK_SIZE))
+              .replace("__ACCEPT__", ",".join(f".{ext}" for ext in sorted(ALLOWED_EXTENSIONS))))
+    html(markup, height=110, scrolling=True)
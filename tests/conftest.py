@@ -0,0 +1,44 @@
+import os
+import uuid
+
+import pytest
+
+from src.data import database
+from src.utils import embeddings
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh SQLite database in tmp_path, used by everything in src.data.database."""
+    monkeypatch.setattr(database, "DATABASE_URL", "")
+    monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path / "chats.db"))
+    database.create_tables()
+    yield database
+    # Writes still queued would otherwise land in the next test's database
+    database.flush_writes()
+
+
+@pytest.fixture
+def local_embeddings(monkeypatch):
+    """The hashing embedder of PIPKA_EMBEDDINGS=local, no model or network needed."""
+    monkeypatch.setattr(embeddings, "EMBEDDINGS_BACKEND", "local")
+
+
+@pytest.fixture
+def postgres_db(monkeypatch):
+    """database on the PostgreSQL server of PIPKA_TEST_DATABASE_URL, in a schema of its own that is dropped after."""
+    url = os.environ.get("PIPKA_TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("PIPKA_TEST_DATABASE_URL is not set")
+    psycopg = pytest.importorskip("psycopg")
+    schema = f"pipka_test_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(url, autocommit=True) as connection:
+        connection.execute(f"CREATE SCHEMA {schema}")
+    monkeypatch.setattr(database, "DATABASE_URL", f"{url}{'&' if '?' in url else '?'}options=-csearch_path%3D{schema}")
+    try:
+        database.create_tables()
+        yield database
+        database.flush_writes()
+    finally:
+        with psycopg.connect(url, autocommit=True) as connection:
+            connection.execute(f"DROP SCHEMA {schema} CASCADE")
@@ -0,0 +1,147 @@
+import sys
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils import admission
+from src.utils.admission import PRIORITY_BACKGROUND, PRIORITY_CHAT
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """A service taking a request every 0.2 s, with no burst."""
+    monkeypatch.setattr(admission, "BURST_SECONDS", 0.2)
+    monkeypatch.setattr(admission, "RECHECK_SECONDS", 0.02)
+    monkeypatch.setattr(admission, "_services", {"test-service": admission._Service({"requests_per_minute": 300})})
+    return "test-service"
+
+
+def queue(service, requests):
+    """Queue (name, user, priority) requests one after another; returns the names in the order they were admitted."""
+    admitted, threads = [], []
+    state = admission._services[service]
+
+    def request(name, user_id, priority):
+        admission.admit(service, user_id=user_id, priority=priority)
+        admitted.append(name)
+
+    for name, user_id, priority in requests:
+        thread = threading.Thread(target=request, args=(name, user_id, priority))
+        waiting = len(state.waiting)
+        thread.start()
+        threads.append(thread)
+        while len(state.waiting) == waiting:
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join(10)
+    return admitted
+
+
+def test_chat_goes_before_background_work(service):
+    admission.admit(service, user_id="warm up")
+
+    admitted = queue(service, [("summary", "alice", PRIORITY_BACKGROUND), ("embedding", "alice", PRIORITY_BACKGROUND),
+                               ("chat", "bob", PRIORITY_CHAT)])
+
+    assert admitted == ["chat", "summary", "embedding"]
+
+
+def test_users_take_turns_within_a_priority(service):
+    admission.admit(service, user_id="warm up")
+
+    admitted = queue(service, [("alice 1", "alice", PRIORITY_BACKGROUND), ("alice 2", "alice", PRIORITY_BACKGROUND),
+                               ("alice 3", "alice", PRIORITY_BACKGROUND), ("bob 1", "bob", PRIORITY_BACKGROUND)])
+
+    assert admitted == ["alice 1", "bob 1", "alice 2", "alice 3"]
+
+
+def test_request_gives_up_after_the_queue_timeout(service, monkeypatch):
+    monkeypatch.setattr(admission, "QUEUE_TIMEOUT", 0.05)
+    admission.admit(service, user_id="alice")
+
+    with pytest.raises(admission.AdmissionTimeout):
+        admission.admit(service, user_id="alice")
+    assert admission._services[service].waiting == []
+
+
+def test_services_without_limits_are_admitted_at_once():
+    assert admission.admit("no-such-service", user_id="alice") == 0.0
+
+
+def test_async_waiters_leave_the_event_loop_free(service):
+    admission.admit(service, user_id="warm up")
+    ticks = []
+
+    async def main():
+        async def ticker():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        ticking = asyncio.ensure_future(ticker())
+        waited = await asyncio.gather(admission.admit_async(service, user_id="alice"),
+                                      admission.admit_async(service, user_id="bob"))
+        ticking.cancel()
+        return waited
+
+    waited = asyncio.run(main())
+
+    assert sorted(waited)[1] > 0.3
+    # The loop kept running while both waited
+    assert len(ticks) > 20
+
+
+def test_async_and_thread_waiters_share_the_queue(service):
+    admission.admit(service, user_id="warm up")
+    admitted = []
+
+    def chat():
+        admission.admit(service, user_id="bob", priority=PRIORITY_CHAT)
+        admitted.append("chat")
+
+    async def main():
+        waiting = asyncio.ensure_future(admission.admit_async(service, user_id="alice", priority=PRIORITY_BACKGROUND))
+        while not admission._services[service].waiting:
+            await asyncio.sleep(0.001)
+        thread = threading.Thread(target=chat)
+        thread.start()
+        await waiting
+        admitted.append("summary")
+        thread.join(5)
+
+    asyncio.run(main())
+
+    assert admitted == ["chat", "summary"]
+
+
+def test_call_inside_admitted_is_not_queued_again(service):
+    admission.admit(service, user_id="warm up")
+
+    async def main():
+        async with admission.admitted(service, user_id="alice"):
+            # A blocking call in a worker thread, admitting itself like speech.synthesize
+            inner = await asyncio.to_thread(admission.admit, service, user_id="alice")
+        return inner
+
+    assert asyncio.run(main()) == 0.0
+    # Only for the one request
+    assert admission._admitted.get() == frozenset()
+
+
+def test_background_summaries_are_charged_to_the_user(db, monkeypatch):
+    from src.utils import summaries
+
+    charged = []
+    monkeypatch.setattr(summaries, "SUMMARY_TRIGGER_TOKENS", 10)
+    monkeypatch.setattr(summaries, "admit", lambda model, tokens, user_id=None, priority=None: charged.append((user_id, priority)))
+    monkeypatch.setattr(summaries._executor, "submit", lambda function, *args: function(*args))
+    # Only the admission is looked at; the model call itself fails and is logged
+    monkeypatch.setitem(sys.modules, "litellm", SimpleNamespace(completion=None))
+    messages = [{"role": role, "content": "x" * 100} for _ in range(6) for role in ("user", "assistant")]
+
+    summaries.compact_history("c1", messages, "alice")
+
+    assert charged == [("alice", PRIORITY_BACKGROUND)]
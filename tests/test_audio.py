@@ -0,0 +1,53 @@
+import struct
+
+import pytest
+
+from src.utils.audio import duration, mp3_duration, ogg_duration
+
+# MPEG 1 Layer III, 128 kbit/s, 44.1 kHz, no padding: 417 byte frames of 1152 samples
+MP3_HEADER = b'\xff\xfb\x90\x00'
+MP3_FRAME = MP3_HEADER + bytes(417 - 4)
+# MPEG 2 Layer III, 32 kbit/s, 22.05 kHz: 576 samples in 104 bytes
+MP3_FRAME_MPEG2 = b'\xff\xf3\x40\x00' + bytes(104 - 4)
+
+
+def id3_tag(size):
+    # The size is stored in four 7 bit bytes
+    return b'ID3\x04\x00\x00' + bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0)) + b'\x00' * size
+
+
+def ogg_page(granule, payload, header_type=0):
+    return b'OggS\x00' + bytes([header_type]) + struct.pack('<qIII', granule, 1, 0, 0) + bytes([1, len(payload)]) + payload
+
+
+def test_mp3_duration_counts_frames():
+    assert mp3_duration(MP3_FRAME * 100) == pytest.approx(100 * 1152 / 44100)
+    assert mp3_duration(MP3_FRAME_MPEG2 * 50) == pytest.approx(50 * 576 / 22050)
+
+
+def test_mp3_duration_skips_tags_and_junk():
+    data = id3_tag(300) + MP3_FRAME * 10 + b'junk' + MP3_FRAME * 10 + b'TAG' + bytes(125)
+
+    assert mp3_duration(data) == pytest.approx(20 * 1152 / 44100)
+    assert mp3_duration(b'') == 0
+
+
+def test_ogg_opus_duration():
+    head = b'OpusHead\x01\x01' + struct.pack('<HIhB', 312, 48000, 0, 0)
+    data = ogg_page(0, head, header_type=2) + ogg_page(0, b'OpusTags') + ogg_page(48000 * 3 + 312, bytes(100), header_type=4)
+
+    assert ogg_duration(data) == pytest.approx(3.0)
+
+
+def test_ogg_vorbis_duration():
+    head = b'\x01vorbis' + struct.pack('<IBIiiiBB', 0, 1, 22050, 0, 0, 0, 0xB8, 1)
+    data = ogg_page(0, head, header_type=2) + ogg_page(22050 * 5, bytes(100), header_type=4)
+
+    assert ogg_duration(data) == pytest.approx(5.0)
+
+
+def test_duration_by_mime_type():
+    assert duration(MP3_FRAME * 100, 'audio/mpeg') == pytest.approx(100 * 1152 / 44100)
+    assert duration(MP3_FRAME * 100, 'audio/ogg') == 0.0
+    # Cut off in the header: no duration rather than an error
+    assert duration(b'OggS\x00\x02' + bytes(4) + b'OpusHead', 'audio/ogg') == 0.0
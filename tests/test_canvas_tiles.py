@@ -0,0 +1,87 @@
+import io
+import base64
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.utils import canvas_tiles
+from src.utils.canvas_tiles import MIN_SIDE, _blend, fits_canvas, process_tiled, tile_positions
+
+
+def random_image(width, height, seed=0):
+    return Image.fromarray(np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def checked(sizes):
+    """process_tile that returns the tile unchanged, after checking Nova Canvas would take it."""
+    def process_tile(tile_base64):
+        with Image.open(io.BytesIO(base64.b64decode(tile_base64))) as tile:
+            assert fits_canvas(*tile.size), tile.size
+            sizes.append(tile.size)
+        return tile_base64
+    return process_tile
+
+
+@pytest.mark.parametrize("length, tile", [(100, 200), (1000, 300), (5000, 2032), (2032, 2032), (2033, 2032)])
+def test_tiles_cover_the_whole_length(length, tile):
+    positions = tile_positions(length, tile)
+
+    assert positions[0] == 0
+    assert positions[-1] + min(tile, length) == length
+    for before, after in zip(positions, positions[1:]):
+        assert before < after <= before + tile - canvas_tiles.OVERLAP
+
+
+def test_blend_cross_fades_the_overlap():
+    first = np.zeros((4, 10, 3), np.uint8)
+    second = np.full((4, 10, 3), 200, np.uint8)
+
+    blended = _blend(first, second, 6, axis=1)
+
+    assert blended.shape == (4, 16, 3)
+    assert (blended[:, :6] == 0).all() and (blended[:, 10:] == 200).all()
+    overlap = blended[0, 6:10, 0]
+    assert list(overlap) == sorted(overlap) and 0 < overlap[0] and overlap[-1] < 200
+
+
+def test_blend_of_equal_tiles_changes_nothing():
+    image = np.asarray(random_image(50, 40))
+
+    assert (_blend(image[:, :30], image[:, 20:], 20, axis=1) == image).all()
+    assert (_blend(image[:25], image[10:], 10, axis=0) == image).all()
+
+
+@pytest.mark.parametrize("width, height", [(900, 700), (1300, 250), (200, 150), (90, 2000)])
+def test_tiled_result_matches_the_image(tmp_path, width, height):
+    image, sizes = random_image(width, height), []
+
+    tiles = process_tiled(image, checked(sizes), tmp_path / "out.png", tile_size=400, overlap=64, workers=2)
+
+    assert tiles == len(sizes)
+    with Image.open(tmp_path / "out.png") as result:
+        assert result.size == (width, height)
+        assert (np.asarray(result) == np.asarray(image)).all()
+
+
+def test_small_tiles_are_padded_for_the_request(tmp_path):
+    sizes = []
+
+    process_tiled(random_image(200, 100), checked(sizes), tmp_path / "out.png")
+
+    assert sizes == [(MIN_SIDE, MIN_SIDE)]
+
+
+def test_tiles_are_processed_and_blended(tmp_path):
+    def darken(tile_base64):
+        with Image.open(io.BytesIO(base64.b64decode(tile_base64))) as tile:
+            result = Image.fromarray(np.asarray(tile) // 2)
+        buffered = io.BytesIO()
+        result.save(buffered, format='PNG')
+        return base64.b64encode(buffered.getvalue()).decode()
+
+    image = random_image(1000, 600)
+    process_tiled(image, darken, tmp_path / "out.png", tile_size=400, overlap=64)
+
+    with Image.open(tmp_path / "out.png") as result:
+        assert (np.abs(np.asarray(result).astype(int) - np.asarray(image) // 2) <= 1).all()
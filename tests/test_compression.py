@@ -0,0 +1,73 @@
+import sqlite3
+
+from src.data.compression import COMPRESS_THRESHOLD, pack_text, unpack_text
+from src.data.models import Chat, Conversation
+
+
+def test_large_contents_are_packed():
+    short, long = "short", "x" * COMPRESS_THRESHOLD
+
+    assert pack_text(short) == (short, None)
+    content, content_z = pack_text(long)
+    assert content is None and len(content_z) < len(long)
+    assert unpack_text(content, content_z) == long
+    assert unpack_text(*pack_text(short)) == short
+
+
+def test_compact_database_compresses_old_chats(db):
+    db.save_conversation(Conversation("c1", "alice"))
+    long_text = "print('hello world')\n" * (COMPRESS_THRESHOLD // 10)
+    # Stored plain, the way chats were written before compression existed
+    with db.create_connection() as cursor:
+        cursor.execute("INSERT INTO chats (id, conversation_id, role, content, content_z) VALUES ('a', 'c1', 'assistant', ?, NULL)",
+                       (long_text,))
+        cursor.execute("INSERT INTO chats (id, conversation_id, role, content, content_z) VALUES ('b', 'c1', 'user', 'short one', NULL)")
+
+    compressed, _, _ = db.compact_database()
+
+    assert compressed == 1
+    with db.create_connection() as cursor:
+        cursor.execute("SELECT id, content, content_z IS NOT NULL FROM chats ORDER BY id")
+        assert cursor.fetchall() == [('a', None, 1), ('b', 'short one', 0)]
+    assert [chat["content"] for chat in db.get_chats_by_conversation_id("c1")] == [long_text, "short one"]
+    assert [result["chat_id"] for result in db.search_chats("alice", "hello")] == ["a"]
+    assert db.compact_database()[0] == 0
+
+
+def test_search_index_keeps_no_copy_of_the_text(db):
+    db.save_conversation(Conversation("c1", "alice"))
+    long_text = "the quarterly revenue report " * COMPRESS_THRESHOLD
+    db.save_chat(Chat("c1", "assistant", long_text))
+    db.flush_writes()
+
+    with db.create_connection() as cursor:
+        cursor.execute("SELECT sum(length(block)) FROM chats_fts_data")
+        index_size = cursor.fetchone()[0]
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE name='chats_fts_content'")
+        assert cursor.fetchone()[0] == 0
+    # Word positions only, a copy of the text alone would be as large as it
+    assert index_size < len(long_text) / 4
+    assert db.search_chats("alice", "quarterly rev")[0]["snippet"].startswith("the **quarterly** **revenue** report")
+
+
+def test_search_index_of_an_older_database_is_migrated(tmp_path, monkeypatch):
+    from src.data import database
+
+    path = str(tmp_path / "old.db")
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE chats (id TEXT PRIMARY KEY, conversation_id TEXT, role TEXT, content TEXT)")
+        connection.execute("CREATE VIRTUAL TABLE chats_fts USING fts5(content, tokenize='unicode61 remove_diacritics 2')")
+        connection.execute("INSERT INTO chats VALUES ('a', 'c1', 'user', 'Příliš žluťoučký kůň')")
+        connection.execute("INSERT INTO chats_fts (rowid, content) SELECT rowid, content FROM chats")
+    monkeypatch.setattr(database, "DATABASE_URL", "")
+    monkeypatch.setattr(database, "DATABASE_PATH", path)
+
+    database.create_tables()
+    database.save_conversation(Conversation("c1", "alice"))
+
+    assert [result["snippet"] for result in database.search_chats("alice", "zlutoucky")] == ["Příliš **žluťoučký** kůň"]
+    database.update_chat_content("a", "something else")
+    database.flush_writes()
+    assert database.search_chats("alice", "kun") == []
+    with database.create_connection() as cursor:
+        cursor.execute("INSERT INTO chats_fts (chats_fts, rank) VALUES ('integrity-check', 0)")
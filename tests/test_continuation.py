@@ -0,0 +1,128 @@
+import pytest
+
+from src.utils import continuation, router
+from src.utils.continuation import CUT_NOTE, continued_completions
+
+MODELS = {
+    "claude": {"capabilities": ["prefill", "prompt_caching"]},
+    "nova": {"capabilities": []},
+}
+
+
+@pytest.fixture(autouse=True)
+def models(monkeypatch):
+    monkeypatch.setattr(router, "_config", {"bedrock": MODELS, "services": {}})
+    monkeypatch.setattr(router, "_health", {})
+
+
+def chunk(content=None, finish_reason=None, tool_calls=None):
+    delta = {"content": content}
+    if tool_calls:
+        delta["tool_calls"] = tool_calls
+    return {"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+
+def scripted(*answers):
+    """completions(**params) answering each request with the next (text, finish_reason), recording the requests."""
+    def completions(**params):
+        requests.append(params)
+        result = answers[len(requests) - 1]
+        if isinstance(result, Exception):
+            raise result
+        text, finish_reason = result
+        for word in text.split(' '):
+            yield chunk(word + ' ')
+        yield chunk(finish_reason=finish_reason)
+    requests = []
+    completions.requests = requests
+    return completions
+
+
+def text_of(chunks):
+    return ''.join(chunk["choices"][0]["delta"].get("content") or '' for chunk in chunks)
+
+
+def test_answer_cut_at_the_limit_is_continued_from_a_prefill():
+    completions = scripted(("The first half", "length"), ("and the rest.", "stop"))
+    messages = [{"role": "user", "content": "Write a long story"}]
+
+    chunks = list(continued_completions(completions, "claude")(messages=messages, max_tokens=10))
+
+    assert text_of(chunks) == "The first half and the rest. "
+    assert completions.requests[0]["messages"] == messages
+    assert completions.requests[1]["messages"] == messages + [{"role": "assistant", "content": "The first half"}]
+    assert completions.requests[1]["max_tokens"] == 10
+
+
+def test_answer_still_cut_after_the_last_continuation_gets_a_note():
+    completions = scripted(*[("more", "length")] * 3)
+
+    chunks = list(continued_completions(completions, "claude", max_continuations=2)(messages=[]))
+
+    assert len(completions.requests) == 3
+    assert text_of(chunks).endswith(CUT_NOTE)
+
+
+def test_failed_continuation_keeps_what_was_streamed():
+    completions = scripted(("The first half", "length"), TimeoutError("timed out"))
+
+    chunks = list(continued_completions(completions, "claude")(messages=[]))
+
+    assert text_of(chunks) == "The first half " + CUT_NOTE
+
+
+def test_first_request_failing_is_raised():
+    completions = scripted(TimeoutError("timed out"))
+
+    with pytest.raises(TimeoutError):
+        list(continued_completions(completions, "claude")(messages=[]))
+
+
+def test_tool_calls_and_complete_answers_are_left_alone():
+    completions = scripted(("done.", "stop"))
+    assert text_of(continued_completions(completions, "claude")(messages=[])) == "done. "
+    assert len(completions.requests) == 1
+
+    def tool_call(**params):
+        tool_call.calls += 1
+        yield chunk(tool_calls=[{"id": "1", "function": {"name": "execute", "arguments": "{\"code\": \"pri"}}])
+        yield chunk(finish_reason="length")
+    tool_call.calls = 0
+    list(continued_completions(tool_call, "claude")(messages=[]))
+    assert tool_call.calls == 1
+
+
+def test_models_without_prefill_are_not_continued():
+    completions = scripted(("The first half", "length"))
+
+    chunks = list(continued_completions(completions, "nova")(messages=[]))
+
+    assert text_of(chunks) == "The first half "
+    assert len(completions.requests) == 1
+
+
+def test_long_prompts_are_marked_for_prompt_caching():
+    completions = scripted(("a", "length"), ("b", "stop"))
+    long_prompt = "x" * continuation.CACHE_MIN_TOKENS * continuation.CHARS_PER_TOKEN
+
+    list(continued_completions(completions, "claude")(messages=[{"role": "user", "content": long_prompt}]))
+
+    for request in completions.requests:
+        assert request["messages"][0]["content"][0]["cache_control"] == {"type": "ephemeral"}
+
+
+def test_continuations_stay_on_the_model_the_router_called():
+    calls = []
+
+    def completions(**params):
+        calls.append(params["model"])
+        if params["model"] == "bedrock/us.claude":
+            raise TimeoutError("timed out")
+        yield chunk("half", finish_reason="length")
+
+    routed = router.routed_completions(completions, ["claude", "nova"],
+                                       per_model=lambda call, model: continued_completions(call, model))
+
+    assert text_of(routed(messages=[])) == "half"
+    # nova answered, and it cannot take a prefill: no continuation on claude or nova
+    assert calls == ["bedrock/us.claude", "bedrock/us.nova"]
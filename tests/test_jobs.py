@@ -0,0 +1,109 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from src.data.models import Conversation
+from src.utils import jobs
+
+
+@pytest.fixture
+def conversation(db):
+    db.save_conversation(Conversation("c1", "alice"))
+    return "c1"
+
+
+@pytest.fixture
+def live_worker():
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    yield f"{jobs.WORKER_HOST}:{process.pid}:{jobs._start_ticks(process.pid)}"
+    process.kill()
+    process.wait()
+
+
+@pytest.fixture
+def dead_worker():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    worker = f"{jobs.WORKER_HOST}:{process.pid}:{jobs._start_ticks(process.pid) or 1}"
+    process.wait()
+    return worker
+
+
+def status(db, job_id):
+    return db.get_job(job_id)["status"]
+
+
+def test_sweep_interrupts_only_jobs_of_gone_workers(db, conversation, live_worker, dead_worker):
+    db.create_job("own", conversation, jobs.WORKER)
+    db.create_job("sibling", conversation, live_worker)
+    db.create_job("dead", conversation, dead_worker)
+    db.create_job("other host", conversation, "elsewhere:1:1")
+
+    jobs.sweep_jobs(force=True)
+
+    assert [status(db, job_id) for job_id in ("own", "sibling", "dead", "other host")] == \
+        ["running", "running", "interrupted", "running"]
+
+
+def test_running_job_of_a_gone_worker_is_interrupted(db, conversation, dead_worker, monkeypatch):
+    # The periodic sweep has just run and missed it
+    monkeypatch.setattr(jobs, "SWEEP_INTERVAL", 3600)
+    jobs.sweep_jobs(force=True)
+    db.create_job("dead", conversation, dead_worker)
+
+    assert jobs.running_job(conversation) is None
+    assert status(db, "dead") == "interrupted"
+
+
+def test_running_job_of_a_live_worker_is_kept(db, conversation, live_worker):
+    db.create_job("sibling", conversation, live_worker)
+
+    assert jobs.running_job(conversation) == "sibling"
+
+
+def test_tail_ends_when_the_worker_is_gone(db, conversation, dead_worker, monkeypatch):
+    monkeypatch.setattr(jobs, "LIVENESS_INTERVAL", 0)
+    db.create_job("dead", conversation, dead_worker)
+    db.append_job_chunks("dead", 0, [{"type": "message", "role": "assistant", "content": "half"}])
+    db.flush_writes()
+
+    chunks = list(jobs.tail_job("dead"))
+
+    assert [chunk["content"] for chunk in chunks] == ["half", jobs.INTERRUPTED_NOTE]
+    assert status(db, "dead") == "interrupted"
+
+
+def test_stop_of_an_orphaned_job_interrupts_it(db, conversation, dead_worker):
+    db.create_job("dead", conversation, dead_worker)
+
+    assert jobs.cancel_job("dead")
+    assert status(db, "dead") == "interrupted"
+
+
+def last_renewed(db, job_id, seconds_ago):
+    with db.create_connection() as cursor:
+        cursor.execute("UPDATE jobs SET renewed=? WHERE id=?", (time.time() - seconds_ago, job_id))
+
+
+def test_jobs_whose_lease_ran_out_are_interrupted_on_any_host(db, conversation):
+    db.create_job("recreated container", conversation, "old-container-id:7:123")
+    db.create_job("live replica", conversation, "other-replica:7:123")
+    last_renewed(db, "recreated container", jobs.JOB_LEASE_SECONDS + 1)
+    last_renewed(db, "live replica", jobs.JOB_LEASE_SECONDS + 1)
+    db.renew_jobs(["live replica"])
+
+    jobs.sweep_jobs(force=True)
+
+    assert status(db, "recreated container") == "interrupted"
+    assert status(db, "live replica") == "running"
+
+
+def test_running_job_with_an_expired_lease_is_interrupted(db, conversation, monkeypatch):
+    monkeypatch.setattr(jobs, "SWEEP_INTERVAL", 3600)
+    jobs.sweep_jobs(force=True)
+    db.create_job("recreated container", conversation, "old-container-id:7:123")
+    last_renewed(db, "recreated container", jobs.JOB_LEASE_SECONDS + 1)
+
+    assert jobs.running_job(conversation) is None
+    assert status(db, "recreated container") == "interrupted"
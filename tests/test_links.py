@@ -0,0 +1,86 @@
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from starlette.testclient import TestClient
+
+from src.utils import file_server
+
+
+@pytest.fixture
+def files_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_server, "_secret", b"test secret")
+    monkeypatch.setattr(file_server, "FILES_ROOT", str(tmp_path))
+    (tmp_path / "alice").mkdir()
+    (tmp_path / "alice" / "report.txt").write_text("alice's report")
+    (tmp_path / "bob").mkdir()
+    (tmp_path / "bob" / "secret.txt").write_text("bob's secret")
+    return tmp_path
+
+
+@pytest.fixture
+def client(files_root):
+    return TestClient(file_server.create_app(str(files_root)))
+
+
+def link(files_root, relative):
+    return file_server.file_url(str(files_root / relative), base="")
+
+
+def test_signed_link_downloads_the_file(client, files_root):
+    response = client.get(link(files_root, "alice/report.txt"))
+
+    assert response.status_code == 200
+    assert response.text == "alice's report"
+    assert "report.txt" in response.headers["content-disposition"]
+
+
+def test_tampered_links_are_refused(client, files_root):
+    url = link(files_root, "alice/report.txt")
+
+    assert client.get(url.replace("alice/report.txt", "bob/secret.txt")).status_code == 403
+    assert client.get(url[:-1] + ("0" if url[-1] != "0" else "1")).status_code == 403
+    assert client.get("/files/alice/report.txt").status_code == 403
+
+
+def test_expired_link_is_refused(client, files_root, monkeypatch):
+    url = link(files_root, "alice/report.txt")
+    expires = int(parse_qs(urlsplit(url).query)["expires"][0])
+    monkeypatch.setattr(file_server, "time", SimpleNamespace(time=lambda: expires + 1))
+
+    assert client.get(url).status_code == 403
+
+
+def test_links_expire_on_the_hour_after_the_link_lifetime(files_root):
+    expires = int(parse_qs(urlsplit(link(files_root, "alice/report.txt")).query)["expires"][0])
+
+    assert expires % file_server.LINK_GRANULARITY == 0
+    assert 0 < expires - time.time() - file_server.LINK_SECONDS <= file_server.LINK_GRANULARITY
+    # Within the hour the same link comes out, so cached answers stay the same
+    assert link(files_root, "alice/report.txt") == link(files_root, "alice/report.txt")
+
+
+def test_paths_outside_the_root_are_not_resolved(files_root):
+    (files_root.parent / "outside.txt").write_text("outside")
+    root = str(files_root.resolve())
+
+    assert file_server._resolve(root, "alice/report.txt") == str(files_root.resolve() / "alice" / "report.txt")
+    assert file_server._resolve(root, "../outside.txt") is None
+    assert file_server._resolve(root, "alice") is None
+
+
+def test_refresh_links_signs_only_links_into_the_workspace(files_root, monkeypatch):
+    alice, bob = link(files_root, "alice/report.txt"), link(files_root, "bob/secret.txt")
+    text = f"[report]({alice}) and [secret]({bob})"
+    expires = int(parse_qs(urlsplit(alice).query)["expires"][0])
+    later = expires + 2 * file_server.LINK_GRANULARITY
+    monkeypatch.setattr(file_server, "time", SimpleNamespace(time=lambda: later))
+
+    refreshed = file_server.refresh_links(text, str(files_root / "alice"))
+
+    assert bob in refreshed
+    new_alice = refreshed.split("(", 1)[1].split(")", 1)[0]
+    assert new_alice != alice
+    query = parse_qs(urlsplit(new_alice).query)
+    assert file_server.verify("alice/report.txt", query["expires"][0], query["sig"][0])
@@ -0,0 +1,86 @@
+import pytest
+
+from src.utils import llm_cache
+from src.utils.llm_cache import CacheStats, cached_completions, request_key
+
+MESSAGES = [{"role": "user", "content": "What is 2 + 2?"}]
+
+
+@pytest.fixture(autouse=True)
+def cache_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "CACHE_FILE", str(tmp_path / "cache.db"))
+    monkeypatch.setattr(llm_cache, "_ready", False)
+
+
+def counting(answer):
+    """completions(**params) streaming answer word by word, counting its calls."""
+    def completions(**params):
+        completions.calls += 1
+        for word in answer.split():
+            yield {"choices": [{"delta": {"content": word}}]}
+    completions.calls = 0
+    return completions
+
+
+def test_key_ignores_what_does_not_change_the_request():
+    key = request_key("alice", "sonnet", 0, None, MESSAGES)
+
+    assert request_key("alice", "sonnet", 0.0, None, [{"role": "user", "content": "What is 2 + 2?  \r\n", "id": "m1"}]) == key
+    assert request_key("alice", "sonnet", 0, None, MESSAGES, max_tokens=None) == key
+    assert request_key("alice", "sonnet", 0, None, MESSAGES, max_tokens=100) != key
+    assert request_key("alice", "haiku", 0, None, MESSAGES) != key
+    assert request_key("alice", "sonnet", 0.2, None, MESSAGES) != key
+
+
+def test_key_differs_per_user():
+    assert request_key("alice", "sonnet", 0, None, MESSAGES) != request_key("bob", "sonnet", 0, None, MESSAGES)
+    assert request_key(None, "sonnet", 0, None, MESSAGES) != request_key("alice", "sonnet", 0, None, MESSAGES)
+
+
+def test_repeated_request_is_replayed():
+    completions, stats = counting("four it is"), CacheStats()
+    cached = cached_completions(completions, "alice", "sonnet", temperature=0, stats=stats)
+
+    first = list(cached(messages=MESSAGES))
+    second = list(cached(messages=MESSAGES))
+
+    assert first == second
+    assert completions.calls == 1
+    assert stats.as_dict()["llm_calls"] == 2
+    assert stats.hits == 1
+
+
+def test_answers_are_not_shared_between_users():
+    completions = counting("alice's numbers are in sales.csv")
+
+    list(cached_completions(completions, "alice", "sonnet", temperature=0)(messages=MESSAGES))
+    list(cached_completions(completions, "bob", "sonnet", temperature=0)(messages=MESSAGES))
+
+    assert completions.calls == 2
+
+
+def test_high_temperature_and_unfinished_streams_are_not_cached():
+    completions = counting("a creative answer")
+    cached = cached_completions(completions, "alice", "sonnet", temperature=0.9)
+    list(cached(messages=MESSAGES))
+    list(cached(messages=MESSAGES))
+    assert completions.calls == 2
+
+    completions = counting("one two three")
+    cached = cached_completions(completions, "alice", "sonnet", temperature=0)
+    stream = cached(messages=MESSAGES)
+    next(stream)
+    stream.close()
+    list(cached(messages=MESSAGES))
+    assert completions.calls == 2
+
+
+def test_expired_entries_are_not_used(monkeypatch):
+    completions = counting("four")
+    cached = cached_completions(completions, "alice", "sonnet", temperature=0)
+    list(cached(messages=MESSAGES))
+    monkeypatch.setattr(llm_cache, "TTL_SECONDS", -1)
+
+    list(cached(messages=MESSAGES))
+
+    assert completions.calls == 2
@@ -0,0 +1,76 @@
+import pytest
+
+from src.data.models import Chat, Conversation
+from src.utils import memory
+
+
+@pytest.fixture(autouse=True)
+def indexed_in_test(monkeypatch):
+    # recall indexes in the background; the tests index themselves so they see every chat
+    monkeypatch.setattr(memory, "schedule_index", lambda user_id: None)
+
+
+def add_conversation(db, user_id, conversation_id, contents):
+    db.save_conversation(Conversation(conversation_id, user_id))
+    ids = [db.save_chat(Chat(conversation_id, role, content))
+           for role, content in zip(("user", "assistant") * len(contents), contents)]
+    db.flush_writes()
+    return ids
+
+
+def test_recall_finds_relevant_chat_of_the_user(db, local_embeddings):
+    add_conversation(db, "alice", "c1", ["How do I group a pandas dataframe by month?",
+                                         "Use df.groupby(df.date.dt.month).sum() on the dataframe."])
+    add_conversation(db, "alice", "c2", ["Recommend a nice holiday destination", "Try the mountains in autumn."])
+    add_conversation(db, "bob", "c3", ["pandas dataframe groupby month secret of bob", "Sure."])
+    memory.index_chats("alice")
+    memory.index_chats("bob")
+
+    snippets = memory.recall("alice", "group the dataframe by month with pandas", token_budget=1000)
+
+    assert snippets
+    assert "groupby" in snippets[0]["content"] or "group a pandas" in snippets[0]["content"]
+    assert all(snippet["conversation_id"] != "c3" for snippet in snippets)
+    assert snippets == sorted(snippets, key=lambda snippet: -snippet["score"])
+
+
+def test_recall_keeps_to_the_token_budget(db, local_embeddings):
+    add_conversation(db, "alice", "c1", ["dataframe " * 100, "dataframe groupby " * 100, "dataframe merge " * 100])
+    memory.index_chats("alice")
+
+    snippets = memory.recall("alice", "dataframe", token_budget=400)
+
+    assert len(snippets) == 1
+    assert sum(len(snippet["content"]) for snippet in snippets) <= 400 * memory.CHARS_PER_TOKEN
+    assert memory.recall("alice", "dataframe", token_budget=0) == []
+
+
+def test_recall_leaves_out_excluded_messages(db, local_embeddings):
+    ids = add_conversation(db, "alice", "c1", ["plot the sales by region", "Here is the sales plot by region."])
+    memory.index_chats("alice")
+
+    snippets = memory.recall("alice", "sales by region plot", token_budget=1000, exclude=[{"id": ids[0]}])
+
+    assert [snippet["id"] for snippet in snippets] == [ids[1]]
+
+
+def test_recall_without_a_match_returns_nothing(db, local_embeddings):
+    assert memory.recall("alice", "anything", token_budget=1000) == []
+    add_conversation(db, "alice", "c1", ["xylophone quartz", "zephyr jukebox"])
+    memory.index_chats("alice")
+
+    assert memory.recall("alice", "completely unrelated words", token_budget=1000) == []
+
+
+def test_index_skips_empty_and_running_chats(db, local_embeddings):
+    ids = add_conversation(db, "alice", "c1", ["a question", ""])
+    running = add_conversation(db, "alice", "c2", ["another question", "half written answer"])[1]
+    db.create_job("job", "c2", "host:1:1", running)
+    memory.index_chats("alice")
+
+    indexed = {chat_id for chat_id, _ in db.get_embeddings("alice", memory.embedding_model())}
+
+    assert ids[0] in indexed
+    assert ids[1] not in indexed
+    assert running not in indexed
+    assert db.get_chats_by_ids([]) == {}
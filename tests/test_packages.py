@@ -0,0 +1,97 @@
+import os
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils import packages
+
+
+class Language:
+    """Stand-in for an Open Interpreter language: reads os.environ when its process starts."""
+    name = "shell"
+
+    def __init__(self, computer):
+        self.started_with = None
+
+    def start_process(self):
+        self.started_with = os.environ.get("VIRTUAL_ENV")
+
+
+def interpreter():
+    return SimpleNamespace(computer=SimpleNamespace(terminal=SimpleNamespace(languages=[Language])))
+
+
+@pytest.fixture
+def workspaces(tmp_path, monkeypatch):
+    # The venv is not built here, only the layout and environment are looked at
+    monkeypatch.setattr(packages, "_prepare", lambda workspace_dir, user_id: None)
+    monkeypatch.setattr(packages, "_prepared", set())
+    monkeypatch.setattr(packages, "SHARED_RECORD_FILE", str(tmp_path / "shared.json"))
+    monkeypatch.delenv("VIRTUAL_ENV", raising=False)
+    return str(tmp_path / "alice"), str(tmp_path / "bob")
+
+
+def test_languages_start_in_their_users_environment(workspaces):
+    alice, bob = workspaces
+    alice_interpreter, bob_interpreter = interpreter(), interpreter()
+    packages.use_environment(alice_interpreter, alice, "alice")
+    packages.use_environment(bob_interpreter, bob, "bob")
+
+    alice_language = alice_interpreter.computer.terminal.languages[0](None)
+    bob_language = bob_interpreter.computer.terminal.languages[0](None)
+    alice_language.start_process()
+    bob_language.start_process()
+
+    assert alice_language.started_with == os.path.join(os.path.abspath(alice), ".packages", packages.VENV_NAME)
+    assert bob_language.started_with.startswith(os.path.abspath(bob))
+    assert alice_interpreter.computer.terminal.languages[0].name == "shell"
+    # The worker's own environment is left as it was
+    assert "VIRTUAL_ENV" not in os.environ
+    assert os.path.isdir(packages._venv_site_packages(alice))
+
+
+def test_binding_again_does_not_stack(workspaces):
+    alice, _ = workspaces
+    bound = interpreter()
+
+    packages.use_environment(bound, alice)
+    first = bound.computer.terminal.languages[0]
+    packages.use_environment(bound, alice)
+
+    assert bound.computer.terminal.languages[0] is first
+    assert first.pipka_language is Language
+
+
+def test_packages_in_a_users_venv_are_only_theirs(workspaces):
+    alice, bob = workspaces
+    site = packages._venv_site_packages(alice)
+    os.makedirs(os.path.join(site, "pipka_test_package-1.0.dist-info"))
+    with open(os.path.join(site, "pipka_test_package-1.0.dist-info", "METADATA"), "w") as f:
+        f.write("Metadata-Version: 2.1\nName: pipka_test_package\nVersion: 1.0\n")
+
+    assert packages.installed_packages(alice)["pipka-test-package"] == "1.0"
+    assert "pipka-test-package" not in packages.installed_packages(bob)
+
+
+def test_record_is_kept_in_the_users_workspace(workspaces, monkeypatch):
+    alice, bob = workspaces
+    monkeypatch.setattr(packages, "_cache_wheels", lambda workspace_dir, requirements: None)
+    installed = [{}]
+    monkeypatch.setattr(packages, "installed_packages", lambda workspace_dir: dict(installed[0]))
+
+    recorder = packages.PackageRecorder("alice", alice)
+    installed[0] = {"tabulate": "0.9.0"}
+    recorder.close()
+
+    assert packages._load_record(alice, "alice") == {"tabulate": "0.9.0"}
+    assert packages._load_record(bob, "bob") == {}
+
+
+def test_record_of_the_shared_environment_is_taken_over(workspaces):
+    alice, bob = workspaces
+    with open(packages.SHARED_RECORD_FILE, "w") as f:
+        json.dump({"alice": {"tabulate": "0.9.0"}}, f)
+
+    assert packages._load_record(alice, "alice") == {"tabulate": "0.9.0"}
+    assert packages._load_record(bob, "bob") == {}
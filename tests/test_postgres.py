@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.data.models import Chat, Conversation
+
+
+@pytest.fixture
+def db(postgres_db):
+    return postgres_db
+
+
+def test_conversations_and_chats(db):
+    db.save_conversation(Conversation("c1", "alice", "First"))
+    first = db.save_chat(Chat("c1", "user", "What is in sales.csv?"))
+    answer = db.save_chat(Chat("c1", "assistant", ""))
+    db.update_chat_content(answer, "It has " + "many rows " * 1000)
+    db.flush_writes()
+
+    assert db.get_all_conversations("alice") == [{"id": "c1", "user_id": "alice", "name": "First"}]
+    chats = db.get_chats_by_conversation_id("c1")
+    assert [chat["id"] for chat in chats] == [first, answer]
+    assert chats[1]["content"].startswith("It has many rows")
+    assert db.get_chats_by_ids([answer])[answer]["role"] == "assistant"
+
+    db.delete_conversation("c1")
+    assert db.get_all_conversations("alice") == []
+
+
+def test_search_is_per_user(db):
+    db.save_conversation(Conversation("c1", "alice"))
+    db.save_conversation(Conversation("c2", "bob"))
+    db.save_chat(Chat("c1", "user", "plot the quarterly revenue"))
+    db.save_chat(Chat("c2", "user", "plot the quarterly revenue of bob"))
+    db.flush_writes()
+
+    results = db.search_chats("alice", "quarterly reven")
+
+    assert [result["conversation_id"] for result in results] == ["c1"]
+    assert db.search_chats("alice", "nothing like it") == []
+
+
+def test_embeddings_and_summaries(db):
+    db.save_conversation(Conversation("c1", "alice"))
+    chat_id = db.save_chat(Chat("c1", "user", "remember this"))
+    db.flush_writes()
+    vector = np.arange(4, dtype=np.float32).tobytes()
+
+    assert [row[0] for row in db.get_chats_without_embedding("alice", "model")] == [chat_id]
+    db.save_embeddings("model", [(chat_id, vector)])
+    assert db.get_chats_without_embedding("alice", "model") == []
+    assert [(row[0], bytes(row[1])) for row in db.get_embeddings("alice", "model")] == [(chat_id, vector)]
+
+    db.save_summary("c1", "a summary", 3)
+    db.save_summary("c1", "a newer summary", 5)
+    assert db.get_summary("c1") == ("a newer summary", 5)
+
+
+def test_jobs(db):
+    db.save_conversation(Conversation("c1", "alice"))
+    db.create_job("j1", "c1", "pipka_1:10:100")
+    db.create_job("j2", "c1", "pipka_10:10:100")
+    db.append_job_chunks("j1", 0, [{"content": "a"}, {"content": "b"}])
+    db.flush_writes()
+
+    assert db.get_running_job("c1") in ("j1", "j2")
+    assert [chunk for _, chunk in db.get_job_chunks("j1", 0)] == [{"content": "b"}]
+    assert db.get_running_workers("pipka_1") == ["pipka_1:10:100"]
+    db.request_job_cancel("j1")
+    assert db.is_job_cancel_requested("j1")
+
+    db.interrupt_jobs(["pipka_1:10:100"])
+    assert db.get_job("j1")["status"] == "interrupted"
+    db.interrupt_expired_jobs(time.time() + 1)
+    assert db.get_job("j2")["status"] == "interrupted"
+
+    db.finish_job("j1", "done")
+    db.flush_writes()
+    db.delete_finished_jobs(time.time() + 1)
+    assert db.get_job("j1") is None
+
+
+def test_compact_database_is_sqlite_only(db):
+    with pytest.raises(RuntimeError):
+        db.compact_database()
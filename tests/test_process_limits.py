@@ -0,0 +1,71 @@
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils import jobs
+from src.utils.kernels import kernel_processes
+from src.utils.process_limits import cpu_snapshot, turn_usage
+
+BUSY = "import time\nend = time.process_time() + 30\nwhile time.process_time() < end: pass"
+
+
+@pytest.fixture
+def busy():
+    process = subprocess.Popen([sys.executable, "-c", BUSY])
+    yield process
+    process.kill()
+    process.wait()
+
+
+def interpreter_with(*languages):
+    terminal = SimpleNamespace(_active_languages={str(i): language for i, language in enumerate(languages)})
+    return SimpleNamespace(computer=SimpleNamespace(terminal=terminal))
+
+
+def test_cpu_counts_from_the_start_of_the_turn(busy):
+    time.sleep(0.5)
+    baseline, last = cpu_snapshot([busy.pid]), {}
+
+    cpu, memory = turn_usage([busy.pid], baseline, last)
+
+    assert cpu < 0.3
+    assert memory > 0
+    time.sleep(0.5)
+    cpu, _ = turn_usage([busy.pid], baseline, last)
+    assert 0.2 < cpu < 1.0
+
+
+def test_cpu_of_exited_processes_still_counts(busy):
+    last = {}
+    time.sleep(0.5)
+    turn_usage([busy.pid], {}, last)
+    busy.kill()
+    busy.wait()
+
+    cpu, memory = turn_usage([busy.pid], {}, last)
+
+    assert cpu > 0.2
+    assert memory == 0
+
+
+def test_kernel_processes_leave_out_languages_without_a_process(busy):
+    language = SimpleNamespace(process=SimpleNamespace(pid=busy.pid))
+
+    assert kernel_processes(interpreter_with(language)) == [busy.pid]
+    assert kernel_processes(interpreter_with(SimpleNamespace())) == []
+
+
+def test_watchdog_stops_a_turn_over_its_cpu_limit(busy, monkeypatch):
+    monkeypatch.setattr(jobs, "WATCHDOG_INTERVAL", 0.1)
+    monkeypatch.setattr(jobs, "is_job_cancel_requested", lambda job_id: False)
+    cancel, stopped = threading.Event(), []
+    monkeypatch.setattr(jobs, "cancel_job", lambda job_id, reason=None: stopped.append(reason) or cancel.set())
+    interpreter = interpreter_with(SimpleNamespace(process=SimpleNamespace(pid=busy.pid)))
+
+    jobs._watchdog("job", cancel, interpreter, jobs.ExecutionLimits(cpu_seconds=0.5))
+
+    assert stopped == ["CPU limit of 0.5 s reached"]
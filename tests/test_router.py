@@ -0,0 +1,128 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils import router
+
+MODELS = {
+    "haiku": {"tier": "small", "max_output_tokens": 4096, "capabilities": ["tools"], "cost": {"input": 1, "output": 5}},
+    "nova-lite": {"tier": "small", "max_output_tokens": 5000, "capabilities": [], "cost": {"input": 0.1, "output": 0.4}},
+    "sonnet": {"tier": "medium", "max_output_tokens": 8192, "capabilities": ["tools", "reasoning"], "cost": {"input": 3, "output": 15}},
+    "opus": {"tier": "large", "max_output_tokens": 32000, "capabilities": ["tools", "reasoning"], "cost": {"input": 15, "output": 75}},
+}
+
+
+@pytest.fixture(autouse=True)
+def models(monkeypatch):
+    monkeypatch.setattr(router, "_config", {"bedrock": MODELS, "services": {}})
+    monkeypatch.setattr(router, "_health", {})
+
+
+class Throttled(Exception):
+    pass
+
+
+def completions_failing(failures, calls):
+    """completions(**params) that raises failures[model] for the listed models and streams two chunks otherwise."""
+    def completions(**params):
+        calls.append(params)
+        model = params["model"].split(".", 1)[1]
+        if model in failures:
+            raise failures[model]
+        yield f"{model} 1"
+        yield f"{model} 2"
+    return completions
+
+
+def test_tier_follows_the_prompt():
+    assert router.estimate_tier("hi there") == "small"
+    assert router.estimate_tier("write a script to plot this csv") == "medium"
+    assert router.estimate_tier("debug this traceback: " + "x" * 2000) == "large"
+    assert router.estimate_tier("hi there", history_chars=20000) == "medium"
+
+
+def test_auto_starts_at_the_tier_then_escalates_then_falls_back():
+    # Cheaper first within a tier
+    assert router.candidates(router.AUTO_MODEL, "hi") == ["nova-lite", "haiku", "sonnet", "opus"]
+    assert router.candidates(router.AUTO_MODEL, "write a script to plot this csv") == ["sonnet", "opus", "nova-lite", "haiku"]
+
+
+def test_chosen_model_leads_and_needs_filter_the_fallbacks():
+    assert router.candidates("haiku") == ["haiku", "nova-lite", "sonnet", "opus"]
+    assert router.candidates("sonnet", needs=("reasoning",)) == ["sonnet", "opus"]
+    # Not configured: routed as the largest tier
+    assert router.candidates("unknown") == ["opus", "sonnet", "nova-lite", "haiku"]
+    assert router.candidates(router.AUTO_MODEL, needs=("vision",)) == []
+
+
+def test_throttled_model_goes_behind_healthy_ones():
+    router.record_failure("sonnet", retryable=True)
+
+    assert router.candidates("sonnet") == ["opus", "nova-lite", "haiku", "sonnet"]
+    assert router.health_report()["sonnet"]["blocked"]
+
+
+def test_cooldown_doubles_up_to_the_limit_and_clears_on_success(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(router, "time", SimpleNamespace(time=lambda: now[0], monotonic=time.monotonic))
+    health = router._stats("sonnet")
+
+    for expected in (30, 60, 120, 240, 300, 300):
+        router.record_failure("sonnet", retryable=True)
+        assert health.cooldown == expected
+    assert health.blocked_until == now[0] + 300
+
+    router.record_failure("haiku", retryable=False)
+    assert router._stats("haiku").blocked_until == 0
+    router.record_success("sonnet", 0.5)
+    assert health.cooldown == 0
+    now[0] += 301
+    assert not router.health_report()["sonnet"]["blocked"]
+
+
+def test_retryable_errors():
+    assert router.is_retryable(Throttled("ThrottlingException: Too many requests"))
+    assert router.is_retryable(TimeoutError("timed out"))
+    assert router.is_retryable(Exception("Error code: 503"))
+    assert not router.is_retryable(ValueError("Input is too long for requested model"))
+
+
+def test_routed_falls_back_on_throttling_before_the_first_chunk():
+    calls = []
+    completions = completions_failing({"sonnet": Throttled("ThrottlingException")}, calls)
+
+    chunks = list(router.routed_completions(completions, ["sonnet", "opus"], max_tokens=20000)(messages=[]))
+
+    assert chunks == ["opus 1", "opus 2"]
+    assert [(call["model"], call["max_tokens"]) for call in calls] == \
+        [("bedrock/us.sonnet", 8192), ("bedrock/us.opus", 20000)]
+    assert router._stats("sonnet").blocked_until > 0
+    assert router.health_report()["opus"]["error_rate"] == 0
+
+
+def test_routed_raises_errors_that_are_the_requests_fault():
+    calls = []
+    completions = completions_failing({"sonnet": ValueError("malformed request")}, calls)
+
+    with pytest.raises(ValueError):
+        list(router.routed_completions(completions, ["sonnet", "opus"])(messages=[]))
+    assert len(calls) == 1
+
+
+def test_routed_does_not_switch_models_mid_answer():
+    def completions(**params):
+        yield "half"
+        raise Throttled("ThrottlingException")
+
+    with pytest.raises(Throttled):
+        list(router.routed_completions(completions, ["sonnet", "opus"])(messages=[]))
+
+
+def test_routed_admits_every_attempt():
+    admitted = []
+    completions = completions_failing({"sonnet": Throttled("throttled")}, [])
+
+    list(router.routed_completions(completions, ["sonnet", "opus"], admit=lambda model, params: admitted.append(model))())
+
+    assert admitted == ["sonnet", "opus"]
@@ -0,0 +1,80 @@
+import pytest
+
+from src.data.models import Chat, Conversation
+
+
+@pytest.fixture
+def chats(db):
+    db.save_conversation(Conversation("c1", "alice", "Sales"))
+    db.save_conversation(Conversation("c2", "alice", "Plots"))
+    db.save_conversation(Conversation("c3", "bob", "Bob's"))
+    ids = {
+        "sales": db.save_chat(Chat("c1", "user", "Summarize the quarterly sales by region")),
+        "plot": db.save_chat(Chat("c2", "assistant", "The histogram of sales is below: data:image/png;base64,iVBORw0KGgo=")),
+        "bob": db.save_chat(Chat("c3", "user", "Bob's quarterly sales numbers")),
+    }
+    db.flush_writes()
+    return ids
+
+
+def found(db, query, user_id="alice"):
+    return [result["chat_id"] for result in db.search_chats(user_id, query)]
+
+
+def test_search_finds_only_the_users_own_chats(db, chats):
+    results = db.search_chats("alice", "quarterly")
+
+    assert [result["chat_id"] for result in results] == [chats["sales"]]
+    assert results[0]["conversation_id"] == "c1"
+    assert results[0]["conversation_name"] == "Sales"
+    assert results[0]["role"] == "user"
+    assert found(db, "quarterly", "bob") == [chats["bob"]]
+
+
+def test_last_word_matches_as_a_prefix(db, chats):
+    assert found(db, "quart") == [chats["sales"]]
+    assert found(db, "quart region") == []
+    assert found(db, "region quart") == [chats["sales"]]
+
+
+def test_every_word_must_match(db, chats):
+    assert sorted(found(db, "sales")) == sorted([chats["plot"], chats["sales"]])
+    assert found(db, "sales histogram") == [chats["plot"]]
+
+
+def test_inline_images_are_not_indexed(db, chats):
+    assert found(db, "iVBORw0KGgo") == []
+    assert found(db, "image") == [chats["plot"]]
+    assert "[image]" in db.search_chats("alice", "histogram")[0]["snippet"]
+
+
+def test_query_syntax_in_user_input_is_taken_literally(db, chats):
+    assert found(db, 'sales" OR "bob') == []
+    assert found(db, "region*") == [chats["sales"]]
+    assert found(db, '"') == []
+    assert found(db, "   ") == []
+
+
+def test_edited_and_deleted_chats_are_searched_as_they_are_now(db, chats):
+    db.update_chat_content(chats["sales"], "Monthly revenue by region")
+    db.flush_writes()
+
+    assert found(db, "quarterly") == []
+    assert found(db, "monthly") == [chats["sales"]]
+    assert db.search_chats("alice", "monthly")[0]["snippet"] == "**Monthly** revenue by region"
+    with db.create_connection() as cursor:
+        cursor.execute("DELETE FROM chats WHERE conversation_id='c1'")
+    assert found(db, "monthly") == []
+
+
+def test_snippet_shows_the_words_around_the_match(db):
+    db.save_conversation(Conversation("c1", "alice"))
+    filler = " ".join(f"word{i}" for i in range(40))
+    db.save_chat(Chat("c1", "assistant", f"{filler} the needle is here {filler}"))
+    db.flush_writes()
+
+    snippet = db.search_chats("alice", "needle")[0]["snippet"]
+
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert "word39 the **needle** is here word0" in snippet
+    assert len(snippet.split()) == db.SNIPPET_WORDS
@@ -0,0 +1,56 @@
+import pytest
+
+from src.data.models import Conversation
+from src.utils import summaries as summaries_module
+
+
+@pytest.fixture
+def summaries(db, monkeypatch):
+    monkeypatch.setattr(summaries_module, "SUMMARY_TRIGGER_TOKENS", 100)
+    return summaries_module
+
+
+@pytest.fixture
+def scheduled(summaries, monkeypatch):
+    """Summaries compact_history asks for, as (function, arguments...); none is made."""
+    calls = []
+    monkeypatch.setattr(summaries._executor, "submit", lambda *args: calls.append(args))
+    return calls
+
+
+def history(pairs):
+    return [message for i in range(pairs) for message in (
+        {"role": "user", "type": "message", "content": f"question {i} " + "x" * 100},
+        {"role": "assistant", "type": "message", "content": f"answer {i} " + "y" * 100},
+    )]
+
+
+def test_short_history_is_kept_verbatim(summaries, scheduled):
+    messages = history(1)
+
+    assert summaries.compact_history("c1", messages) == messages
+    assert scheduled == []
+
+
+def test_long_history_waits_for_the_summary(summaries, scheduled):
+    messages = history(6)
+
+    # No summary yet: nothing is dropped, one is made in the background
+    assert summaries.compact_history("c1", messages) == messages
+    assert len(scheduled) == 1
+    _, _, previous, folded, covered_until, _ = scheduled[0]
+    assert previous == ''
+    assert folded == messages[:covered_until]
+    assert messages[covered_until]["role"] == "user"
+    assert len(messages) - covered_until == summaries.KEEP_RECENT_MESSAGES
+
+
+def test_long_history_starts_with_the_summary(db, summaries, scheduled):
+    messages = history(6)
+    db.save_conversation(Conversation("c1", "alice"))
+    db.save_summary("c1", "- the user asked six questions", 4)
+
+    compacted = summaries.compact_history("c1", messages)
+
+    assert "the user asked six questions" in compacted[0]["content"]
+    assert compacted[1:] == messages[4:]
@@ -0,0 +1,146 @@
+import os
+
+import pytest
+from starlette.testclient import TestClient
+
+from src.utils import file_server, uploads, workspace
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def files_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_server, "_secret", b"test secret")
+    (tmp_path / "alice").mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def client(files_root):
+    return TestClient(file_server.create_app(str(files_root)))
+
+
+@pytest.fixture
+def token(files_root):
+    return file_server.space_token(str(files_root / "alice"))
+
+
+def put(client, token, data, offset, total, upload_id="upload-0001", name="data.txt"):
+    return client.put(f"/uploads/{upload_id}", params={"token": token, "name": name, "offset": offset, "total": total},
+                      content=data)
+
+
+def test_chunk_past_the_declared_total_is_refused(client, token, files_root):
+    response = put(client, token, b"x" * 20, 0, 10)
+
+    assert response.status_code == 413
+    assert not (files_root / "alice" / "data.txt").exists()
+    assert client.get("/uploads/upload-0001", params={"token": token}).json() == {"offset": 0}
+
+
+def test_chunk_larger_than_the_cap_is_refused(client, token, monkeypatch):
+    monkeypatch.setattr(file_server, "MAX_CHUNK_SIZE", 8)
+
+    assert put(client, token, b"x" * 9, 0, 100).status_code == 413
+    # Without a content-length the stream itself is cut off, and nothing of it kept
+    assert put(client, token, iter([b"x" * 5, b"x" * 5]), 0, 100).status_code == 413
+    assert put(client, token, b"x" * 8, 0, 100).json() == {"offset": 8}
+
+
+def test_quota_counts_the_chunks_already_received(client, token, monkeypatch):
+    monkeypatch.setattr(workspace, "SOFT_QUOTA_MB", 0)
+    monkeypatch.setattr(workspace, "HARD_QUOTA_MB", 2)
+    assert put(client, token, bytes(MB // 2), 0, 3 * MB // 2).json() == {"offset": MB // 2}
+    # Grows the part file in place, its directory does not change
+    assert put(client, token, bytes(MB // 2), MB // 2, 3 * MB // 2).json() == {"offset": MB}
+
+    response = put(client, token, b"", 0, 5 * MB // 4, upload_id="upload-0002")
+
+    assert response.status_code == 507
+    assert "quota" in response.json()["error"]
+
+
+def test_quota_is_checked_on_every_chunk(client, token, files_root, monkeypatch):
+    monkeypatch.setattr(workspace, "SOFT_QUOTA_MB", 0)
+    monkeypatch.setattr(workspace, "HARD_QUOTA_MB", 2)
+    assert put(client, token, bytes(MB), 0, 2 * MB).json() == {"offset": MB}
+    # Meanwhile the workspace filled up
+    (files_root / "alice" / "other.bin").write_bytes(bytes(MB // 2))
+
+    assert put(client, token, bytes(MB), MB, 2 * MB).status_code == 507
+
+
+def test_empty_file_is_stored(client, token, files_root):
+    response = put(client, token, b"", 0, 0)
+
+    assert response.json()["done"]
+    assert (files_root / "alice" / "data.txt").read_bytes() == b""
+
+
+def test_eviction_makes_room_for_an_upload(client, token, files_root, monkeypatch):
+    monkeypatch.setattr(workspace, "SOFT_QUOTA_MB", 1)
+    monkeypatch.setattr(workspace, "HARD_QUOTA_MB", 2)
+    canvas = files_root / "alice" / f"{workspace.CANVAS_PREFIX}1"
+    canvas.mkdir()
+    (canvas / "tile.png").write_bytes(bytes(MB))
+
+    response = put(client, token, bytes(MB // 2), 0, MB // 2)
+
+    assert response.json()["done"]
+    assert not canvas.exists()
+    assert uploads.upload_offset(str(files_root / "alice"), "upload-0001") == 0
+
+
+def test_upload_resumes_from_the_offset_the_server_has(client, token, files_root):
+    assert put(client, token, b"hello ", 0, 11).json() == {"offset": 6}
+    # A retried chunk at an old offset is refused, the client asks where to go on
+    assert put(client, token, b"hello ", 0, 11).status_code == 409
+    offset = client.get("/uploads/upload-0001", params={"token": token}).json()["offset"]
+
+    response = put(client, token, b"world", offset, 11)
+
+    assert response.json() == {"offset": 11, "done": True, "status": "stored", "duplicate_of": None}
+    assert (files_root / "alice" / "data.txt").read_bytes() == b"hello world"
+
+
+def test_hash_is_rebuilt_after_a_restart(client, token, files_root):
+    put(client, token, b"hello ", 0, 11)
+    uploads._hashers.clear()
+
+    put(client, token, b"world", 6, 11)
+
+    assert uploads._load_index(str(files_root / "alice")) == {
+        "b94d27b9934d3e08a52e52d7da7dabfac484efe37a5380ee9088f7ace2efcde9": "data.txt"}
+
+
+def test_identical_content_is_reported(client, token, files_root):
+    put(client, token, b"same", 0, 4)
+
+    again = put(client, token, b"same", 0, 4, upload_id="upload-0002")
+    copy = put(client, token, b"same", 0, 4, upload_id="upload-0003", name="copy.txt")
+
+    assert again.json()["status"] == "unchanged"
+    assert copy.json()["status"] == "stored"
+    assert copy.json()["duplicate_of"] == "data.txt"
+    assert (files_root / "alice" / "copy.txt").read_bytes() == b"same"
+
+
+def test_store_file_skips_identical_content(tmp_path):
+    with open(tmp_path / "in.txt", "wb") as f:
+        f.write(b"content")
+
+    with open(tmp_path / "in.txt", "rb") as f:
+        first = uploads.store_file(str(tmp_path), f, "out.txt")
+    with open(tmp_path / "in.txt", "rb") as f:
+        second = uploads.store_file(str(tmp_path), f, "out.txt")
+
+    assert (first, second) == (("stored", None), ("unchanged", None))
+    assert os.listdir(tmp_path / ".uploads") == ["index.json"]
+
+
+def test_upload_token_of_another_workspace_is_refused(client, files_root):
+    (files_root / "bob").mkdir()
+    space, expires, _ = file_server.space_token(str(files_root / "bob")).rsplit(".", 2)
+    forged = f"{space}.{expires}.{file_server.sign('space:alice', expires)}"
+
+    assert put(client, forged, b"x", 0, 1).status_code == 403
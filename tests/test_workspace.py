@@ -0,0 +1,85 @@
+import os
+import time
+
+import pytest
+
+from src.utils import workspace
+from src.utils.workspace import QuotaExceeded, disk_usage, enforce_quota, evict, touch_artifact
+
+KB = 1024
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path)
+
+
+def write(root, relative, size, age=0):
+    path = os.path.join(root, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(bytes(size))
+    if age:
+        then = time.time() - age
+        os.utime(path, (then, then))
+        os.utime(os.path.dirname(path), (then, then))
+    return path
+
+
+def test_usage_follows_added_and_removed_files(root):
+    write(root, "a.txt", KB)
+    write(root, "sub/b.txt", 2 * KB)
+    assert disk_usage(root) == 3 * KB
+
+    os.remove(os.path.join(root, "sub/b.txt"))
+    write(root, "c.txt", KB)
+
+    assert disk_usage(root) == 2 * KB
+
+
+def test_file_grown_in_place_is_counted_once_reported(root):
+    path = write(root, "upload.part", KB)
+    assert disk_usage(root) == KB
+    with open(path, "ab") as f:
+        f.write(bytes(KB))
+
+    workspace.update_file_usage(root, path)
+
+    assert disk_usage(root) == 2 * KB
+
+
+def test_eviction_takes_least_recently_used_artifacts_first(root):
+    write(root, f"{workspace.CANVAS_PREFIX}old/out.png", 4 * KB, age=300)
+    write(root, f"{workspace.CANVAS_PREFIX}new/out.png", 4 * KB, age=200)
+    write(root, ".profiles/data.json", 4 * KB, age=100)
+    write(root, "notes.txt", 4 * KB, age=400)
+    # Used just now, so the new canvas outlives the profile
+    touch_artifact(root, f"{workspace.CANVAS_PREFIX}new")
+
+    freed = evict(root, 12 * KB)
+
+    assert freed == 8 * KB
+    assert sorted(os.listdir(root)) == [".access.json", ".profiles", "notes.txt", f"{workspace.CANVAS_PREFIX}new"]
+    assert os.listdir(os.path.join(root, ".profiles")) == []
+
+
+def test_user_files_and_fresh_uploads_are_never_evicted(root):
+    write(root, "notes.txt", 4 * KB, age=10 ** 6)
+    write(root, ".uploads/fresh.part", 4 * KB)
+    stale = write(root, ".uploads/stale.part", 4 * KB, age=workspace.STALE_UPLOAD_SECONDS + 60)
+
+    assert evict(root, 0) == 4 * KB
+    assert not os.path.exists(stale)
+    assert disk_usage(root) == 8 * KB
+
+
+def test_quota_evicts_down_to_the_soft_limit_and_refuses_above_the_hard_one(root, monkeypatch):
+    monkeypatch.setattr(workspace, "SOFT_QUOTA_MB", 1)
+    monkeypatch.setattr(workspace, "HARD_QUOTA_MB", 2)
+    write(root, f"{workspace.CANVAS_PREFIX}1/out.png", 1024 * KB)
+    write(root, "data.bin", 512 * KB)
+
+    assert enforce_quota(root, 256 * KB) == 512 * KB
+    assert not os.path.exists(os.path.join(root, f"{workspace.CANVAS_PREFIX}1"))
+    with pytest.raises(QuotaExceeded):
+        enforce_quota(root, 2048 * KB)
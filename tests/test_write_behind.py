@@ -0,0 +1,96 @@
+import sqlite3
+
+import pytest
+
+from src.data import write_behind
+from src.data.write_behind import WriteBehind
+
+
+class FlakyBackend:
+    """SQLite backend whose first connects fail, like a database that is restarting."""
+
+    def __init__(self, path, failures):
+        self.path = path
+        self.failures = failures
+
+    def connect(self):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("unable to open database file")
+        return sqlite3.connect(self.path)
+
+    def release(self, connection):
+        connection.close()
+
+
+def insert(cursor, value):
+    cursor.execute("INSERT INTO items VALUES (?)", (value,))
+
+
+def stored(path):
+    with sqlite3.connect(path) as connection:
+        return [value for value, in connection.execute("SELECT value FROM items ORDER BY rowid")]
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    monkeypatch.setattr(write_behind, "RETRY_DELAY", 0.01)
+    path = str(tmp_path / "items.db")
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE items (value TEXT UNIQUE)")
+    return path
+
+
+def test_writes_wait_for_the_database_to_come_back(path):
+    backend = FlakyBackend(path, failures=3)
+    writer = WriteBehind(lambda: backend)
+
+    writer.submit(insert, "a")
+    writer.submit(insert, "b")
+
+    assert writer.flush(5)
+    assert stored(path) == ["a", "b"]
+    assert writer._thread.is_alive()
+
+
+def test_failing_factory_does_not_stop_the_writer(path):
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("no backend yet")
+        return FlakyBackend(path, failures=0)
+
+    writer = WriteBehind(factory)
+    writer.submit(insert, "a")
+
+    assert writer.flush(5)
+    assert stored(path) == ["a"]
+
+
+def test_bad_write_is_dropped_alone(path):
+    writer = WriteBehind(lambda: FlakyBackend(path, failures=0))
+
+    for value in ("a", "a", "b"):
+        writer.submit(insert, value)
+
+    assert writer.flush(5)
+    assert stored(path) == ["a", "b"]
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_dead_writer_thread_is_started_again(path):
+    writer = WriteBehind(lambda: FlakyBackend(path, failures=0))
+
+    def crash(cursor):
+        raise SystemExit
+
+    writer.submit(crash)
+    writer._thread.join(5)
+    assert not writer._thread.is_alive()
+
+    writer.submit(insert, "a")
+
+    assert writer.flush(5)
+    assert stored(path) == ["a"]